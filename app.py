@@ -1,6 +1,9 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session
+from flask import Flask, Response, g, render_template, request, jsonify, redirect, url_for, session, stream_with_context
 from dotenv import load_dotenv
-from azure.storage.blob import BlobServiceClient, generate_blob_sas, BlobSasPermissions
+from azure.storage.blob import BlobServiceClient
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceNotFoundError, ResourceModifiedError
+from itsdangerous import URLSafeTimedSerializer, BadSignature
 import os
 import requests
 import datetime
@@ -8,12 +11,35 @@ from functools import wraps
 from datetime import timedelta
 import re
 import io
-from docx import Document
-from docx.shared import RGBColor
-from docx.enum.text import WD_COLOR_INDEX
-import fitz  # PyMuPDF for PDF processing
-import tempfile
+from blob_metadata import BlobMetadataCache
+from blob_transfer import DocumentBuffer, MemoryBudget, download_into, upload_from
+from cache import TTLCache
+from result_cache import ResultCache, SqliteResultStore
+from sas import SasUrlIssuer
+from source_cache import CachedSource, SourceCache
+from pdf_word_index import PdfWordIndex, build_pdf_word_index
+from page_preview import convert_to_pdf, document_layout, render_page
+from highlight_pool import HighlightPool, PoolSaturatedError
+from singleflight import SingleFlight
+from local_search import LocalSearchBackend
+from search_client import AzureSearchClient, CircuitBreaker, CircuitOpenError
+from metrics import SlowRequestProfiler, count, observe_request, render_prometheus, stage, start_request
+from highlighter import (
+    PDF_HIGHLIGHT_CSS_COLORS, extract_snippets, find_pdf_overlay, highlight_keywords, highlight_docx, highlight_pdf,
+    normalize_keywords
+)
 import json
+import math
+import shutil
+import time
+import hashlib
+import multiprocessing
+import threading
+import contextvars
+import struct
+import tempfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
 
 # Load environment variables
 load_dotenv()
@@ -27,19 +53,263 @@ AZURE_STORAGE_CONNECTION_STRING = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
 CONTAINER_NAME = os.getenv("CONTAINER_NAME")
 ACCOUNT_KEY = os.getenv("ACCOUNT_KEY")
 
+# Interactive debugger for the development server (`python app.py`); never set in production
+FLASK_DEBUG = os.getenv("FLASK_DEBUG", "false").lower() == "true"
+
+# 'azure' for Azure Cognitive Search, 'local' for the in-process index over
+# LOCAL_SEARCH_ROOT (development, load tests), saved to LOCAL_SEARCH_INDEX_PATH
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "azure").lower()
+LOCAL_SEARCH_ROOT = os.getenv("LOCAL_SEARCH_ROOT", "documents")
+LOCAL_SEARCH_INDEX_PATH = os.getenv("LOCAL_SEARCH_INDEX_PATH", "local_search_index.pickle")
+
+# Azure Search HTTP client: connection pool, timeouts, retries, circuit breaker
+SEARCH_POOL_SIZE = int(os.getenv("SEARCH_POOL_SIZE", "20"))
+SEARCH_CONNECT_TIMEOUT_SECONDS = float(os.getenv("SEARCH_CONNECT_TIMEOUT_SECONDS", "3.05"))
+SEARCH_READ_TIMEOUT_SECONDS = float(os.getenv("SEARCH_READ_TIMEOUT_SECONDS", "15"))
+SEARCH_MAX_RETRIES = int(os.getenv("SEARCH_MAX_RETRIES", "3"))
+SEARCH_BREAKER_FAILURE_THRESHOLD = int(os.getenv("SEARCH_BREAKER_FAILURE_THRESHOLD", "5"))
+SEARCH_BREAKER_RESET_SECONDS = float(os.getenv("SEARCH_BREAKER_RESET_SECONDS", "30"))
+
+# Paging limits for /search
+SEARCH_MAX_TOP = int(os.getenv("SEARCH_MAX_TOP", "50"))
+SEARCH_MAX_SKIP = int(os.getenv("SEARCH_MAX_SKIP", "1000"))
+
+# Hits carry passages around matches instead of the full document text:
+# 'azure' uses Azure Search highlights, 'local' extracts them from the
+# content here, 'off' returns full content. Full text is fetched on demand.
+SNIPPET_MODE = os.getenv("SNIPPET_MODE", "azure").lower()
+SNIPPET_WINDOW_CHARS = int(os.getenv("SNIPPET_WINDOW_CHARS", "200"))
+SNIPPET_MAX_FRAGMENTS = int(os.getenv("SNIPPET_MAX_FRAGMENTS", "3"))
+SNIPPET_RESPONSE_MAX_BYTES = int(os.getenv("SNIPPET_RESPONSE_MAX_BYTES", str(256 * 1024)))
+
+# Enriched results per (user filter, query, top, skip); RESULT_CACHE_SQLITE_PATH
+# shares them between worker processes on the same host
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+RESULT_CACHE_TTL_SECONDS = int(os.getenv("RESULT_CACHE_TTL_SECONDS", "60"))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1000"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 ** 2)))
+RESULT_CACHE_SQLITE_PATH = os.getenv("RESULT_CACHE_SQLITE_PATH")
+
+# Concurrent identical searches and highlight jobs share one execution. Lock files in
+# SINGLEFLIGHT_LOCK_DIR extend that across worker processes; unset, each process coalesces its own
+SINGLEFLIGHT_LOCK_DIR = os.getenv("SINGLEFLIGHT_LOCK_DIR")
+
+# Per-result enrichment (blob lookup, SAS signing, metadata)
+ENRICH_MAX_WORKERS = int(os.getenv("ENRICH_MAX_WORKERS", "8"))
+ENRICH_RESULT_TIMEOUT_SECONDS = float(os.getenv("ENRICH_RESULT_TIMEOUT_SECONDS", "20"))
+
+# How long a preview link handed out with search results stays valid
+PREVIEW_LINK_MAX_AGE_SECONDS = int(os.getenv("PREVIEW_LINK_MAX_AGE_SECONDS", "3600"))
+
+# Highlighted copies are reused for this long; keep it below the cleanup
+# scheduler's HIGHLIGHTED_MAX_AGE_MINUTES so a reused copy is not swept away
+HIGHLIGHT_CACHE_TTL_SECONDS = int(os.getenv("HIGHLIGHT_CACHE_TTL_SECONDS", "600"))
+HIGHLIGHT_CACHE_MAX_ENTRIES = int(os.getenv("HIGHLIGHT_CACHE_MAX_ENTRIES", "1024"))
+HIGHLIGHT_CACHE_MAX_BYTES = int(os.getenv("HIGHLIGHT_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+
+# 'overlay': PDFs are previewed as the original blob plus hit coordinates the viewer
+# draws on top; 'pages': as server-rendered page images; 'annotate': upload an
+# annotated copy per query, as for DOCX
+PDF_HIGHLIGHT_MODE = os.getenv("PDF_HIGHLIGHT_MODE", "overlay").lower()
+PDF_OVERLAY_CACHE_MAX_ENTRIES = int(os.getenv("PDF_OVERLAY_CACHE_MAX_ENTRIES", "4096"))
+PDF_OVERLAY_CACHE_MAX_BYTES = int(os.getenv("PDF_OVERLAY_CACHE_MAX_BYTES", str(64 * 1024 ** 2)))
+
+# Server-rendered page previews: JPEG pages with highlights drawn in, cached per (ETag, page, zoom, keywords)
+PAGE_PREVIEW_ZOOM = float(os.getenv("PAGE_PREVIEW_ZOOM", "1.5"))
+PAGE_PREVIEW_MAX_ZOOM = float(os.getenv("PAGE_PREVIEW_MAX_ZOOM", "3"))
+PAGE_PREVIEW_JPEG_QUALITY = int(os.getenv("PAGE_PREVIEW_JPEG_QUALITY", "75"))
+PAGE_CACHE_MAX_ENTRIES = int(os.getenv("PAGE_CACHE_MAX_ENTRIES", "2048"))
+PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_BYTES", str(256 * 1024 ** 2)))
+
+# LibreOffice, to convert Word documents to PDF for page previews; empty disables conversion
+DOCUMENT_CONVERTER = os.getenv("DOCUMENT_CONVERTER", shutil.which("soffice") or shutil.which("libreoffice") or "")
+DOCUMENT_CONVERT_TIMEOUT_SECONDS = int(os.getenv("DOCUMENT_CONVERT_TIMEOUT_SECONDS", "120"))
+CONVERTED_PDF_SUFFIX = '.converted.pdf'
+
+# 'pages': Word documents are previewed as rendered pages (needs DOCUMENT_CONVERTER);
+# 'annotate': upload a highlighted copy per query for the Office viewer
+DOCX_HIGHLIGHT_MODE = os.getenv("DOCX_HIGHLIGHT_MODE", "pages" if DOCUMENT_CONVERTER else "annotate").lower()
+
+# Blob existence/size/last-modified/ETag, cached to save a round trip per hit
+BLOB_METADATA_TTL_SECONDS = int(os.getenv("BLOB_METADATA_TTL_SECONDS", "300"))
+BLOB_METADATA_MAX_ENTRIES = int(os.getenv("BLOB_METADATA_MAX_ENTRIES", "50000"))
+BLOB_METADATA_WARM_ON_START = os.getenv("BLOB_METADATA_WARM_ON_START", "false").lower() == "true"
+
+# SAS URLs are valid for SAS_LIFETIME_MINUTES and reissued after SAS_REFRESH_FRACTION of it
+SAS_LIFETIME_MINUTES = int(os.getenv("SAS_LIFETIME_MINUTES", "60"))
+SAS_REFRESH_FRACTION = float(os.getenv("SAS_REFRESH_FRACTION", "0.5"))
+
+# Requests slower than this get their sampled stacks logged (0 disables the profiler)
+SLOW_REQUEST_PROFILE_SECONDS = float(os.getenv("SLOW_REQUEST_PROFILE_SECONDS", "0"))
+SLOW_REQUEST_PROFILE_INTERVAL_MS = float(os.getenv("SLOW_REQUEST_PROFILE_INTERVAL_MS", "10"))
+# Bearer token required by /metrics; unset leaves it open to scrapers
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# PDFs with at least PDF_PARALLEL_MIN_PAGES pages are searched across this many processes
+# (only when the highlight pool is off; pool jobs are one process each)
+PDF_PARALLEL_WORKERS = int(os.getenv("PDF_PARALLEL_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "200"))
+
+# Highlighting, overlays and page renders run in HIGHLIGHT_POOL_WORKERS processes (0: in the
+# request thread). Past HIGHLIGHT_POOL_MAX_QUEUE waiting jobs, previews fall back to the plain document
+HIGHLIGHT_POOL_WORKERS = int(os.getenv("HIGHLIGHT_POOL_WORKERS", str(os.cpu_count() or 1)))
+HIGHLIGHT_POOL_MAX_QUEUE = int(os.getenv("HIGHLIGHT_POOL_MAX_QUEUE", "8"))
+# CPU seconds per job and address space per worker process; 0 for no limit
+HIGHLIGHT_JOB_CPU_SECONDS = int(os.getenv("HIGHLIGHT_JOB_CPU_SECONDS", "60"))
+HIGHLIGHT_WORKER_MEMORY_BYTES = int(os.getenv("HIGHLIGHT_WORKER_MEMORY_BYTES", str(2 * 1024 ** 3)))
+# Wall-clock seconds from a job starting in its worker, queue wait excluded, before that worker is killed; 0 for no limit
+HIGHLIGHT_JOB_TIMEOUT_SECONDS = float(os.getenv("HIGHLIGHT_JOB_TIMEOUT_SECONDS", "120"))
+
+# Source documents and highlighted copies move in chunks of BLOB_TRANSFER_CHUNK_BYTES,
+# BLOB_TRANSFER_CONCURRENCY chunks at a time
+BLOB_TRANSFER_CHUNK_BYTES = int(os.getenv("BLOB_TRANSFER_CHUNK_BYTES", str(4 * 1024 ** 2)))
+BLOB_TRANSFER_CONCURRENCY = int(os.getenv("BLOB_TRANSFER_CONCURRENCY", "4"))
+
+# Memory one highlight may use for the source and its highlighted copy;
+# documents that don't fit are spooled to temporary files in HIGHLIGHT_SPOOL_DIR
+HIGHLIGHT_MEMORY_BUDGET_BYTES = int(os.getenv("HIGHLIGHT_MEMORY_BUDGET_BYTES", str(32 * 1024 ** 2)))
+HIGHLIGHT_SPOOL_DIR = os.getenv("HIGHLIGHT_SPOOL_DIR") or None
+
+# On-disk LRU cache of source documents for highlighting (0 bytes disables it);
+# entries are revalidated by ETag once they are older than SOURCE_CACHE_REVALIDATE_SECONDS
+SOURCE_CACHE_DIR = os.getenv("SOURCE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "docsearch-source-cache"))
+SOURCE_CACHE_MAX_BYTES = int(os.getenv("SOURCE_CACHE_MAX_BYTES", str(1024 ** 3)))
+SOURCE_CACHE_REVALIDATE_SECONDS = float(os.getenv("SOURCE_CACHE_REVALIDATE_SECONDS", "60"))
+
+# Keep a word-position index next to each cached PDF version and highlight from it
+PDF_WORD_INDEX_ENABLED = os.getenv("PDF_WORD_INDEX_ENABLED", "true").lower() == "true"
+PDF_WORD_INDEX_SUFFIX = '.words'
+
 # Initialize Flask app
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", os.urandom(24))
 app.permanent_session_lifetime = timedelta(minutes=30)
+preview_serializer = URLSafeTimedSerializer(app.secret_key, salt='preview')
 
 # Initialize Azure Blob client
-blob_service_client = BlobServiceClient.from_connection_string(AZURE_STORAGE_CONNECTION_STRING)
+blob_service_client = BlobServiceClient.from_connection_string(
+    AZURE_STORAGE_CONNECTION_STRING,
+    max_single_get_size=BLOB_TRANSFER_CHUNK_BYTES,
+    max_chunk_get_size=BLOB_TRANSFER_CHUNK_BYTES,
+    max_single_put_size=BLOB_TRANSFER_CHUNK_BYTES,
+    max_block_size=BLOB_TRANSFER_CHUNK_BYTES
+)
 container_client = blob_service_client.get_container_client(CONTAINER_NAME)
 
+# Bounded worker pool shared by all requests for per-result enrichment
+enrichment_executor = ThreadPoolExecutor(max_workers=ENRICH_MAX_WORKERS, thread_name_prefix="enrich")
+
+result_cache = ResultCache(
+    ttl=RESULT_CACHE_TTL_SECONDS,
+    max_entries=RESULT_CACHE_MAX_ENTRIES,
+    max_bytes=RESULT_CACHE_MAX_BYTES,
+    shared_store=SqliteResultStore(
+        RESULT_CACHE_SQLITE_PATH, ttl=RESULT_CACHE_TTL_SECONDS
+    ) if RESULT_CACHE_SQLITE_PATH else None
+)
+
+# Searches wait on other processes only if they can then read those processes' results
+search_flights = SingleFlight('search', SINGLEFLIGHT_LOCK_DIR if RESULT_CACHE_SQLITE_PATH else None)
+search_hit_flights = SingleFlight('search_hits')
+# Highlighted copies are found in Blob Storage by the processes that waited
+highlight_flights = SingleFlight('highlight', SINGLEFLIGHT_LOCK_DIR)
+# Overlays and page images are kept per process
+preview_flights = SingleFlight('preview')
+
+# Signed read URLs, cached per (blob, permission, disposition)
+sas_issuer = SasUrlIssuer(
+    container_client,
+    ACCOUNT_KEY,
+    lifetime=timedelta(minutes=SAS_LIFETIME_MINUTES),
+    refresh_fraction=SAS_REFRESH_FRACTION
+)
+
+blob_metadata = BlobMetadataCache(
+    container_client,
+    ttl=BLOB_METADATA_TTL_SECONDS,
+    max_entries=BLOB_METADATA_MAX_ENTRIES
+)
+
+source_cache = SourceCache(
+    SOURCE_CACHE_DIR,
+    SOURCE_CACHE_MAX_BYTES,
+    revalidate_after=SOURCE_CACHE_REVALIDATE_SECONDS,
+    max_concurrency=BLOB_TRANSFER_CONCURRENCY
+) if SOURCE_CACHE_MAX_BYTES > 0 else None
+
+def warm_blob_metadata():
+    try:
+        count = blob_metadata.warm()
+        app.logger.info(f"Warmed blob metadata cache with {count} blobs")
+    except Exception as e:
+        app.logger.error(f"Error warming blob metadata cache: {str(e)}")
+
+# Bulk-load metadata from a container listing without delaying startup
+if BLOB_METADATA_WARM_ON_START:
+    threading.Thread(target=warm_blob_metadata, name="blob-metadata-warm", daemon=True).start()
+
+# Created on first use by get_pdf_process_pool()
+pdf_process_pool = None
+pdf_process_pool_lock = threading.Lock()
+
+# Created on first use by get_highlight_pool()
+highlight_pool = None
+highlight_pool_lock = threading.Lock()
+
+# Highlighted copies keyed by (blob, ETag, keywords, format) -> highlighted blob name
+highlight_cache = TTLCache(
+    max_entries=HIGHLIGHT_CACHE_MAX_ENTRIES,
+    ttl=HIGHLIGHT_CACHE_TTL_SECONDS,
+    max_bytes=HIGHLIGHT_CACHE_MAX_BYTES
+)
+
+# Hit coordinates of PDFs, per (blob, ETag, keywords)
+pdf_overlay_cache = TTLCache(
+    max_entries=PDF_OVERLAY_CACHE_MAX_ENTRIES,
+    ttl=HIGHLIGHT_CACHE_TTL_SECONDS,
+    max_bytes=PDF_OVERLAY_CACHE_MAX_BYTES
+)
+
+# Page previews: layouts and page images per (blob, ETag, keywords, part), and
+# converted PDFs of Word documents when the source cache can't hold them
+page_cache = TTLCache(
+    max_entries=PAGE_CACHE_MAX_ENTRIES,
+    ttl=HIGHLIGHT_CACHE_TTL_SECONDS,
+    max_bytes=PAGE_CACHE_MAX_BYTES
+)
+
+slow_request_profiler = SlowRequestProfiler(
+    SLOW_REQUEST_PROFILE_SECONDS, interval=SLOW_REQUEST_PROFILE_INTERVAL_MS / 1000
+) if SLOW_REQUEST_PROFILE_SECONDS > 0 else None
+
 @app.before_request
 def make_session_permanent():
     session.permanent = True
 
+@app.before_request
+def start_request_timing():
+    g.timings = start_request()
+    if slow_request_profiler:
+        slow_request_profiler.begin()
+
+@app.after_request
+def add_server_timing(response):
+    timings = g.get('timings')
+    if timings is not None:
+        # Streamed responses only report the stages before the first byte
+        response.headers['Server-Timing'] = timings.server_timing()
+        observe_request(request.endpoint or 'unknown', response.status_code, time.perf_counter() - timings.started)
+    return response
+
+@app.teardown_request
+def report_slow_request(exc):
+    timings = g.get('timings')
+    if slow_request_profiler and timings is not None:
+        elapsed = time.perf_counter() - timings.started
+        report = slow_request_profiler.end(elapsed)
+        if report:
+            app.logger.warning(f"Slow request {request.method} {request.path} took {elapsed:.2f}s; {report}")
+
 # Valid credentials
 # VALID_CREDENTIALS = {
 #     os.getenv("ADMIN_USERNAME", "admin"): os.getenv("ADMIN_PASSWORD", "admin123")
@@ -54,6 +324,23 @@ VALID_CREDENTIALS = {
 # Azure Search endpoint
 endpoint = f"https://{SEARCH_SERVICE_NAME}.search.windows.net/indexes/{SEARCH_INDEX_NAME}/docs/search?api-version={API_VERSION}"
 
+# Both backends take a REST search payload and return {"value": [...]}
+if SEARCH_BACKEND == 'local':
+    search_client = LocalSearchBackend(LOCAL_SEARCH_ROOT, index_path=LOCAL_SEARCH_INDEX_PATH)
+else:
+    search_client = AzureSearchClient(
+        endpoint,
+        API_KEY,
+        pool_size=SEARCH_POOL_SIZE,
+        connect_timeout=SEARCH_CONNECT_TIMEOUT_SECONDS,
+        read_timeout=SEARCH_READ_TIMEOUT_SECONDS,
+        max_retries=SEARCH_MAX_RETRIES,
+        breaker=CircuitBreaker(
+            failure_threshold=SEARCH_BREAKER_FAILURE_THRESHOLD,
+            reset_timeout=SEARCH_BREAKER_RESET_SECONDS
+        )
+    )
+
 
 def escape_query(query: str) -> str:
     # Escape special characters for Lucene
@@ -61,6 +348,14 @@ def escape_query(query: str) -> str:
     query = re.sub(lucene_special_chars, r'\\\1', query)
     return f'"{query}"'  # Wrap in quotes to treat entire thing as a literal string
 
+def parse_int_arg(value, default, minimum, maximum):
+    """Parse an optional integer request argument, clamped to [minimum, maximum]."""
+    try:
+        number = int(value) if value not in (None, '') else default
+    except ValueError:
+        number = default
+    return max(minimum, min(maximum, number))
+
 # Helper for login required
 def login_required(f):
     @wraps(f)
@@ -70,164 +365,170 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-# Highlight keywords inside text
-def highlight_keywords(text, keywords):
-    """Wrap keywords with <mark> tags using different colors."""
-    if not text:
-        return ""
-    
-    # Define colors for highlighting
-    colors = [
-        'background-color: #FFFF00;',  # Yellow
-        'background-color: #40E0D0;',  # Turquoise
-        'background-color: #FFC0CB;',  # Pink
-        'background-color: #90EE90;',  # Green
-        'background-color: #98FB98;',  # Bright Green
-        'background-color: #ADD8E6;',  # Blue
-        'background-color: #FFB6C1;',  # Red
-        'background-color: #EE82EE;'   # Violet
-    ]
-    
-    # Create a mapping of keywords to colors
-    keyword_colors = {}
-    for i, keyword in enumerate(keywords.split()):
-        keyword_colors[keyword.lower()] = colors[i % len(colors)]
-    
-    # Process each keyword
-    for keyword, color in keyword_colors.items():
-        pattern = re.compile(re.escape(keyword), re.IGNORECASE)
-        text = pattern.sub(lambda m: f'<mark style="{color}">{m.group(0)}</mark>', text)
-    
-    return text
+def open_buffer(size, budget, kind, suffix):
+    """A DocumentBuffer for a source or highlighted copy, in memory if `size` fits the budget."""
+    buffer = DocumentBuffer(size or 0, budget, HIGHLIGHT_SPOOL_DIR, suffix=suffix)
+    count('highlight_buffers', 1, 'Highlight buffers by kind and where they were kept', kind=kind,
+          location='memory' if buffer.in_memory else 'disk')
+    return buffer
+
+def download_source(blob_client, size, budget, etag=None):
+    """Download a source blob into a DocumentBuffer, or map it from the source cache.
+
+    Raises ResourceModifiedError if the blob no longer has `etag`.
+    """
+    if source_cache is not None and etag is not None:
+        with stage('download'):
+            return source_cache.open(blob_client, etag)
 
-def highlight_keywords_in_docx(blob_client, keywords):
-    """Process DOCX file and highlight keywords with different colors."""
+    buffer = open_buffer(size, budget, 'source', os.path.splitext(blob_client.blob_name)[1])
     try:
-        # Download the blob content
-        blob_data = blob_client.download_blob()
-        docx_bytes = blob_data.readall()
-        
-        # Create a Document object from bytes
-        doc = Document(io.BytesIO(docx_bytes))
-        
-        # Define colors for highlighting
-        highlight_colors = [
-            WD_COLOR_INDEX.YELLOW,      # Yellow
-            WD_COLOR_INDEX.TURQUOISE,   # Turquoise
-            WD_COLOR_INDEX.PINK,        # Pink
-            WD_COLOR_INDEX.GREEN,       # Green
-            WD_COLOR_INDEX.BRIGHT_GREEN,# Bright Green
-            WD_COLOR_INDEX.BLUE,        # Blue
-            WD_COLOR_INDEX.RED,         # Red
-            WD_COLOR_INDEX.VIOLET       # Violet
-        ]
-        
-        # Create a mapping of keywords to colors
-        keyword_colors = {}
-        for i, keyword in enumerate(keywords.split()):
-            keyword_colors[keyword.lower()] = highlight_colors[i % len(highlight_colors)]
-        
-        # Process each paragraph
-        for paragraph in doc.paragraphs:
-            for run in paragraph.runs:
-                text = run.text
-                modified_text = text
-                
-                # Process each keyword
-                for keyword, color in keyword_colors.items():
-                    pattern = re.compile(re.escape(keyword), re.IGNORECASE)
-                    if pattern.search(modified_text):
-                        # Split text by this keyword
-                        parts = pattern.split(modified_text)
-                        if len(parts) > 1:
-                            # Clear the original run
-                            run.text = parts[0]
-                            
-                            # Add highlighted runs for this keyword
-                            for i, part in enumerate(parts[1:]):
-                                # Add the keyword with its specific color
-                                keyword_run = paragraph.add_run(pattern.findall(modified_text)[i])
-                                keyword_run.font.highlight_color = color
-                                
-                                # Add the next part
-                                if i < len(parts) - 2:
-                                    paragraph.add_run(part)
-                            
-                            # Update modified_text for next keyword
-                            modified_text = pattern.sub('', modified_text)
-        
-        # Save the modified document
-        output = io.BytesIO()
-        doc.save(output)
-        output.seek(0)
-        
-        return output.getvalue()
+        with stage('download'):
+            if etag is None:
+                downloaded = download_into(blob_client, buffer, BLOB_TRANSFER_CONCURRENCY)
+            else:
+                downloaded = download_into(
+                    blob_client, buffer, BLOB_TRANSFER_CONCURRENCY,
+                    etag=etag, match_condition=MatchConditions.IfNotModified
+                )
+    except BaseException:
+        buffer.close()
+        raise
+    count('blob_bytes_downloaded', downloaded, 'Bytes downloaded from Blob Storage')
+    return buffer
+
+def highlight_keywords_in_docx(blob_client, keywords, size, budget, etag=None):
+    """Process DOCX file and highlight keywords with different colors; returns a DocumentBuffer or None."""
+    try:
+        # Download the blob content, only if it is still the version we expect
+        with download_source(blob_client, size, budget, etag) as source:
+            output = open_buffer(source.size, budget, 'output', '.docx')
+            try:
+                with stage('highlight_docx'):
+                    run_highlight_job(highlight_docx, source, keywords, output)
+            except BaseException:
+                output.close()
+                raise
+            return output
+    except (ResourceModifiedError, PoolSaturatedError):
+        raise
     except Exception as e:
         app.logger.error(f"Error processing DOCX file: {str(e)}")
         return None
 
-def highlight_keywords_in_pdf(blob_client, keywords):
-    """Process PDF file and highlight keywords with different colors."""
+def highlight_keywords_in_pdf(blob_client, keywords, size, budget, etag=None):
+    """Process PDF file and highlight keywords with different colors; returns a DocumentBuffer or None."""
     try:
-        # Download the blob content
-        blob_data = blob_client.download_blob()
-        pdf_bytes = blob_data.readall()
-        
-        # Create a temporary file to work with
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-            temp_file.write(pdf_bytes)
-            temp_path = temp_file.name
-        
-        # Open the PDF with PyMuPDF
-        doc = fitz.open(temp_path)
-        
-        # Define colors for highlighting
-        highlight_colors = [
-            (1, 1, 0),       # Yellow
-            (0, 0.8, 0.8),   # Turquoise
-            (1, 0.75, 0.8),  # Pink
-            (0.56, 0.93, 0.56), # Green
-            (0.6, 0.98, 0.6),   # Bright Green
-            (0.68, 0.85, 0.9),  # Blue
-            (1, 0.71, 0.76),    # Red
-            (0.93, 0.51, 0.93)  # Violet
-        ]
-        
-        # Create a mapping of keywords to colors
-        keyword_colors = {}
-        for i, keyword in enumerate(keywords.split()):
-            keyword_colors[keyword.lower()] = highlight_colors[i % len(highlight_colors)]
-        
-        # Process each page
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            
-            # Search for each keyword
-            for keyword, color in keyword_colors.items():
-                text_instances = page.search_for(keyword, quads=True)
-                
-                # Add highlight for each instance
-                for inst in text_instances:
-                    annot = page.add_highlight_annot(inst)
-                    annot.set_colors(stroke=color)
-                    annot.update()
-        
-        # Save the modified PDF
-        output = io.BytesIO()
-        doc.save(output)
-        doc.close()
-        
-        # Clean up the temporary file
-        os.unlink(temp_path)
-        
-        # Return the modified PDF bytes
-        output.seek(0)
-        return output.getvalue()
-    
+        # Download the blob content, only if it is still the version we expect
+        with download_source(blob_client, size, budget, etag) as source:
+            word_index = get_pdf_word_index(blob_client.blob_name, etag, source)
+            output = open_buffer(source.size, budget, 'output', '.pdf')
+            try:
+                with stage('highlight_pdf'):
+                    run_highlight_job(highlight_pdf, source, keywords, output, word_index=word_index, **pdf_search_options())
+            except BaseException:
+                output.close()
+                raise
+            return output
+    except (ResourceModifiedError, PoolSaturatedError):
+        raise
     except Exception as e:
         app.logger.error(f"Error processing PDF file: {str(e)}")
         return None
 
+def get_pdf_word_index(blob_name, etag, source):
+    """Word index of a cached PDF version, built and stored next to it on first use.
+
+    Returns None (search the pages instead) if the index is disabled or
+    the source is not in the source cache. Building it is one text
+    extraction pass, already cheaper than the page search it replaces.
+    """
+    if not PDF_WORD_INDEX_ENABLED or source_cache is None or not isinstance(source, CachedSource):
+        return None
+    data = source_cache.read_sidecar(blob_name, etag, PDF_WORD_INDEX_SUFFIX)
+    if data is not None:
+        try:
+            with stage('word_index_load'):
+                word_index = PdfWordIndex.loads(data)
+            count('pdf_word_index', 1, 'PDF word index lookups by outcome', outcome='loaded')
+            return word_index
+        except (ValueError, zlib.error, struct.error) as e:
+            app.logger.error(f"Error loading word index of {blob_name}: {str(e)}")
+
+    with stage('word_index_build'):
+        word_index = run_cpu_job(build_pdf_word_index, source.path, **pdf_search_options())
+        source_cache.write_sidecar(blob_name, etag, PDF_WORD_INDEX_SUFFIX, word_index.dumps())
+    count('pdf_word_index', 1, 'PDF word index lookups by outcome', outcome='built')
+    return word_index
+
+def get_pdf_process_pool():
+    """Process pool for searching large PDFs page range by page range, or None if disabled."""
+    global pdf_process_pool
+    if PDF_PARALLEL_WORKERS <= 1:
+        return None
+    with pdf_process_pool_lock:
+        if pdf_process_pool is None:
+            # forkserver: never fork this multi-threaded process directly
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(['highlighter', 'pdf_word_index'])
+            pdf_process_pool = ProcessPoolExecutor(max_workers=PDF_PARALLEL_WORKERS, mp_context=context)
+    return pdf_process_pool
+
+def get_highlight_pool():
+    """Process pool for whole highlighting jobs, or None to run them in the request thread."""
+    global highlight_pool
+    if HIGHLIGHT_POOL_WORKERS <= 0:
+        return None
+    with highlight_pool_lock:
+        if highlight_pool is None:
+            # forkserver: never fork this multi-threaded process directly
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(['highlighter', 'pdf_word_index', 'page_preview'])
+            highlight_pool = HighlightPool(
+                HIGHLIGHT_POOL_WORKERS,
+                HIGHLIGHT_POOL_MAX_QUEUE,
+                cpu_seconds=HIGHLIGHT_JOB_CPU_SECONDS,
+                memory_bytes=HIGHLIGHT_WORKER_MEMORY_BYTES,
+                timeout=HIGHLIGHT_JOB_TIMEOUT_SECONDS or None,
+                mp_context=context
+            )
+    return highlight_pool
+
+def run_cpu_job(func, *args, **kwargs):
+    """Run a CPU-bound highlighting function in the highlight pool, or here if the pool is off.
+
+    Arguments must be picklable: pass sources as paths or bytes. Raises
+    PoolSaturatedError if the pool's queue is full.
+    """
+    pool = get_highlight_pool()
+    if pool is None:
+        return func(*args, **kwargs)
+    return pool.run(func, *args, **kwargs)
+
+def run_highlight_job(highlighter, source, keywords, output, **kwargs):
+    """Highlight a downloaded source into the DocumentBuffer `output` with highlight_docx or highlight_pdf."""
+    # python-docx needs a seekable file, so cached sources are read by path, not mapped
+    source = source.path or source.target
+    if get_highlight_pool() is None:
+        highlighter(source, keywords, output=output.target, **kwargs)
+    elif output.path is not None:
+        run_cpu_job(highlighter, source, keywords, output=output.path, **kwargs)
+    else:
+        # A worker can't fill this process's BytesIO; it returns the bytes instead
+        data = run_cpu_job(highlighter, source, keywords, **kwargs)
+        with output.open('wb') as stream:
+            stream.write(data)
+
+def pdf_search_options():
+    """Page-range parallelism for searching one PDF, unless whole jobs run in the highlight pool."""
+    if get_highlight_pool() is not None:
+        return {}
+    return {
+        'executor': get_pdf_process_pool(),
+        'workers': PDF_PARALLEL_WORKERS,
+        'parallel_min_pages': PDF_PARALLEL_MIN_PAGES
+    }
+
 # Login page
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -255,162 +556,779 @@ def logout():
 def index():
     return render_template('index.html')
 
-# Search API
-@app.route('/search', methods=['POST'])
-@login_required
-def search():
-    user_query = request.form.get('query')
-    
-    if not user_query:
-        return jsonify({'error': 'No query provided'}), 400
+# File type detection
+FILE_TYPES = {
+    'pdf': 'pdf',
+    'doc': 'word', 'docx': 'word',
+    'xls': 'excel', 'xlsx': 'excel',
+    'ppt': 'powerpoint', 'pptx': 'powerpoint',
+    'txt': 'text',
+    'json': 'text',
+    'csv': 'text'
+}
+
+def get_file_type(blob_name):
+    """Return the lowercase extension and display file type of a blob."""
+    ext = blob_name.lower().split('.')[-1] if '.' in blob_name else ''
+    return ext, FILE_TYPES.get(ext, 'other')
+
+# Extensions that get a keyword-highlighted preview
+HIGHLIGHT_EXTENSIONS = {'doc', 'docx', 'pdf'}
+
+def fallback_enrichment(blob_name):
+    """Plain SAS link for a hit whose enrichment failed or timed out."""
+    try:
+        _, file_type = get_file_type(blob_name)
+        return {'file_type': file_type, 'view_url': sas_issuer.url(blob_name)}
+    except Exception as e:
+        app.logger.error(f"Error generating SAS URL for blob {blob_name}: {str(e)}")
+        return {'view_url': None}
 
-    headers = {
-        "Content-Type": "application/json",
-        "api-key": API_KEY
+def enrich_result(blob_name):
+    """Look up and sign a single hit; returns the fields to merge into it."""
+    metadata = blob_metadata.get(blob_name)
+    if not metadata.exists:
+        return {'view_url': None}
+
+    _, file_type = get_file_type(blob_name)
+    count('search_hits', 1, 'Search hits by document type', file_type=file_type)
+    return {
+        'file_type': file_type,
+        'view_url': sas_issuer.url(blob_name),
+        'file_size': metadata.size,
+        'last_modified': metadata.last_modified.isoformat()
     }
 
+def build_preview_url(blob_name, user_query):
+    """Signed link to the on-demand highlighted preview of a hit, or None if it has none."""
+    ext, _ = get_file_type(blob_name)
+    if ext not in HIGHLIGHT_EXTENSIONS:
+        return None
+    token = preview_serializer.dumps({'blob': blob_name, 'user': session['username']})
+    return url_for('preview', blob_name=blob_name, q=user_query, token=token)
+
+def highlighted_blob_name(blob_name, etag, keywords, ext):
+    """Content-addressed name of the highlighted copy of a given blob version and keyword set."""
+    digest = hashlib.sha256(json.dumps([blob_name, etag, keywords, ext]).encode('utf-8')).hexdigest()[:32]
+    return f"highlighted_{digest}_{blob_name.rsplit('/', 1)[-1]}"
+
+def find_shared_highlighted_blob(temp_blob_client):
+    """(size, age in seconds) of a highlighted copy another worker already uploaded and that is still fresh, else None."""
+    try:
+        with stage('properties'):
+            props = temp_blob_client.get_blob_properties()
+    except ResourceNotFoundError:
+        return None
+    created = props.creation_time
+    if created.tzinfo is None:
+        created = created.replace(tzinfo=datetime.timezone.utc)
+    age = datetime.datetime.now(datetime.timezone.utc) - created
+    if age.total_seconds() >= HIGHLIGHT_CACHE_TTL_SECONDS:
+        return None
+    return props.size, age.total_seconds()
+
+def build_highlighted_view_url(blob_name, user_query, retry_if_modified=True):
+    """Return (view_url, highlighted) for a DOCX/PDF blob, reusing a cached highlighted copy if possible."""
+    ext, _ = get_file_type(blob_name)
+    keywords = normalize_keywords(user_query)
+
+    metadata = blob_metadata.get(blob_name)
+    if not metadata.exists:
+        raise ResourceNotFoundError(f"Blob {blob_name} does not exist")
+    etag = metadata.etag
+    cache_key = (blob_name, etag, keywords, ext)
+    temp_blob_name = highlight_cache.get(cache_key)
+    if temp_blob_name:
+        count_highlight(ext, 'cached')
+        return sas_issuer.url(temp_blob_name), True
+
+    # Concurrent previews of the same version and keywords share one build and upload
+    return highlight_flights.do(cache_key, build_highlighted_copy, blob_name, user_query, metadata, retry_if_modified)
+
+def build_highlighted_copy(blob_name, user_query, metadata, retry_if_modified):
+    """Highlight and upload a blob version, or find the copy another process uploaded; returns (view_url, highlighted)."""
+    blob_client = container_client.get_blob_client(blob_name)
+    ext, _ = get_file_type(blob_name)
+    keywords = normalize_keywords(user_query)
+    etag = metadata.etag
+    cache_key = (blob_name, etag, keywords, ext)
+
+    temp_blob_name = highlighted_blob_name(blob_name, etag, keywords, ext)
+    temp_blob_client = container_client.get_blob_client(temp_blob_name)
+
+    # Another worker may already have built this exact copy
+    shared = find_shared_highlighted_blob(temp_blob_client)
+    if shared is not None:
+        size, age = shared
+        # Reused only as long as one this worker had built then would be, so cleanup never sweeps it first
+        highlight_cache.put(cache_key, temp_blob_name, ttl=HIGHLIGHT_CACHE_TTL_SECONDS - age, size=size)
+        count_highlight(ext, 'shared')
+        return sas_issuer.url(temp_blob_name), True
+
+    # Source and highlighted copy share one memory budget; what doesn't fit goes to disk
+    budget = MemoryBudget(HIGHLIGHT_MEMORY_BUDGET_BYTES)
+    highlighted = None
+    try:
+        if ext in ['doc', 'docx']:
+            highlighted = highlight_keywords_in_docx(blob_client, user_query, metadata.size, budget, etag)
+        elif ext == 'pdf':
+            highlighted = highlight_keywords_in_pdf(blob_client, user_query, metadata.size, budget, etag)
+    except ResourceModifiedError:
+        # The blob changed after its metadata was cached; key the copy on the new version
+        blob_metadata.invalidate(blob_name)
+        if not retry_if_modified:
+            raise
+        return build_highlighted_view_url(blob_name, user_query, retry_if_modified=False)
+    except PoolSaturatedError:
+        # Every highlight worker is busy and the queue is full: serve the original now
+        count_highlight(ext, 'shed')
+        return sas_issuer.url(blob_name), False
+
+    if highlighted is None:
+        # Highlighting failed: use the original blob
+        count_highlight(ext, 'failed')
+        return sas_issuer.url(blob_name), False
+
+    # Upload the highlighted version under its content-addressed name, in blocks
+    with highlighted, stage('upload'):
+        uploaded = upload_from(temp_blob_client, highlighted, BLOB_TRANSFER_CONCURRENCY)
+    count('blob_bytes_uploaded', uploaded, 'Bytes uploaded to Blob Storage')
+    highlight_cache.put(cache_key, temp_blob_name, size=uploaded)
+    count_highlight(ext, 'built')
+    return sas_issuer.url(temp_blob_name), True
+
+def uses_pdf_overlay(ext):
+    return ext == 'pdf' and PDF_HIGHLIGHT_MODE == 'overlay'
+
+def build_pdf_overlay(blob_name, user_query, retry_if_modified=True):
+    """Hit coordinates of a PDF for the viewer to draw over the original blob, cached per (blob, ETag, keywords)."""
+    keywords = normalize_keywords(user_query)
+    metadata = blob_metadata.get(blob_name)
+    if not metadata.exists:
+        raise ResourceNotFoundError(f"Blob {blob_name} does not exist")
+    cache_key = (blob_name, metadata.etag, keywords)
+    overlay = pdf_overlay_cache.get(cache_key)
+    if overlay is not None:
+        count_highlight('pdf', 'cached')
+        return overlay
+    return preview_flights.do(cache_key, compute_pdf_overlay, blob_name, user_query, metadata, retry_if_modified)
+
+def compute_pdf_overlay(blob_name, user_query, metadata, retry_if_modified):
+    """Download a PDF version and find its overlay hits, caching them."""
+    cache_key = (blob_name, metadata.etag, normalize_keywords(user_query))
+    blob_client = container_client.get_blob_client(blob_name)
+    try:
+        with download_source(blob_client, metadata.size, MemoryBudget(HIGHLIGHT_MEMORY_BUDGET_BYTES), metadata.etag) as source:
+            overlay = pdf_overlay_from_source(blob_name, metadata.etag, source, user_query)
+    except ResourceModifiedError:
+        # The blob changed after its metadata was cached; key the overlay on the new version
+        blob_metadata.invalidate(blob_name)
+        if not retry_if_modified:
+            raise
+        return build_pdf_overlay(blob_name, user_query, retry_if_modified=False)
+
+    pdf_overlay_cache.put(cache_key, overlay, size=len(json.dumps(overlay)))
+    count_highlight('pdf', 'overlay')
+    return overlay
+
+def pdf_overlay_from_source(blob_name, etag, source, user_query):
+    """The overlay payload for a downloaded PDF version: hits plus the color of each keyword."""
+    word_index = get_pdf_word_index(blob_name, etag, source)
+    with stage('pdf_overlay'):
+        hits = run_cpu_job(find_pdf_overlay, source.path or source.target, user_query, word_index=word_index, **pdf_search_options())
+    keywords = normalize_keywords(user_query)
+    return {
+        'etag': etag,
+        'keywords': list(keywords),
+        'colors': [PDF_HIGHLIGHT_CSS_COLORS[i % len(PDF_HIGHLIGHT_CSS_COLORS)] for i in range(len(keywords))],
+        'hits': hits
+    }
+
+def uses_page_preview(ext):
+    if ext == 'pdf':
+        return PDF_HIGHLIGHT_MODE == 'pages'
+    return ext in ('doc', 'docx') and DOCX_HIGHLIGHT_MODE == 'pages' and bool(DOCUMENT_CONVERTER)
+
+def page_preview_zoom(value):
+    """Requested zoom, clamped and snapped to quarter steps so the page cache sees few distinct values."""
+    try:
+        zoom = float(value)
+    except (TypeError, ValueError):
+        zoom = PAGE_PREVIEW_ZOOM
+    if not math.isfinite(zoom):
+        zoom = PAGE_PREVIEW_ZOOM
+    return min(max(round(zoom * 4) / 4, 0.5), PAGE_PREVIEW_MAX_ZOOM)
+
+def build_page_preview(blob_name, user_query, part, retry_if_modified=True):
+    """A part of a page preview, cached per (blob, ETag, keywords, part).
+
+    `part` is ('layout',) for the page sizes and pages with hits, or
+    ('page', page number, zoom) for a JPEG of one page. Raises IndexError
+    for a page the document does not have.
+    """
+    keywords = normalize_keywords(user_query)
+    metadata = blob_metadata.get(blob_name)
+    if not metadata.exists:
+        raise ResourceNotFoundError(f"Blob {blob_name} does not exist")
+    cache_key = (blob_name, metadata.etag, keywords) + part
+    value = page_cache.get(cache_key)
+    if value is not None:
+        count_page_preview(part, 'cached')
+        return value
+    return preview_flights.do(cache_key, compute_page_preview, blob_name, user_query, part, metadata, retry_if_modified)
+
+def compute_page_preview(blob_name, user_query, part, metadata, retry_if_modified):
+    """Render a page preview part of a blob version, caching it."""
+    cache_key = (blob_name, metadata.etag, normalize_keywords(user_query)) + part
+    ext, _ = get_file_type(blob_name)
+    converted = None if ext == 'pdf' else get_converted_pdf(blob_name, metadata.etag)
+    if converted is not None:
+        value = render_page_preview(io.BytesIO(converted), None, user_query, part)
+    else:
+        blob_client = container_client.get_blob_client(blob_name)
+        try:
+            with download_source(blob_client, metadata.size, MemoryBudget(HIGHLIGHT_MEMORY_BUDGET_BYTES), metadata.etag) as source:
+                value = page_preview_from_source(blob_name, metadata.etag, source, user_query, part)
+        except ResourceModifiedError:
+            # The blob changed after its metadata was cached; key the preview on the new version
+            blob_metadata.invalidate(blob_name)
+            if not retry_if_modified:
+                raise
+            return build_page_preview(blob_name, user_query, part, retry_if_modified=False)
+
+    page_cache.put(cache_key, value, size=len(value) if isinstance(value, bytes) else len(json.dumps(value)))
+    count_page_preview(part, 'rendered')
+    return value
+
+def page_preview_from_source(blob_name, etag, source, user_query, part):
+    """A page preview part from a downloaded blob version; Word documents are converted to PDF first."""
+    ext, _ = get_file_type(blob_name)
+    if ext == 'pdf':
+        return render_page_preview(source.path or source.target, get_pdf_word_index(blob_name, etag, source), user_query, part)
+    # The layout and first pages are requested together; they share one conversion
+    converted = preview_flights.do((blob_name, etag, 'converted'), convert_document, blob_name, etag, source)
+    return render_page_preview(io.BytesIO(converted), None, user_query, part)
+
+def render_page_preview(pdf, word_index, user_query, part):
+    if part[0] == 'layout':
+        with stage('page_layout'):
+            return run_cpu_job(document_layout, pdf, user_query, word_index)
+    _, page_num, zoom = part
+    with stage('render_page'):
+        return run_cpu_job(render_page, pdf, page_num, zoom, user_query, word_index=word_index, quality=PAGE_PREVIEW_JPEG_QUALITY)
+
+def get_converted_pdf(blob_name, etag):
+    """The PDF a Word document version was converted to earlier, or None."""
+    converted = source_cache.read_sidecar(blob_name, etag, CONVERTED_PDF_SUFFIX) if source_cache is not None else None
+    if converted is None:
+        converted = page_cache.get((blob_name, etag, 'converted'))
+    return converted
+
+def convert_document(blob_name, etag, source):
+    """Convert a downloaded Word document to PDF once per version, keeping the result next to the source."""
+    with stage('convert'):
+        pdf = convert_to_pdf(
+            source.path or source.target,
+            DOCUMENT_CONVERTER,
+            suffix=os.path.splitext(blob_name)[1],
+            timeout=DOCUMENT_CONVERT_TIMEOUT_SECONDS
+        )
+    if source_cache is None or not source_cache.write_sidecar(blob_name, etag, CONVERTED_PDF_SUFFIX, pdf):
+        page_cache.put((blob_name, etag, 'converted'), pdf, size=len(pdf))
+    count('document_conversions', 1, 'Word documents converted to PDF for page previews')
+    return pdf
+
+def count_page_preview(part, outcome):
+    count('page_previews', 1, 'Page preview layouts and images by outcome (cached, rendered)', part=part[0], outcome=outcome)
+
+def count_highlight(ext, outcome):
+    """Count a highlighted preview by document type and how it was served (cached, shared, built, overlay, shed, failed)."""
+    _, file_type = get_file_type(f".{ext}")
+    count('highlights', 1, 'Highlighted previews by document type and outcome', file_type=file_type, outcome=outcome)
+
+def iter_enrichments(results):
+    """Enrich all hits concurrently on the bounded pool, yielding them as they finish.
+
+    Yields (index into results, enrichment, ok). Each hit gets at most
+    ENRICH_RESULT_TIMEOUT_SECONDS from the start of the batch; hits that
+    fail or run over fall back to a plain SAS link with ok=False.
+    """
+    futures = {}
+    for index, result in enumerate(results):
+        if 'metadata_storage_path' in result:
+            blob_name = result['metadata_storage_name']
+            # Run in a copy of the request's context so its stage timings count against it
+            future = enrichment_executor.submit(contextvars.copy_context().run, enrich_result, blob_name)
+            futures[future] = (index, blob_name)
+
+    try:
+        for future in as_completed(futures, timeout=ENRICH_RESULT_TIMEOUT_SECONDS):
+            index, blob_name = futures.pop(future)
+            try:
+                yield index, future.result(), True
+            except Exception as e:
+                app.logger.error(f"Error enriching blob {blob_name}: {str(e)}")
+                yield index, fallback_enrichment(blob_name), False
+    except FutureTimeoutError:
+        for future, (index, blob_name) in futures.items():
+            future.cancel()
+            app.logger.warning(f"Enrichment timed out for blob {blob_name}, using plain link")
+            yield index, fallback_enrichment(blob_name), False
+
+def enrich_results(results):
+    """Enrich all hits in place, keeping result order; returns False if any hit had to fall back."""
+    complete = True
+    for index, enrichment, ok in iter_enrichments(results):
+        results[index].update(enrichment)
+        complete = complete and ok
+    return complete
+
+def build_search(form, user_query, username):
+    """Azure Search payload and result-cache key for a search form."""
+    top = parse_int_arg(form.get('top'), default=10, minimum=1, maximum=SEARCH_MAX_TOP)
+    skip = parse_int_arg(form.get('skip'), default=0, minimum=0, maximum=SEARCH_MAX_SKIP)
+
     escaped_query = escape_query(user_query)
+    search_filter = f"authorized_users eq '{username}'"
     payload = {
         "search": escaped_query,
         "searchFields": "content,metadata_storage_name",
         "select": "content,metadata_storage_name,metadata_storage_path",
-        "top": 10,
+        "top": top,
+        "skip": skip,
         "queryType": "full",
         "searchMode": "all",
-        "filter": f"authorized_users eq '{session['username']}'"
+        "filter": search_filter
     }
+    if SNIPPET_MODE == 'azure':
+        # Let the service cut the passages, so full content never leaves it
+        payload["select"] = "metadata_storage_name,metadata_storage_path"
+        payload["highlight"] = f"content-{SNIPPET_MAX_FRAGMENTS}"
+        payload["highlightPreTag"] = SNIPPET_PRE_TAG
+        payload["highlightPostTag"] = SNIPPET_POST_TAG
 
-    try:
-        print("@@@@@@@@@@@ endpoint @@@@@@@@@@@@@@...", endpoint)
-        print("@@@@@@@@@@@ headers @@@@@@@@@@@@@@...", headers)
-        print("@@@@@@@@@@@ payload @@@@@@@@@@@@@@...", payload)
-
-        response = requests.post(endpoint, headers=headers, json=payload)
-        print("@@@@@@@@@@@ payload @@@@@@@@@@@@@@...", response)
-        print(response.text)
-        print(json.dumps(payload, indent=2))
-        response.raise_for_status()
-        results = response.json().get("value", [])
-        
+    # The ACL filter is part of the key, so results never cross users
+    cache_key = [search_filter, escape_query(' '.join(user_query.lower().split())), top, skip]
+    return payload, cache_key
+
+def highlight_result_content(result, user_query):
+    # Highlight content
+    if 'content' in result:
+        result['highlighted_content'] = highlight_keywords(result['content'], user_query)
+    else:
+        result['highlighted_content'] = ''
+
+# Azure Search highlight tags; private-use characters never occur in document text
+SNIPPET_PRE_TAG = '\ue000'
+SNIPPET_POST_TAG = '\ue001'
+
+def azure_snippets(highlights):
+    """Plain-text passages from Azure Search highlights, trimmed to SNIPPET_WINDOW_CHARS around the first match."""
+    snippets = []
+    for fragment in highlights[:SNIPPET_MAX_FRAGMENTS]:
+        # Nothing precedes the first pre tag, so its offset is the same in the plain text
+        start = max(0, fragment.find(SNIPPET_PRE_TAG) - SNIPPET_WINDOW_CHARS // 2)
+        text = fragment.replace(SNIPPET_PRE_TAG, '').replace(SNIPPET_POST_TAG, '')
+        snippets.append(' '.join(text[start:start + SNIPPET_WINDOW_CHARS].split()))
+    return snippets
+
+def add_snippets(results, user_query):
+    """Replace each hit's content with highlighted passages around its matches.
+
+    Fills `snippets` (HTML, keywords marked) and drops `content`, then
+    trims the passages to SNIPPET_RESPONSE_MAX_BYTES. With SNIPPET_MODE
+    'off', highlights the full content instead.
+    """
+    with stage('snippets'):
         for result in results:
-            if 'metadata_storage_path' in result:
-                try:
-                    blob_name = result['metadata_storage_name']
-                    blob_client = container_client.get_blob_client(blob_name)
-                    
-                    if not blob_client.exists():
-                        result['view_url'] = None
-                        continue
-                    
-                    # File type detection
-                    ext = blob_name.lower().split('.')[-1] if '.' in blob_name else ''
-                    result['file_type'] = {
-                        'pdf': 'pdf',
-                        'doc': 'word', 'docx': 'word',
-                        'xls': 'excel', 'xlsx': 'excel',
-                        'ppt': 'powerpoint', 'pptx': 'powerpoint',
-                        'txt': 'text',
-                        'json': 'text',
-                        'csv': 'text'
-                    }.get(ext, 'other')
-                    
-                    # For DOCX files, process and highlight keywords
-                    if ext in ['doc', 'docx']:
-                        highlighted_docx = highlight_keywords_in_docx(blob_client, user_query)
-                        if highlighted_docx:
-                            # Upload the highlighted version to a temporary blob
-                            temp_blob_name = f"highlighted_{blob_name}"
-                            temp_blob_client = container_client.get_blob_client(temp_blob_name)
-                            temp_blob_client.upload_blob(highlighted_docx, overwrite=True)
-                            
-                            # Generate SAS token for the highlighted version
-                            sas_token = generate_blob_sas(
-                                account_name=blob_service_client.account_name,
-                                container_name=CONTAINER_NAME,
-                                blob_name=temp_blob_name,
-                                account_key=ACCOUNT_KEY,
-                                permission=BlobSasPermissions(read=True),
-                                expiry=datetime.datetime.utcnow() + datetime.timedelta(hours=1),
-                                content_disposition='inline'
-                            )
-                            result['view_url'] = f"{temp_blob_client.url}?{sas_token}"
-                        else:
-                            # Fallback to original if highlighting fails
-                            sas_token = generate_blob_sas(
-                                account_name=blob_service_client.account_name,
-                                container_name=CONTAINER_NAME,
-                                blob_name=blob_name,
-                                account_key=ACCOUNT_KEY,
-                                permission=BlobSasPermissions(read=True),
-                                expiry=datetime.datetime.utcnow() + datetime.timedelta(hours=1),
-                                content_disposition='inline'
-                            )
-                            result['view_url'] = f"{blob_client.url}?{sas_token}"
-                    # For PDF files, process and highlight keywords
-                    elif ext == 'pdf':
-                        highlighted_pdf = highlight_keywords_in_pdf(blob_client, user_query)
-                        if highlighted_pdf:
-                            # Upload the highlighted version to a temporary blob
-                            temp_blob_name = f"highlighted_{blob_name}"
-                            temp_blob_client = container_client.get_blob_client(temp_blob_name)
-                            temp_blob_client.upload_blob(highlighted_pdf, overwrite=True)
-                            
-                            # Generate SAS token for the highlighted version
-                            sas_token = generate_blob_sas(
-                                account_name=blob_service_client.account_name,
-                                container_name=CONTAINER_NAME,
-                                blob_name=temp_blob_name,
-                                account_key=ACCOUNT_KEY,
-                                permission=BlobSasPermissions(read=True),
-                                expiry=datetime.datetime.utcnow() + datetime.timedelta(hours=1),
-                                content_disposition='inline'
-                            )
-                            result['view_url'] = f"{temp_blob_client.url}?{sas_token}"
-                        else:
-                            # Fallback to original if highlighting fails
-                            sas_token = generate_blob_sas(
-                                account_name=blob_service_client.account_name,
-                                container_name=CONTAINER_NAME,
-                                blob_name=blob_name,
-                                account_key=ACCOUNT_KEY,
-                                permission=BlobSasPermissions(read=True),
-                                expiry=datetime.datetime.utcnow() + datetime.timedelta(hours=1),
-                                content_disposition='inline'
-                            )
-                            result['view_url'] = f"{blob_client.url}?{sas_token}"
-                    else:
-                        # For other file types, use original blob
-                        sas_token = generate_blob_sas(
-                            account_name=blob_service_client.account_name,
-                            container_name=CONTAINER_NAME,
-                            blob_name=blob_name,
-                            account_key=ACCOUNT_KEY,
-                            permission=BlobSasPermissions(read=True),
-                            expiry=datetime.datetime.utcnow() + datetime.timedelta(hours=1),
-                            content_disposition='inline'
-                        )
-                        result['view_url'] = f"{blob_client.url}?{sas_token}"
-                    
-                    # Metadata
-                    props = blob_client.get_blob_properties()
-                    result['file_size'] = props.size
-                    result['last_modified'] = props.last_modified.isoformat()
-                    
-                except Exception as e:
-                    app.logger.error(f"Error generating SAS URL for blob {blob_name}: {str(e)}")
-                    result['view_url'] = None
-
-            # Highlight content
-            if 'content' in result:
-                result['highlighted_content'] = highlight_keywords(result['content'], user_query)
+            if SNIPPET_MODE == 'off':
+                highlight_result_content(result, user_query)
+                continue
+            highlights = result.pop('@search.highlights', None) or {}
+            if 'content' in highlights:
+                snippets = azure_snippets(highlights['content'])
             else:
-                result['highlighted_content'] = ''
+                snippets = extract_snippets(
+                    result.get('content', ''), user_query,
+                    window=SNIPPET_WINDOW_CHARS, max_fragments=SNIPPET_MAX_FRAGMENTS
+                )
+            result.pop('content', None)
+            result['snippets'] = [highlight_keywords(snippet, user_query) for snippet in snippets]
+        if SNIPPET_MODE != 'off':
+            trim_snippets(results, SNIPPET_RESPONSE_MAX_BYTES)
+
+def trim_snippets(results, max_bytes):
+    """Drop passages until they fit in max_bytes: first passages of higher-ranked hits go in first."""
+    budget = max_bytes
+    kept = [[] for _ in results]
+    rounds = max((len(result['snippets']) for result in results), default=0)
+    for round_index in range(rounds):
+        for result, keep in zip(results, kept):
+            if round_index < len(result['snippets']):
+                snippet = result['snippets'][round_index]
+                size = len(snippet.encode('utf-8'))
+                if size <= budget:
+                    keep.append(snippet)
+                    budget -= size
+    for result, keep in zip(results, kept):
+        if len(keep) < len(result['snippets']):
+            result['snippets_truncated'] = True
+        result['snippets'] = keep
 
-        return jsonify({'results': results})
+def build_content_lookup(blob_name, username):
+    """Azure Search payload fetching one document's full content, within the user's ACL."""
+    return {
+        "search": "*",
+        "select": "content,metadata_storage_name",
+        "top": 1,
+        "filter": f"authorized_users eq '{username}' and metadata_storage_name eq '{blob_name.replace(chr(39), chr(39) * 2)}'"
+    }
+
+def highlight_status(blob_name, user_query):
+    """'none' if a hit has no highlighted preview, 'ready' if one is cached, else 'on_demand'."""
+    ext, _ = get_file_type(blob_name)
+    if ext not in HIGHLIGHT_EXTENSIONS:
+        return 'none'
+    metadata = blob_metadata.get(blob_name)
+    if not metadata.exists:
+        return 'on_demand'
+    if uses_pdf_overlay(ext):
+        ready = (blob_name, metadata.etag, normalize_keywords(user_query)) in pdf_overlay_cache
+    elif uses_page_preview(ext):
+        ready = (blob_name, metadata.etag, normalize_keywords(user_query), 'layout') in page_cache
+    else:
+        ready = (blob_name, metadata.etag, normalize_keywords(user_query), ext) in highlight_cache
+    return 'ready' if ready else 'on_demand'
+
+def ndjson_line(message):
+    return json.dumps(message) + '\n'
+
+# Search API
+@app.route('/search', methods=['POST'])
+@login_required
+def search():
+    user_query = request.form.get('query')
+    
+    if not user_query:
+        return jsonify({'error': 'No query provided'}), 400
+
+    payload, cache_key = build_search(request.form, user_query, session['username'])
+    cached = result_cache.get(cache_key) if RESULT_CACHE_ENABLED else None
+    if cached is not None:
+        response = jsonify({'results': cached})
+        response.headers['X-Cache'] = 'HIT'
+        return response
+
+    try:
+        # The same user running the same search concurrently gets one search's results
+        results, cache_status = search_flights.do(
+            tuple(cache_key), run_search, payload, cache_key, user_query,
+            recheck=lambda: cached_search(cache_key)
+        )
+        response = jsonify({'results': results})
+        response.headers['X-Cache'] = cache_status
+        return response
     
+    except CircuitOpenError:
+        return jsonify({'error': 'Search service is temporarily unavailable. Please try again later.'}), 503
+    except requests.exceptions.RequestException as e:
+        app.logger.error(f"Search API error: {str(e)}")
+        return jsonify({'error': 'Search service error. Please try again later.'}), 500
+
+def run_search(payload, cache_key, user_query):
+    """Search, enrich and cache; returns (results, 'MISS')."""
+    started = time.monotonic()
+    with stage('search'):
+        results = search_client.search(payload).get("value", [])
+
+    complete = enrich_results(results)
+
+    for result in results:
+        if result.get('view_url'):
+            result['preview_url'] = build_preview_url(result['metadata_storage_name'], user_query)
+    add_snippets(results, user_query)
+
+    # Results degraded by enrichment timeouts or errors are not worth keeping
+    if RESULT_CACHE_ENABLED and complete:
+        result_cache.put(cache_key, results, time.monotonic() - started)
+    return results, 'MISS'
+
+def cached_search(cache_key):
+    """(results, 'HIT') if another process cached this search meanwhile, else None."""
+    cached = result_cache.get(cache_key) if RESULT_CACHE_ENABLED else None
+    return (cached, 'HIT') if cached is not None else None
+
+def search_hits(payload):
+    with stage('search'):
+        return search_client.search(payload).get("value", [])
+
+# Streaming search API (NDJSON)
+@app.route('/search/stream', methods=['POST'])
+@login_required
+def search_stream():
+    """Stream the ranked hits first, then each hit's enrichment as soon as it is ready.
+
+    Messages, one JSON object per line:
+      {"type": "hits", "results": [...]}            ranked hits, highlighted text
+      {"type": "result", "index": i, "view_url": ..., "file_size": ...,
+       "last_modified": ..., "preview_url": ..., "highlight_status": ...}
+      {"type": "done", "complete": bool}
+    Cached results arrive fully enriched in the "hits" message.
+    """
+    user_query = request.form.get('query')
+
+    if not user_query:
+        return jsonify({'error': 'No query provided'}), 400
+
+    payload, cache_key = build_search(request.form, user_query, session['username'])
+    cached = result_cache.get(cache_key) if RESULT_CACHE_ENABLED else None
+    if cached is not None:
+        return ndjson_response([
+            ndjson_line({'type': 'hits', 'results': cached}),
+            ndjson_line({'type': 'done', 'complete': True})
+        ], cache_status='HIT')
+
+    started = time.monotonic()
+    try:
+        # Hits are shared with concurrent identical searches; each stream enriches its own copies
+        results = [dict(result) for result in search_hit_flights.do(tuple(cache_key), search_hits, payload)]
+    except CircuitOpenError:
+        return jsonify({'error': 'Search service is temporarily unavailable. Please try again later.'}), 503
+    except requests.exceptions.RequestException as e:
+        app.logger.error(f"Search API error: {str(e)}")
+        return jsonify({'error': 'Search service error. Please try again later.'}), 500
+
+    add_snippets(results, user_query)
+
+    @stream_with_context
+    def generate():
+        yield ndjson_line({'type': 'hits', 'results': results})
+
+        complete = True
+        for index, enrichment, ok in iter_enrichments(results):
+            result = results[index]
+            result.update(enrichment)
+            complete = complete and ok
+            blob_name = result['metadata_storage_name']
+            if result.get('view_url'):
+                result['preview_url'] = build_preview_url(blob_name, user_query)
+            yield ndjson_line({
+                'type': 'result',
+                'index': index,
+                **enrichment,
+                'preview_url': result.get('preview_url'),
+                'highlight_status': highlight_status(blob_name, user_query) if result.get('view_url') else 'none'
+            })
+
+        if RESULT_CACHE_ENABLED and complete:
+            result_cache.put(cache_key, results, time.monotonic() - started)
+        yield ndjson_line({'type': 'done', 'complete': complete})
+
+    return ndjson_response(generate(), cache_status='MISS')
+
+def ndjson_response(lines, cache_status):
+    response = Response(lines, mimetype='application/x-ndjson')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Keep reverse proxies from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.headers['X-Cache'] = cache_status
+    return response
+
+# Full document text for a hit, fetched only when the user expands it
+@app.route('/content/<path:blob_name>')
+@login_required
+def document_content(blob_name):
+    user_query = request.args.get('q', '')
+    try:
+        with stage('search'):
+            documents = search_client.search(build_content_lookup(blob_name, session['username'])).get("value", [])
+    except CircuitOpenError:
+        return jsonify({'error': 'Search service is temporarily unavailable. Please try again later.'}), 503
     except requests.exceptions.RequestException as e:
         app.logger.error(f"Search API error: {str(e)}")
         return jsonify({'error': 'Search service error. Please try again later.'}), 500
 
+    # The ACL filter also hides documents the user may not read
+    if not documents:
+        return jsonify({'error': 'Document not found'}), 404
+    content = documents[0].get('content') or ''
+    return jsonify({'content': content, 'highlighted_content': highlight_keywords(content, user_query)})
+
+def valid_preview_token(blob_name):
+    """Whether the request's preview token was issued for this blob to the signed-in user."""
+    # Preview links are only handed out with search results the user is authorized for
+    try:
+        claims = preview_serializer.loads(request.args.get('token', ''), max_age=PREVIEW_LINK_MAX_AGE_SECONDS)
+    except BadSignature:
+        return False
+    return claims.get('blob') == blob_name and claims.get('user') == session['username']
+
+# Highlighted preview, built only when the user opens it
+@app.route('/preview/<path:blob_name>')
+@login_required
+def preview(blob_name):
+    user_query = request.args.get('q')
+    if not user_query:
+        return jsonify({'error': 'No query provided'}), 400
+
+    if not valid_preview_token(blob_name):
+        return jsonify({'error': 'Invalid or expired preview link'}), 403
+
+    ext, _ = get_file_type(blob_name)
+    if uses_pdf_overlay(ext):
+        # The viewer shows the original and fetches the hit coordinates itself; nothing is uploaded
+        return jsonify({
+            'view_url': sas_issuer.url(blob_name),
+            'highlighted': True,
+            'overlay_url': url_for('pdf_overlay', blob_name=blob_name, q=user_query, token=request.args.get('token'))
+        })
+    if uses_page_preview(ext):
+        # Pages are rendered as the viewer scrolls to them; the original stays the download
+        return jsonify({
+            'view_url': sas_issuer.url(blob_name),
+            'highlighted': True,
+            'page_preview_url': url_for('preview_pdf', blob_name=blob_name, q=user_query, token=request.args.get('token'))
+        })
+
+    try:
+        view_url, highlighted = build_highlighted_view_url(blob_name, user_query)
+        return jsonify({'view_url': view_url, 'highlighted': highlighted})
+    except ResourceNotFoundError:
+        return jsonify({'error': 'Document not found'}), 404
+    except Exception as e:
+        app.logger.error(f"Error building preview for blob {blob_name}: {str(e)}")
+        return jsonify({'error': 'Preview is not available for this document.'}), 500
+
+# Hit coordinates of a PDF preview, computed on first request
+@app.route('/overlay/<path:blob_name>')
+@login_required
+def pdf_overlay(blob_name):
+    user_query = request.args.get('q')
+    if not user_query:
+        return jsonify({'error': 'No query provided'}), 400
+    if not valid_preview_token(blob_name):
+        return jsonify({'error': 'Invalid or expired preview link'}), 403
+
+    try:
+        overlay = build_pdf_overlay(blob_name, user_query)
+    except ResourceNotFoundError:
+        return jsonify({'error': 'Document not found'}), 404
+    except PoolSaturatedError:
+        # The viewer shows the document without highlights
+        count_highlight('pdf', 'shed')
+        return busy_response()
+    except Exception as e:
+        app.logger.error(f"Error finding highlights for blob {blob_name}: {str(e)}")
+        count_highlight('pdf', 'failed')
+        return jsonify({'error': 'Highlights are not available for this document.'}), 500
+    response = jsonify(overlay)
+    response.headers['Cache-Control'] = 'private, max-age=300'
+    return response
+
+# PDF.js page viewer that draws overlay highlights over the original PDF
+@app.route('/pdf_viewer')
+@login_required
+def pdf_viewer():
+    return render_template('pdf_viewer.html')
+
+# Page-image preview of a PDF or Word document; pages are fetched as they scroll into view
+@app.route('/preview_pdf/<path:blob_name>')
+@login_required
+def preview_pdf(blob_name):
+    user_query = request.args.get('q')
+    if not user_query:
+        return jsonify({'error': 'No query provided'}), 400
+    if not valid_preview_token(blob_name):
+        return jsonify({'error': 'Invalid or expired preview link'}), 403
+
+    token = request.args.get('token')
+    return render_template(
+        'page_preview.html',
+        title=blob_name,
+        layout_url=url_for('preview_pdf_layout', blob_name=blob_name, q=user_query, token=token),
+        page_url=url_for('preview_pdf_page', blob_name=blob_name, q=user_query, token=token),
+        zoom=PAGE_PREVIEW_ZOOM,
+        max_zoom=PAGE_PREVIEW_MAX_ZOOM
+    )
+
+# Page sizes and pages with hits, for laying out a page preview before any page is rendered
+@app.route('/preview_pdf_layout/<path:blob_name>')
+@login_required
+def preview_pdf_layout(blob_name):
+    user_query = request.args.get('q')
+    if not user_query:
+        return jsonify({'error': 'No query provided'}), 400
+    if not valid_preview_token(blob_name):
+        return jsonify({'error': 'Invalid or expired preview link'}), 403
+
+    try:
+        layout = build_page_preview(blob_name, user_query, ('layout',))
+    except ResourceNotFoundError:
+        return jsonify({'error': 'Document not found'}), 404
+    except PoolSaturatedError:
+        return busy_response()
+    except Exception as e:
+        app.logger.error(f"Error laying out preview of blob {blob_name}: {str(e)}")
+        return jsonify({'error': 'Preview is not available for this document.'}), 500
+    response = jsonify(layout)
+    response.headers['Cache-Control'] = 'private, max-age=300'
+    return response
+
+# One rendered page of a page preview, as JPEG
+@app.route('/preview_pdf_page/<path:blob_name>')
+@login_required
+def preview_pdf_page(blob_name):
+    user_query = request.args.get('q')
+    if not user_query:
+        return jsonify({'error': 'No query provided'}), 400
+    if not valid_preview_token(blob_name):
+        return jsonify({'error': 'Invalid or expired preview link'}), 403
+    page = request.args.get('page', type=int)
+    if page is None or page < 1:
+        return jsonify({'error': 'No page provided'}), 400
+
+    part = ('page', page - 1, page_preview_zoom(request.args.get('zoom')))
+    try:
+        image = build_page_preview(blob_name, user_query, part)
+    except (ResourceNotFoundError, IndexError):
+        return jsonify({'error': 'Page not found'}), 404
+    except PoolSaturatedError:
+        return busy_response()
+    except Exception as e:
+        app.logger.error(f"Error rendering page {page} of blob {blob_name}: {str(e)}")
+        return jsonify({'error': 'Preview is not available for this document.'}), 500
+    response = Response(image, mimetype='image/jpeg')
+    response.headers['Cache-Control'] = 'private, max-age=300'
+    return response
+
+def busy_response():
+    """503 for a preview part shed because the highlight pool is saturated."""
+    response = jsonify({'error': 'Previews are busy. Please try again shortly.'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+# Cache statistics
+@app.route('/stats')
+@login_required
+def stats():
+    return jsonify({
+        'highlight_cache': highlight_cache.stats(),
+        'pdf_overlays': pdf_overlay_cache.stats(),
+        'page_previews': page_cache.stats(),
+        'highlight_pool': highlight_pool.stats() if highlight_pool is not None else None,
+        'blob_metadata': blob_metadata.stats(),
+        'sas_urls': sas_issuer.stats(),
+        'search_results': result_cache.stats(),
+        'source_cache': source_cache.stats() if source_cache is not None else None
+    })
+
+# Prometheus metrics: stage latency histograms, request counts, bytes and document types
+@app.route('/metrics')
+def prometheus_metrics():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+        return jsonify({'error': 'Unauthorized'}), 401
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
-  app.run(debug=True, port=5001, use_reloader=False)
+  app.run(debug=FLASK_DEBUG, port=5001, use_reloader=False)
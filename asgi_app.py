@@ -0,0 +1,756 @@
+"""Async (ASGI) serving mode.
+
+Serves the same routes as app.py with Quart, the async Azure Blob SDK
+(azure.storage.blob.aio) and aiohttp for the search endpoint, so one process
+holds hundreds of in-flight searches without a thread per request.
+CPU-bound highlighting runs on an executor so it never blocks the event loop.
+
+Configuration, caches and helpers are shared with app.py:
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5001
+"""
+import asyncio
+import contextvars
+import datetime
+import io
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceNotFoundError, ResourceModifiedError
+from azure.storage.blob.aio import BlobServiceClient
+from itsdangerous import BadSignature
+from quart import Quart, Response, g, render_template, request, jsonify, redirect, url_for, session, stream_with_context
+
+import app as sync_app
+from app import (
+    AZURE_STORAGE_CONNECTION_STRING, CONTAINER_NAME, API_KEY, endpoint, VALID_CREDENTIALS, SEARCH_BACKEND,
+    SEARCH_POOL_SIZE, SEARCH_CONNECT_TIMEOUT_SECONDS, SEARCH_READ_TIMEOUT_SECONDS, SEARCH_MAX_RETRIES,
+    SEARCH_BREAKER_FAILURE_THRESHOLD, SEARCH_BREAKER_RESET_SECONDS,
+    RESULT_CACHE_ENABLED, ENRICH_RESULT_TIMEOUT_SECONDS, PREVIEW_LINK_MAX_AGE_SECONDS,
+    RESULT_CACHE_SQLITE_PATH, SINGLEFLIGHT_LOCK_DIR, HIGHLIGHT_CACHE_TTL_SECONDS, HIGHLIGHT_EXTENSIONS, BLOB_METADATA_TTL_SECONDS,
+    BLOB_METADATA_MAX_ENTRIES, BLOB_METADATA_WARM_ON_START,
+    BLOB_TRANSFER_CHUNK_BYTES, BLOB_TRANSFER_CONCURRENCY, HIGHLIGHT_MEMORY_BUDGET_BYTES,
+    METRICS_TOKEN, count_highlight, open_buffer, get_pdf_word_index, uses_pdf_overlay, pdf_overlay_from_source,
+    uses_page_preview, page_preview_zoom, page_preview_from_source, render_page_preview, get_converted_pdf,
+    count_page_preview, PAGE_PREVIEW_ZOOM, PAGE_PREVIEW_MAX_ZOOM, build_search, add_snippets, build_content_lookup, ndjson_line, get_file_type, fallback_enrichment, highlighted_blob_name,
+    run_highlight_job, pdf_search_options, preview_serializer, result_cache, sas_issuer, highlight_cache, pdf_overlay_cache, page_cache
+)
+from blob_metadata import AsyncBlobMetadataCache
+from blob_transfer import MemoryBudget, download_into_async, upload_from_async
+from highlighter import highlight_keywords, highlight_docx, highlight_pdf, normalize_keywords
+from local_search import AsyncLocalSearchBackend
+from source_cache import AsyncSourceCache
+from highlight_pool import PoolSaturatedError
+from singleflight import AsyncSingleFlight
+from metrics import count, observe_request, render_prometheus, stage, start_request
+from search_client import AsyncAzureSearchClient, CircuitBreaker, CircuitOpenError, SearchServiceError
+
+# Threads for CPU-bound highlighting (python-docx, PyMuPDF) off the event loop
+ASYNC_HIGHLIGHT_WORKERS = int(os.getenv("ASYNC_HIGHLIGHT_WORKERS", str(os.cpu_count() or 1)))
+ASYNC_SEARCH_POOL_SIZE = int(os.getenv("ASYNC_SEARCH_POOL_SIZE", str(max(100, SEARCH_POOL_SIZE))))
+
+# Initialize Quart app; sessions are interchangeable with the Flask app's
+app = Quart(__name__)
+app.secret_key = sync_app.app.secret_key
+app.permanent_session_lifetime = sync_app.app.permanent_session_lifetime
+
+highlight_executor = ThreadPoolExecutor(max_workers=ASYNC_HIGHLIGHT_WORKERS, thread_name_prefix="highlight")
+
+if SEARCH_BACKEND == 'local':
+    # Share the index the Flask module already loaded
+    search_client = AsyncLocalSearchBackend(sync_app.search_client)
+else:
+    search_client = AsyncAzureSearchClient(
+        endpoint,
+        API_KEY,
+        pool_size=ASYNC_SEARCH_POOL_SIZE,
+        connect_timeout=SEARCH_CONNECT_TIMEOUT_SECONDS,
+        read_timeout=SEARCH_READ_TIMEOUT_SECONDS,
+        max_retries=SEARCH_MAX_RETRIES,
+        breaker=CircuitBreaker(
+            failure_threshold=SEARCH_BREAKER_FAILURE_THRESHOLD,
+            reset_timeout=SEARCH_BREAKER_RESET_SECONDS
+        )
+    )
+
+# Concurrent identical searches and highlight jobs share one execution, as in app.py
+search_flights = AsyncSingleFlight('search', SINGLEFLIGHT_LOCK_DIR if RESULT_CACHE_SQLITE_PATH else None)
+search_hit_flights = AsyncSingleFlight('search_hits')
+highlight_flights = AsyncSingleFlight('highlight', SINGLEFLIGHT_LOCK_DIR)
+preview_flights = AsyncSingleFlight('preview')
+
+# Share the source cache's files and index with the Flask module
+source_cache = AsyncSourceCache(sync_app.source_cache) if sync_app.source_cache is not None else None
+
+# Async Azure clients are bound to the event loop, so they are created at startup
+blob_service_client = None
+container_client = None
+blob_metadata = None
+
+@app.before_serving
+async def startup():
+    global blob_service_client, container_client, blob_metadata
+    blob_service_client = BlobServiceClient.from_connection_string(
+        AZURE_STORAGE_CONNECTION_STRING,
+        max_single_get_size=BLOB_TRANSFER_CHUNK_BYTES,
+        max_chunk_get_size=BLOB_TRANSFER_CHUNK_BYTES,
+        max_single_put_size=BLOB_TRANSFER_CHUNK_BYTES,
+        max_block_size=BLOB_TRANSFER_CHUNK_BYTES
+    )
+    container_client = blob_service_client.get_container_client(CONTAINER_NAME)
+    blob_metadata = AsyncBlobMetadataCache(
+        container_client,
+        ttl=BLOB_METADATA_TTL_SECONDS,
+        max_entries=BLOB_METADATA_MAX_ENTRIES
+    )
+    if BLOB_METADATA_WARM_ON_START:
+        app.add_background_task(warm_blob_metadata)
+
+@app.after_serving
+async def shutdown():
+    await search_client.close()
+    await blob_service_client.close()
+
+async def warm_blob_metadata():
+    try:
+        count = await blob_metadata.warm()
+        app.logger.info(f"Warmed blob metadata cache with {count} blobs")
+    except Exception as e:
+        app.logger.error(f"Error warming blob metadata cache: {str(e)}")
+
+@app.before_request
+async def make_session_permanent():
+    session.permanent = True
+
+@app.before_request
+async def start_request_timing():
+    g.timings = start_request()
+
+@app.after_request
+async def add_server_timing(response):
+    timings = g.get('timings')
+    if timings is not None:
+        response.headers['Server-Timing'] = timings.server_timing()
+        observe_request(request.endpoint or 'unknown', response.status_code, time.perf_counter() - timings.started)
+    return response
+
+# Helper for login required
+def login_required(f):
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        if 'username' not in session:
+            return redirect(url_for('login'))
+        return await f(*args, **kwargs)
+    return decorated_function
+
+async def run_highlighter(func, *args, **kwargs):
+    """Run a CPU-bound highlighter on the executor and await its result."""
+    loop = asyncio.get_running_loop()
+    # Run in a copy of the request's context so its stage timings count against it
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(highlight_executor, partial(context.run, func, *args, **kwargs))
+
+async def download_source(blob_client, size, budget, etag):
+    """Download a source blob into a DocumentBuffer, or map it from the source cache.
+
+    Raises ResourceModifiedError if the blob no longer has `etag`.
+    """
+    if source_cache is not None:
+        with stage('download'):
+            return await source_cache.open(blob_client, etag)
+
+    buffer = open_buffer(size, budget, 'source', os.path.splitext(blob_client.blob_name)[1])
+    try:
+        with stage('download'):
+            downloaded = await download_into_async(
+                blob_client, buffer, BLOB_TRANSFER_CONCURRENCY,
+                etag=etag, match_condition=MatchConditions.IfNotModified
+            )
+    except BaseException:
+        buffer.close()
+        raise
+    count('blob_bytes_downloaded', downloaded, 'Bytes downloaded from Blob Storage')
+    return buffer
+
+async def find_shared_highlighted_blob(temp_blob_client):
+    """(size, age in seconds) of a highlighted copy another worker already uploaded and that is still fresh, else None."""
+    try:
+        with stage('properties'):
+            props = await temp_blob_client.get_blob_properties()
+    except ResourceNotFoundError:
+        return None
+    created = props.creation_time
+    if created.tzinfo is None:
+        created = created.replace(tzinfo=datetime.timezone.utc)
+    age = datetime.datetime.now(datetime.timezone.utc) - created
+    if age.total_seconds() >= HIGHLIGHT_CACHE_TTL_SECONDS:
+        return None
+    return props.size, age.total_seconds()
+
+async def build_highlighted_view_url(blob_name, user_query, retry_if_modified=True):
+    """Return (view_url, highlighted) for a DOCX/PDF blob, reusing a cached highlighted copy if possible."""
+    ext, _ = get_file_type(blob_name)
+    keywords = normalize_keywords(user_query)
+
+    metadata = await blob_metadata.get(blob_name)
+    if not metadata.exists:
+        raise ResourceNotFoundError(f"Blob {blob_name} does not exist")
+    cache_key = (blob_name, metadata.etag, keywords, ext)
+    temp_blob_name = highlight_cache.get(cache_key)
+    if temp_blob_name:
+        count_highlight(ext, 'cached')
+        return sas_issuer.url(temp_blob_name), True
+
+    # Concurrent previews of the same version and keywords share one build and upload
+    return await highlight_flights.do(cache_key, build_highlighted_copy, blob_name, user_query, metadata, retry_if_modified)
+
+async def build_highlighted_copy(blob_name, user_query, metadata, retry_if_modified):
+    """Highlight and upload a blob version, or find the copy another process uploaded; returns (view_url, highlighted)."""
+    blob_client = container_client.get_blob_client(blob_name)
+    ext, _ = get_file_type(blob_name)
+    keywords = normalize_keywords(user_query)
+    etag = metadata.etag
+    cache_key = (blob_name, etag, keywords, ext)
+
+    temp_blob_name = highlighted_blob_name(blob_name, etag, keywords, ext)
+    temp_blob_client = container_client.get_blob_client(temp_blob_name)
+
+    # Another worker may already have built this exact copy
+    shared = await find_shared_highlighted_blob(temp_blob_client)
+    if shared is not None:
+        size, age = shared
+        # Reused only as long as one this worker had built then would be, so cleanup never sweeps it first
+        highlight_cache.put(cache_key, temp_blob_name, ttl=HIGHLIGHT_CACHE_TTL_SECONDS - age, size=size)
+        count_highlight(ext, 'shared')
+        return sas_issuer.url(temp_blob_name), True
+
+    # Source and highlighted copy share one memory budget; what doesn't fit goes to disk
+    budget = MemoryBudget(HIGHLIGHT_MEMORY_BUDGET_BYTES)
+    try:
+        source = await download_source(blob_client, metadata.size, budget, etag)
+    except ResourceModifiedError:
+        # The blob changed after its metadata was cached; key the copy on the new version
+        blob_metadata.invalidate(blob_name)
+        if not retry_if_modified:
+            raise
+        return await build_highlighted_view_url(blob_name, user_query, retry_if_modified=False)
+
+    with source:
+        highlighted = open_buffer(source.size, budget, 'output', f".{ext}")
+        try:
+            if ext in ['doc', 'docx']:
+                with stage('highlight_docx'):
+                    await run_highlighter(run_highlight_job, highlight_docx, source, user_query, highlighted)
+            elif ext == 'pdf':
+                word_index = await run_highlighter(get_pdf_word_index, blob_name, etag, source)
+                with stage('highlight_pdf'):
+                    await run_highlighter(
+                        run_highlight_job, highlight_pdf, source, user_query, highlighted,
+                        word_index=word_index, **pdf_search_options()
+                    )
+        except PoolSaturatedError:
+            # Every highlight worker is busy and the queue is full: serve the original now
+            highlighted.close()
+            count_highlight(ext, 'shed')
+            return sas_issuer.url(blob_name), False
+        except Exception as e:
+            app.logger.error(f"Error highlighting {blob_name}: {str(e)}")
+            highlighted.close()
+            highlighted = None
+
+    if highlighted is None:
+        # Highlighting failed: use the original blob
+        count_highlight(ext, 'failed')
+        return sas_issuer.url(blob_name), False
+
+    # Upload the highlighted version under its content-addressed name, in blocks
+    with highlighted, stage('upload'):
+        uploaded = await upload_from_async(temp_blob_client, highlighted, BLOB_TRANSFER_CONCURRENCY)
+    count('blob_bytes_uploaded', uploaded, 'Bytes uploaded to Blob Storage')
+    highlight_cache.put(cache_key, temp_blob_name, size=uploaded)
+    count_highlight(ext, 'built')
+    return sas_issuer.url(temp_blob_name), True
+
+async def build_pdf_overlay(blob_name, user_query, retry_if_modified=True):
+    """Hit coordinates of a PDF for the viewer to draw over the original blob, cached per (blob, ETag, keywords)."""
+    keywords = normalize_keywords(user_query)
+    metadata = await blob_metadata.get(blob_name)
+    if not metadata.exists:
+        raise ResourceNotFoundError(f"Blob {blob_name} does not exist")
+    cache_key = (blob_name, metadata.etag, keywords)
+    overlay = pdf_overlay_cache.get(cache_key)
+    if overlay is not None:
+        count_highlight('pdf', 'cached')
+        return overlay
+    return await preview_flights.do(cache_key, compute_pdf_overlay, blob_name, user_query, metadata, retry_if_modified)
+
+async def compute_pdf_overlay(blob_name, user_query, metadata, retry_if_modified):
+    """Download a PDF version and find its overlay hits, caching them."""
+    cache_key = (blob_name, metadata.etag, normalize_keywords(user_query))
+    blob_client = container_client.get_blob_client(blob_name)
+    try:
+        source = await download_source(blob_client, metadata.size, MemoryBudget(HIGHLIGHT_MEMORY_BUDGET_BYTES), metadata.etag)
+    except ResourceModifiedError:
+        # The blob changed after its metadata was cached; key the overlay on the new version
+        blob_metadata.invalidate(blob_name)
+        if not retry_if_modified:
+            raise
+        return await build_pdf_overlay(blob_name, user_query, retry_if_modified=False)
+
+    with source:
+        overlay = await run_highlighter(pdf_overlay_from_source, blob_name, metadata.etag, source, user_query)
+    pdf_overlay_cache.put(cache_key, overlay, size=len(json.dumps(overlay)))
+    count_highlight('pdf', 'overlay')
+    return overlay
+
+async def build_page_preview(blob_name, user_query, part, retry_if_modified=True):
+    """A part of a page preview, cached per (blob, ETag, keywords, part); see app.build_page_preview()."""
+    keywords = normalize_keywords(user_query)
+    metadata = await blob_metadata.get(blob_name)
+    if not metadata.exists:
+        raise ResourceNotFoundError(f"Blob {blob_name} does not exist")
+    cache_key = (blob_name, metadata.etag, keywords) + part
+    value = page_cache.get(cache_key)
+    if value is not None:
+        count_page_preview(part, 'cached')
+        return value
+    return await preview_flights.do(cache_key, compute_page_preview, blob_name, user_query, part, metadata, retry_if_modified)
+
+async def compute_page_preview(blob_name, user_query, part, metadata, retry_if_modified):
+    """Render a page preview part of a blob version, caching it."""
+    cache_key = (blob_name, metadata.etag, normalize_keywords(user_query)) + part
+    ext, _ = get_file_type(blob_name)
+    converted = None if ext == 'pdf' else get_converted_pdf(blob_name, metadata.etag)
+    if converted is not None:
+        value = await run_highlighter(render_page_preview, io.BytesIO(converted), None, user_query, part)
+    else:
+        blob_client = container_client.get_blob_client(blob_name)
+        try:
+            source = await download_source(blob_client, metadata.size, MemoryBudget(HIGHLIGHT_MEMORY_BUDGET_BYTES), metadata.etag)
+        except ResourceModifiedError:
+            # The blob changed after its metadata was cached; key the preview on the new version
+            blob_metadata.invalidate(blob_name)
+            if not retry_if_modified:
+                raise
+            return await build_page_preview(blob_name, user_query, part, retry_if_modified=False)
+        with source:
+            value = await run_highlighter(page_preview_from_source, blob_name, metadata.etag, source, user_query, part)
+
+    page_cache.put(cache_key, value, size=len(value) if isinstance(value, bytes) else len(json.dumps(value)))
+    count_page_preview(part, 'rendered')
+    return value
+
+async def enrich_result(blob_name):
+    """Look up and sign a single hit; returns the fields to merge into it."""
+    metadata = await blob_metadata.get(blob_name)
+    if not metadata.exists:
+        return {'view_url': None}
+
+    _, file_type = get_file_type(blob_name)
+    count('search_hits', 1, 'Search hits by document type', file_type=file_type)
+    return {
+        'file_type': file_type,
+        'view_url': sas_issuer.url(blob_name),
+        'file_size': metadata.size,
+        'last_modified': metadata.last_modified.isoformat()
+    }
+
+async def enrich_indexed(index, blob_name):
+    try:
+        return index, await asyncio.wait_for(enrich_result(blob_name), ENRICH_RESULT_TIMEOUT_SECONDS), True
+    except asyncio.TimeoutError:
+        app.logger.warning(f"Enrichment timed out for blob {blob_name}, using plain link")
+    except Exception as e:
+        app.logger.error(f"Error enriching blob {blob_name}: {str(e)}")
+    return index, fallback_enrichment(blob_name), False
+
+async def iter_enrichments(results):
+    """Enrich all hits concurrently, yielding (index, enrichment, ok) as each finishes."""
+    pending = [
+        enrich_indexed(index, result['metadata_storage_name'])
+        for index, result in enumerate(results) if 'metadata_storage_path' in result
+    ]
+    for next_done in asyncio.as_completed(pending):
+        yield await next_done
+
+async def enrich_results(results):
+    """Enrich all hits in place, keeping result order; returns False if any hit fell back."""
+    complete = True
+    async for index, enrichment, ok in iter_enrichments(results):
+        results[index].update(enrichment)
+        complete = complete and ok
+    return complete
+
+async def highlight_status(blob_name, user_query):
+    """'none' if a hit has no highlighted preview, 'ready' if one is cached, else 'on_demand'."""
+    ext, _ = get_file_type(blob_name)
+    if ext not in HIGHLIGHT_EXTENSIONS:
+        return 'none'
+    metadata = await blob_metadata.get(blob_name)
+    if not metadata.exists:
+        return 'on_demand'
+    if uses_pdf_overlay(ext):
+        ready = (blob_name, metadata.etag, normalize_keywords(user_query)) in pdf_overlay_cache
+    elif uses_page_preview(ext):
+        ready = (blob_name, metadata.etag, normalize_keywords(user_query), 'layout') in page_cache
+    else:
+        ready = (blob_name, metadata.etag, normalize_keywords(user_query), ext) in highlight_cache
+    return 'ready' if ready else 'on_demand'
+
+def build_preview_url(blob_name, user_query):
+    """Signed link to the on-demand highlighted preview of a hit, or None if it has none."""
+    ext, _ = get_file_type(blob_name)
+    if ext not in HIGHLIGHT_EXTENSIONS:
+        return None
+    token = preview_serializer.dumps({'blob': blob_name, 'user': session['username']})
+    return url_for('preview', blob_name=blob_name, q=user_query, token=token)
+
+# Login page
+@app.route('/login', methods=['GET', 'POST'])
+async def login():
+    if request.method == 'POST':
+        form = await request.form
+        username = form.get('username')
+        password = form.get('password')
+
+        if username in VALID_CREDENTIALS and VALID_CREDENTIALS[username] == password:
+            session['username'] = username
+            return redirect(url_for('index'))
+        else:
+            return await render_template('login.html', error='Invalid username or password')
+
+    return await render_template('login.html')
+
+# Logout
+@app.route('/logout')
+async def logout():
+    session.pop('username', None)
+    return redirect(url_for('login'))
+
+# Home page
+@app.route('/')
+@login_required
+async def index():
+    return await render_template('index.html')
+
+# Search API
+@app.route('/search', methods=['POST'])
+@login_required
+async def search():
+    form = await request.form
+    user_query = form.get('query')
+
+    if not user_query:
+        return jsonify({'error': 'No query provided'}), 400
+
+    payload, cache_key = build_search(form, user_query, session['username'])
+    cached = result_cache.get(cache_key) if RESULT_CACHE_ENABLED else None
+    if cached is not None:
+        response = jsonify({'results': cached})
+        response.headers['X-Cache'] = 'HIT'
+        return response
+
+    try:
+        # The same user running the same search concurrently gets one search's results
+        results, cache_status = await search_flights.do(
+            tuple(cache_key), run_search, payload, cache_key, user_query,
+            recheck=partial(cached_search, cache_key)
+        )
+        response = jsonify({'results': results})
+        response.headers['X-Cache'] = cache_status
+        return response
+
+    except CircuitOpenError:
+        return jsonify({'error': 'Search service is temporarily unavailable. Please try again later.'}), 503
+    except SearchServiceError as e:
+        app.logger.error(f"Search API error: {str(e)}")
+        return jsonify({'error': 'Search service error. Please try again later.'}), 500
+
+async def run_search(payload, cache_key, user_query):
+    """Search, enrich and cache; returns (results, 'MISS')."""
+    started = time.monotonic()
+    with stage('search'):
+        results = (await search_client.search(payload)).get("value", [])
+
+    complete = await enrich_results(results)
+
+    for result in results:
+        if result.get('view_url'):
+            result['preview_url'] = build_preview_url(result['metadata_storage_name'], user_query)
+    add_snippets(results, user_query)
+
+    if RESULT_CACHE_ENABLED and complete:
+        result_cache.put(cache_key, results, time.monotonic() - started)
+    return results, 'MISS'
+
+async def cached_search(cache_key):
+    """(results, 'HIT') if another process cached this search meanwhile, else None."""
+    return sync_app.cached_search(cache_key)
+
+async def search_hits(payload):
+    with stage('search'):
+        return (await search_client.search(payload)).get("value", [])
+
+# Streaming search API (NDJSON), same messages as the Flask route
+@app.route('/search/stream', methods=['POST'])
+@login_required
+async def search_stream():
+    form = await request.form
+    user_query = form.get('query')
+
+    if not user_query:
+        return jsonify({'error': 'No query provided'}), 400
+
+    payload, cache_key = build_search(form, user_query, session['username'])
+    cached = result_cache.get(cache_key) if RESULT_CACHE_ENABLED else None
+    if cached is not None:
+        return ndjson_response([
+            ndjson_line({'type': 'hits', 'results': cached}),
+            ndjson_line({'type': 'done', 'complete': True})
+        ], cache_status='HIT')
+
+    started = time.monotonic()
+    try:
+        # Hits are shared with concurrent identical searches; each stream enriches its own copies
+        results = [dict(result) for result in await search_hit_flights.do(tuple(cache_key), search_hits, payload)]
+    except CircuitOpenError:
+        return jsonify({'error': 'Search service is temporarily unavailable. Please try again later.'}), 503
+    except SearchServiceError as e:
+        app.logger.error(f"Search API error: {str(e)}")
+        return jsonify({'error': 'Search service error. Please try again later.'}), 500
+
+    add_snippets(results, user_query)
+
+    @stream_with_context
+    async def generate():
+        yield ndjson_line({'type': 'hits', 'results': results})
+
+        complete = True
+        async for index, enrichment, ok in iter_enrichments(results):
+            result = results[index]
+            result.update(enrichment)
+            complete = complete and ok
+            blob_name = result['metadata_storage_name']
+            if result.get('view_url'):
+                result['preview_url'] = build_preview_url(blob_name, user_query)
+            yield ndjson_line({
+                'type': 'result',
+                'index': index,
+                **enrichment,
+                'preview_url': result.get('preview_url'),
+                'highlight_status': await highlight_status(blob_name, user_query) if result.get('view_url') else 'none'
+            })
+
+        if RESULT_CACHE_ENABLED and complete:
+            result_cache.put(cache_key, results, time.monotonic() - started)
+        yield ndjson_line({'type': 'done', 'complete': complete})
+
+    return ndjson_response(generate(), cache_status='MISS')
+
+def ndjson_response(lines, cache_status):
+    response = Response(lines, mimetype='application/x-ndjson')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.headers['X-Cache'] = cache_status
+    # Quart would otherwise time out long streams after 60s
+    response.timeout = None
+    return response
+
+# Full document text for a hit, fetched only when the user expands it
+@app.route('/content/<path:blob_name>')
+@login_required
+async def document_content(blob_name):
+    user_query = request.args.get('q', '')
+    try:
+        with stage('search'):
+            documents = (await search_client.search(build_content_lookup(blob_name, session['username']))).get("value", [])
+    except CircuitOpenError:
+        return jsonify({'error': 'Search service is temporarily unavailable. Please try again later.'}), 503
+    except SearchServiceError as e:
+        app.logger.error(f"Search API error: {str(e)}")
+        return jsonify({'error': 'Search service error. Please try again later.'}), 500
+
+    if not documents:
+        return jsonify({'error': 'Document not found'}), 404
+    content = documents[0].get('content') or ''
+    return jsonify({'content': content, 'highlighted_content': highlight_keywords(content, user_query)})
+
+def valid_preview_token(blob_name):
+    """Whether the request's preview token was issued for this blob to the signed-in user."""
+    # Preview links are only handed out with search results the user is authorized for
+    try:
+        claims = preview_serializer.loads(request.args.get('token', ''), max_age=PREVIEW_LINK_MAX_AGE_SECONDS)
+    except BadSignature:
+        return False
+    return claims.get('blob') == blob_name and claims.get('user') == session['username']
+
+# Highlighted preview, built only when the user opens it
+@app.route('/preview/<path:blob_name>')
+@login_required
+async def preview(blob_name):
+    user_query = request.args.get('q')
+    if not user_query:
+        return jsonify({'error': 'No query provided'}), 400
+
+    if not valid_preview_token(blob_name):
+        return jsonify({'error': 'Invalid or expired preview link'}), 403
+
+    ext, _ = get_file_type(blob_name)
+    if uses_pdf_overlay(ext):
+        # The viewer shows the original and fetches the hit coordinates itself; nothing is uploaded
+        return jsonify({
+            'view_url': sas_issuer.url(blob_name),
+            'highlighted': True,
+            'overlay_url': url_for('pdf_overlay', blob_name=blob_name, q=user_query, token=request.args.get('token'))
+        })
+    if uses_page_preview(ext):
+        # Pages are rendered as the viewer scrolls to them; the original stays the download
+        return jsonify({
+            'view_url': sas_issuer.url(blob_name),
+            'highlighted': True,
+            'page_preview_url': url_for('preview_pdf', blob_name=blob_name, q=user_query, token=request.args.get('token'))
+        })
+
+    try:
+        view_url, highlighted = await build_highlighted_view_url(blob_name, user_query)
+        return jsonify({'view_url': view_url, 'highlighted': highlighted})
+    except ResourceNotFoundError:
+        return jsonify({'error': 'Document not found'}), 404
+    except Exception as e:
+        app.logger.error(f"Error building preview for blob {blob_name}: {str(e)}")
+        return jsonify({'error': 'Preview is not available for this document.'}), 500
+
+# Hit coordinates of a PDF preview, computed on first request
+@app.route('/overlay/<path:blob_name>')
+@login_required
+async def pdf_overlay(blob_name):
+    user_query = request.args.get('q')
+    if not user_query:
+        return jsonify({'error': 'No query provided'}), 400
+    if not valid_preview_token(blob_name):
+        return jsonify({'error': 'Invalid or expired preview link'}), 403
+
+    try:
+        overlay = await build_pdf_overlay(blob_name, user_query)
+    except ResourceNotFoundError:
+        return jsonify({'error': 'Document not found'}), 404
+    except PoolSaturatedError:
+        # The viewer shows the document without highlights
+        count_highlight('pdf', 'shed')
+        return busy_response()
+    except Exception as e:
+        app.logger.error(f"Error finding highlights for blob {blob_name}: {str(e)}")
+        count_highlight('pdf', 'failed')
+        return jsonify({'error': 'Highlights are not available for this document.'}), 500
+    response = jsonify(overlay)
+    response.headers['Cache-Control'] = 'private, max-age=300'
+    return response
+
+# PDF.js page viewer that draws overlay highlights over the original PDF
+@app.route('/pdf_viewer')
+@login_required
+async def pdf_viewer():
+    return await render_template('pdf_viewer.html')
+
+# Page-image preview of a PDF or Word document; pages are fetched as they scroll into view
+@app.route('/preview_pdf/<path:blob_name>')
+@login_required
+async def preview_pdf(blob_name):
+    user_query = request.args.get('q')
+    if not user_query:
+        return jsonify({'error': 'No query provided'}), 400
+    if not valid_preview_token(blob_name):
+        return jsonify({'error': 'Invalid or expired preview link'}), 403
+
+    token = request.args.get('token')
+    return await render_template(
+        'page_preview.html',
+        title=blob_name,
+        layout_url=url_for('preview_pdf_layout', blob_name=blob_name, q=user_query, token=token),
+        page_url=url_for('preview_pdf_page', blob_name=blob_name, q=user_query, token=token),
+        zoom=PAGE_PREVIEW_ZOOM,
+        max_zoom=PAGE_PREVIEW_MAX_ZOOM
+    )
+
+# Page sizes and pages with hits, for laying out a page preview before any page is rendered
+@app.route('/preview_pdf_layout/<path:blob_name>')
+@login_required
+async def preview_pdf_layout(blob_name):
+    user_query = request.args.get('q')
+    if not user_query:
+        return jsonify({'error': 'No query provided'}), 400
+    if not valid_preview_token(blob_name):
+        return jsonify({'error': 'Invalid or expired preview link'}), 403
+
+    try:
+        layout = await build_page_preview(blob_name, user_query, ('layout',))
+    except ResourceNotFoundError:
+        return jsonify({'error': 'Document not found'}), 404
+    except PoolSaturatedError:
+        return busy_response()
+    except Exception as e:
+        app.logger.error(f"Error laying out preview of blob {blob_name}: {str(e)}")
+        return jsonify({'error': 'Preview is not available for this document.'}), 500
+    response = jsonify(layout)
+    response.headers['Cache-Control'] = 'private, max-age=300'
+    return response
+
+# One rendered page of a page preview, as JPEG
+@app.route('/preview_pdf_page/<path:blob_name>')
+@login_required
+async def preview_pdf_page(blob_name):
+    user_query = request.args.get('q')
+    if not user_query:
+        return jsonify({'error': 'No query provided'}), 400
+    if not valid_preview_token(blob_name):
+        return jsonify({'error': 'Invalid or expired preview link'}), 403
+    page = request.args.get('page', type=int)
+    if page is None or page < 1:
+        return jsonify({'error': 'No page provided'}), 400
+
+    part = ('page', page - 1, page_preview_zoom(request.args.get('zoom')))
+    try:
+        image = await build_page_preview(blob_name, user_query, part)
+    except (ResourceNotFoundError, IndexError):
+        return jsonify({'error': 'Page not found'}), 404
+    except PoolSaturatedError:
+        return busy_response()
+    except Exception as e:
+        app.logger.error(f"Error rendering page {page} of blob {blob_name}: {str(e)}")
+        return jsonify({'error': 'Preview is not available for this document.'}), 500
+    response = Response(image, mimetype='image/jpeg')
+    response.headers['Cache-Control'] = 'private, max-age=300'
+    return response
+
+def busy_response():
+    """503 for a preview part shed because the highlight pool is saturated."""
+    response = jsonify({'error': 'Previews are busy. Please try again shortly.'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+# Cache statistics
+@app.route('/stats')
+@login_required
+async def stats():
+    return jsonify({
+        'highlight_cache': highlight_cache.stats(),
+        'pdf_overlays': pdf_overlay_cache.stats(),
+        'page_previews': page_cache.stats(),
+        'highlight_pool': sync_app.highlight_pool.stats() if sync_app.highlight_pool is not None else None,
+        'blob_metadata': blob_metadata.stats(),
+        'sas_urls': sas_issuer.stats(),
+        'search_results': result_cache.stats(),
+        'source_cache': source_cache.stats() if source_cache is not None else None
+    })
+
+# Prometheus metrics: stage latency histograms, request counts, bytes and document types
+@app.route('/metrics')
+async def prometheus_metrics():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+        return jsonify({'error': 'Unauthorized'}), 401
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
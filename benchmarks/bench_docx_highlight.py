@@ -0,0 +1,103 @@
+"""Benchmark DOCX keyword highlighting on large synthetic documents.
+
+Builds a document of --pages pages (body paragraphs with keywords split
+across runs, a table every few pages, header and footer), then times
+highlight_docx() end to end (parse, highlight, save).
+
+    python benchmarks/bench_docx_highlight.py --pages 500 --repeat 3
+"""
+import argparse
+import io
+import os
+import random
+import statistics
+import sys
+import time
+
+from docx import Document
+from docx.enum.text import WD_BREAK
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from highlighter import get_matcher, highlight_docx, highlight_docx_document  # noqa: E402
+
+WORDS = (
+    "agreement party shall herein pursuant obligation term notice payment "
+    "services liability clause section provided period written consent"
+).split()
+
+
+def build_document(pages, paragraphs_per_page, words_per_paragraph, keywords, density, seed=0):
+    """Return DOCX bytes of a synthetic document with roughly `pages` pages."""
+    rng = random.Random(seed)
+    doc = Document()
+    section = doc.sections[0]
+    section.header.paragraphs[0].text = f"Confidential {keywords[0]} header"
+    section.footer.paragraphs[0].text = f"Page footer {keywords[-1]}"
+
+    for page in range(pages):
+        for _ in range(paragraphs_per_page):
+            words = [
+                rng.choice(keywords) if rng.random() < density else rng.choice(WORDS)
+                for _ in range(words_per_paragraph)
+            ]
+            paragraph = doc.add_paragraph()
+            # Emit the text as several runs, cutting some words in half so that
+            # keywords straddle run boundaries the way Word often stores them
+            run_text = ''
+            for word in words:
+                if len(word) > 3 and rng.random() < 0.1:
+                    cut = len(word) // 2
+                    paragraph.add_run(run_text + word[:cut])
+                    run_text = word[cut:] + ' '
+                else:
+                    run_text += word + ' '
+            paragraph.add_run(run_text)
+
+        if page % 10 == 0:
+            table = doc.add_table(rows=3, cols=3)
+            for cell in table._cells:
+                cell.text = f"{rng.choice(WORDS)} {rng.choice(keywords)} {rng.choice(WORDS)}"
+
+        doc.paragraphs[-1].runs[-1].add_break(WD_BREAK.PAGE)
+
+    output = io.BytesIO()
+    doc.save(output)
+    return output.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, default=500)
+    parser.add_argument('--paragraphs-per-page', type=int, default=6)
+    parser.add_argument('--words-per-paragraph', type=int, default=80)
+    parser.add_argument('--keywords', default='contract renewal indemnity')
+    parser.add_argument('--density', type=float, default=0.02,
+                        help='fraction of words that are keywords')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    keywords = args.keywords.split()
+    started = time.perf_counter()
+    docx_bytes = build_document(
+        args.pages, args.paragraphs_per_page, args.words_per_paragraph, keywords, args.density
+    )
+    print(f"built {args.pages} pages, {len(docx_bytes) / 1024 ** 2:.1f} MB "
+          f"in {time.perf_counter() - started:.1f}s")
+
+    matches = highlight_docx_document(Document(io.BytesIO(docx_bytes)), get_matcher(args.keywords))
+
+    timings = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        highlight_docx(docx_bytes, args.keywords)
+        timings.append(time.perf_counter() - started)
+
+    best = min(timings)
+    print(f"matches: {matches}")
+    print(f"highlight_docx: best {best:.2f}s, median {statistics.median(timings):.2f}s "
+          f"over {args.repeat} runs ({args.pages / best:.0f} pages/s, {matches / best:.0f} matches/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,379 @@
+"""End-to-end benchmark of /search and highlighted previews against local Azure stand-ins.
+
+Seeds a synthetic corpus of TXT, DOCX and PDF files, then for every
+scenario starts the Flask app in a fresh process with Blob Storage replaced
+by an in-memory fake (fake_blob_storage.py) and Azure Search replaced by
+the local BM25 backend (SEARCH_BACKEND=local) over the corpus. Simulated
+users log in over HTTP and, in lock-step rounds, each run one search and
+open the highlighted preview of its first --previews hits (for PDFs in
+overlay mode, the preview plus its hit coordinates).
+
+Scenarios combine a corpus mix (text-only, docx-heavy, pdf-heavy), a cache
+state (cold: every app cache is cleared before each round; warm: a warm-up
+pass over all queries first) and a number of concurrent users. Each one
+reports p50/p95/p99 latency of searches and previews, throughput, peak
+RSS of the app process (and of its PDF worker processes) and blob calls.
+
+Results are written to benchmarks/results/<commit>.json; compare two runs
+to catch regressions in highlight_keywords_in_pdf and friends:
+
+    python benchmarks/bench_search.py --docs 60 --users 1,4,16,64
+    python benchmarks/bench_search.py --compare benchmarks/results/abc1234.json benchmarks/results/def5678.json
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+BENCH_USER = 'bench'
+BENCH_PASSWORD = 'bench'
+
+WORDS = (
+    "agreement party shall herein pursuant obligation term notice payment "
+    "services liability clause section provided period written consent"
+).split()
+
+# Share of each file type per corpus
+CORPUS_MIXES = {
+    'text-only': {'txt': 1.0},
+    'docx-heavy': {'docx': 0.8, 'pdf': 0.1, 'txt': 0.1},
+    'pdf-heavy': {'pdf': 0.8, 'docx': 0.1, 'txt': 0.1},
+}
+
+# Latency and throughput metrics where higher is worse, for --compare
+COMPARED_METRICS = [
+    ('search', 'p50'), ('search', 'p95'), ('search', 'p99'),
+    ('preview', 'p50'), ('preview', 'p95'), ('preview', 'p99'),
+]
+
+
+def random_words(rng, count, keywords, density):
+    return ' '.join(rng.choice(keywords) if rng.random() < density else rng.choice(WORDS) for _ in range(count))
+
+
+def build_txt(pages, words_per_page, keywords, density, rng):
+    return '\n\n'.join(random_words(rng, words_per_page, keywords, density) for _ in range(pages)).encode()
+
+
+def build_docx(pages, words_per_page, keywords, density, rng):
+    from docx import Document
+    from docx.enum.text import WD_BREAK
+
+    doc = Document()
+    for _ in range(pages):
+        for _ in range(4):
+            doc.add_paragraph(random_words(rng, words_per_page // 4, keywords, density))
+        doc.paragraphs[-1].runs[-1].add_break(WD_BREAK.PAGE)
+    output = io.BytesIO()
+    doc.save(output)
+    return output.getvalue()
+
+
+def build_pdf(pages, words_per_page, keywords, density, rng):
+    import fitz
+
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page()
+        page.insert_textbox(page.rect + (50, 50, -50, -50), random_words(rng, words_per_page, keywords, density), fontsize=9)
+    return doc.tobytes()
+
+
+BUILDERS = {'txt': build_txt, 'docx': build_docx, 'pdf': build_pdf}
+
+
+def seed_corpus(root, args):
+    """Write one folder of synthetic documents per corpus mix, with an acl.json granting BENCH_USER."""
+    keywords = args.keywords.split()
+    for mix, shares in CORPUS_MIXES.items():
+        folder = os.path.join(root, mix)
+        os.makedirs(folder, exist_ok=True)
+        rng = random.Random(f"{args.seed}-{mix}")
+        for ext, share in shares.items():
+            for number in range(max(1, round(args.docs * share))):
+                data = BUILDERS[ext](args.pages, args.words_per_page, keywords, args.density, rng)
+                with open(os.path.join(folder, f"{ext}_{number:05d}.{ext}"), 'wb') as f:
+                    f.write(data)
+        with open(os.path.join(folder, 'acl.json'), 'w') as f:
+            json.dump({'*': [BENCH_USER]}, f)
+
+
+def percentiles(samples):
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def at(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    return {
+        'count': len(ordered),
+        'mean': statistics.fmean(ordered),
+        'p50': at(0.50),
+        'p95': at(0.95),
+        'p99': at(0.99),
+        'max': ordered[-1],
+    }
+
+
+def run_scenario(spec):
+    """Run one scenario in this process and return its metrics; see main() for spec."""
+    import fake_blob_storage
+
+    folder = spec['folder']
+    store = fake_blob_storage.MemoryBlobStore(latency=spec['blob_latency_ms'] / 1000)
+    for name in os.listdir(folder):
+        if name != 'acl.json' and not name.endswith('.pickle'):
+            with open(os.path.join(folder, name), 'rb') as f:
+                store.put(name, f.read())
+    fake_blob_storage.install(store)
+
+    os.environ.update({
+        'SEARCH_BACKEND': 'local',
+        'LOCAL_SEARCH_ROOT': folder,
+        'LOCAL_SEARCH_INDEX_PATH': os.path.join(folder, 'index.pickle'),
+        'SOURCE_CACHE_DIR': tempfile.mkdtemp(prefix='bench_source_cache_'),
+        'AZURE_STORAGE_CONNECTION_STRING': 'UseDevelopmentStorage=true',
+        'CONTAINER_NAME': 'documents',
+        # Any base64 string signs SAS URLs; nothing ever verifies them
+        'ACCOUNT_KEY': 'YmVuY2htYXJrLWFjY291bnQta2V5LW5vdC1hLXNlY3JldA==',
+        'ADMIN_USERNAME': BENCH_USER,
+        'ADMIN_PASSWORD': BENCH_PASSWORD,
+        'FLASK_SECRET_KEY': 'benchmark',
+    })
+    import requests
+    from werkzeug.serving import make_server
+
+    import app as search_app
+
+    server = make_server('127.0.0.1', 0, search_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    def clear_caches():
+        search_app.result_cache.clear()
+        search_app.highlight_cache.clear()
+        search_app.pdf_overlay_cache.clear()
+        search_app.page_cache.clear()
+        search_app.blob_metadata.clear()
+        search_app.sas_issuer.clear()
+        if search_app.source_cache is not None:
+            search_app.source_cache.clear()
+
+    queries = spec['queries']
+    users = spec['users']
+    samples = {'search': [], 'preview': []}
+    cache_hits = []
+    errors = []
+    lock = threading.Lock()
+
+    def one_request(session, query, record):
+        started = time.perf_counter()
+        response = session.post(f"{base_url}/search", data={'query': query})
+        elapsed = time.perf_counter() - started
+        if response.status_code != 200:
+            errors.append(f"search {response.status_code}")
+            return
+        previews = [hit['preview_url'] for hit in response.json()['results'] if hit.get('preview_url')]
+        preview_times = []
+        for preview_url in previews[:spec['previews']]:
+            started = time.perf_counter()
+            preview = session.get(f"{base_url}{preview_url}")
+            if preview.status_code == 200 and preview.json().get('overlay_url'):
+                # PDF overlay mode: the viewer fetches the hit coordinates next
+                preview = session.get(f"{base_url}{preview.json()['overlay_url']}")
+            preview_times.append(time.perf_counter() - started)
+            if preview.status_code != 200:
+                errors.append(f"preview {preview.status_code}")
+        if record:
+            with lock:
+                samples['search'].append(elapsed)
+                samples['preview'].extend(preview_times)
+                cache_hits.append(response.headers.get('X-Cache') == 'HIT')
+
+    sessions = []
+    for _ in range(users):
+        session = requests.Session()
+        session.post(f"{base_url}/login", data={'username': BENCH_USER, 'password': BENCH_PASSWORD})
+        sessions.append(session)
+
+    warmup_rounds = len(queries) if spec['cache'] == 'warm' else 0
+    total_rounds = warmup_rounds + spec['rounds']
+    barrier = threading.Barrier(users + 1)
+
+    def user(number):
+        session = sessions[number]
+        for round_number in range(total_rounds):
+            barrier.wait()
+            try:
+                one_request(session, queries[(number + round_number) % len(queries)], round_number >= warmup_rounds)
+            except Exception as e:
+                errors.append(repr(e))
+            barrier.wait()
+
+    threads = [threading.Thread(target=user, args=(number,), daemon=True) for number in range(users)]
+    for thread in threads:
+        thread.start()
+
+    measured = 0.0
+    for round_number in range(total_rounds):
+        if spec['cache'] == 'cold':
+            clear_caches()
+        started = time.perf_counter()
+        barrier.wait()
+        barrier.wait()
+        if round_number >= warmup_rounds:
+            measured += time.perf_counter() - started
+    server.shutdown()
+
+    searches = len(samples['search'])
+    return {
+        'search': percentiles(samples['search']),
+        'preview': percentiles(samples['preview']),
+        'throughput_rps': searches / measured if measured else 0.0,
+        'cache_hit_ratio': sum(cache_hits) / len(cache_hits) if cache_hits else 0.0,
+        # ru_maxrss is in KiB on Linux; children are the PDF worker processes
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'peak_children_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+        'blob_calls': store.calls,
+        'errors': errors[:10],
+        'error_count': len(errors),
+    }
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_DIR,
+                                    capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+    return commit, dirty
+
+
+def compare(base_path, new_path, threshold):
+    """Print metric changes between two result files; returns the number of regressions."""
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    regressions = 0
+    print(f"{'scenario':<28} {'metric':<16} {'base':>10} {'new':>10} {'change':>8}")
+    for name, result in new['scenarios'].items():
+        before = base['scenarios'].get(name)
+        if before is None:
+            continue
+        rows = [(f"{op} {stat}", before[op].get(stat), result[op].get(stat), True) for op, stat in COMPARED_METRICS]
+        rows.append(('throughput rps', before['throughput_rps'], result['throughput_rps'], False))
+        for label, old_value, new_value, lower_is_better in rows:
+            if not old_value or new_value is None:
+                continue
+            change = (new_value - old_value) / old_value
+            worse = change > threshold if lower_is_better else change < -threshold
+            regressions += worse
+            scale = 1000 if lower_is_better else 1
+            print(f"{name:<28} {label:<16} {old_value * scale:>10.2f} {new_value * scale:>10.2f} "
+                  f"{change:>+7.0%}{'  REGRESSION' if worse else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--docs', type=int, default=60, help='documents per corpus')
+    parser.add_argument('--pages', type=int, default=5)
+    parser.add_argument('--words-per-page', type=int, default=300)
+    parser.add_argument('--keywords', default='contract renewal indemnity')
+    parser.add_argument('--density', type=float, default=0.02, help='fraction of words that are keywords')
+    parser.add_argument('--corpora', default=','.join(CORPUS_MIXES))
+    parser.add_argument('--cache', default='cold,warm')
+    parser.add_argument('--users', default='1,4,16,64', help='concurrent users per scenario')
+    parser.add_argument('--rounds', type=int, default=5, help='measured rounds; each user runs one search per round')
+    parser.add_argument('--previews', type=int, default=1, help='highlighted previews opened per search')
+    parser.add_argument('--blob-latency-ms', type=float, default=0.0, help='simulated Blob Storage round trip')
+    parser.add_argument('--corpus-dir', help='reuse (or create) the corpus here instead of a temp dir')
+    parser.add_argument('--output', help='result file (default: benchmarks/results/<commit>.json)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help='compare two result files and exit')
+    parser.add_argument('--threshold', type=float, default=0.10, help='relative change reported as a regression')
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        print(json.dumps(run_scenario(json.loads(args.scenario))))
+        return
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+
+    corpus_dir = args.corpus_dir or tempfile.mkdtemp(prefix='bench_search_')
+    started = time.perf_counter()
+    if not all(os.path.isdir(os.path.join(corpus_dir, mix)) for mix in CORPUS_MIXES):
+        seed_corpus(corpus_dir, args)
+    print(f"corpus in {corpus_dir} ({time.perf_counter() - started:.1f}s)")
+
+    queries = [f"{keyword} {word}" for keyword in args.keywords.split() for word in WORDS[:2]] + args.keywords.split()
+    commit, dirty = git_commit()
+    results = {
+        'meta': {
+            'commit': commit,
+            'dirty': dirty,
+            'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': {key: value for key, value in vars(args).items() if key not in ('compare', 'scenario')},
+        },
+        'scenarios': {},
+    }
+
+    for mix in args.corpora.split(','):
+        for cache in args.cache.split(','):
+            for users in (int(count) for count in args.users.split(',')):
+                name = f"{mix}/{cache}/{users}u"
+                spec = {
+                    'folder': os.path.join(corpus_dir, mix), 'cache': cache, 'users': users,
+                    'rounds': args.rounds, 'previews': args.previews, 'queries': queries,
+                    'blob_latency_ms': args.blob_latency_ms,
+                }
+                # A fresh process per scenario keeps caches, pools and peak RSS separate
+                completed = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), '--scenario', json.dumps(spec)],
+                    capture_output=True, text=True
+                )
+                if completed.returncode != 0:
+                    print(f"{name}: failed\n{completed.stderr[-2000:]}")
+                    continue
+                result = json.loads(completed.stdout.strip().splitlines()[-1])
+                results['scenarios'][name] = result
+                search, preview = result['search'], result['preview']
+                print(f"{name:<24} search p50 {search.get('p50', 0) * 1000:7.1f} ms  p95 {search.get('p95', 0) * 1000:7.1f}  "
+                      f"p99 {search.get('p99', 0) * 1000:7.1f} | preview p50 {preview.get('p50', 0) * 1000:7.1f} ms  "
+                      f"p95 {preview.get('p95', 0) * 1000:7.1f} | {result['throughput_rps']:6.1f} searches/s | "
+                      f"rss {result['peak_rss_mb']:.0f} MB{' | errors: ' + str(result['error_count']) if result['error_count'] else ''}")
+
+    output = args.output or os.path.join(BENCH_DIR, 'results', f"{commit}{'-dirty' if dirty else ''}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
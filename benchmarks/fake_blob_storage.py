@@ -0,0 +1,168 @@
+"""In-memory stand-in for the Azure Blob Storage SDK, for benchmarks.
+
+Implements the parts of ContainerClient / BlobClient the app uses
+(properties, conditional downloads, uploads, listing, deletes) over a
+dict, with an optional per-call latency to mimic network round trips.
+install() must run before app.py is imported, since app.py creates its
+clients at import time.
+"""
+import datetime
+import hashlib
+import threading
+import time
+
+import azure.storage.blob as azure_blob
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceModifiedError, ResourceNotFoundError, ResourceNotModifiedError
+
+ACCOUNT_NAME = 'benchaccount'
+
+
+class BlobProperties:
+    def __init__(self, name, data, last_modified):
+        self.name = name
+        self.size = len(data)
+        self.last_modified = last_modified
+        self.creation_time = last_modified
+        self.etag = f'"0x{hashlib.md5(data).hexdigest()[:16].upper()}"'
+
+
+class BlobDownloader:
+    def __init__(self, data, properties):
+        self._data = data
+        self.size = len(data)
+        self.properties = properties
+
+    def readall(self):
+        return self._data
+
+    def readinto(self, stream):
+        stream.write(self._data)
+        return len(self._data)
+
+    def chunks(self, chunk_size=4 * 1024 ** 2):
+        for start in range(0, len(self._data), chunk_size):
+            yield self._data[start:start + chunk_size]
+
+
+class BatchResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class MemoryBlobStore:
+    """Blobs by name, plus call counters; `latency` seconds are slept per call."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.blobs = {}  # name -> (bytes, BlobProperties)
+        self.calls = {'get_blob_properties': 0, 'download_blob': 0, 'upload_blob': 0, 'list_blobs': 0, 'delete_blob': 0}
+        self._lock = threading.Lock()
+
+    def put(self, name, data):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        with self._lock:
+            self.blobs[name] = (bytes(data), BlobProperties(name, data, now))
+
+    def call(self, operation):
+        with self._lock:
+            self.calls[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class MemoryBlobClient:
+    def __init__(self, store, container_name, blob_name):
+        self.store = store
+        self.container_name = container_name
+        self.blob_name = blob_name
+        self.account_name = ACCOUNT_NAME
+        self.url = f"https://{ACCOUNT_NAME}.blob.core.windows.net/{container_name}/{blob_name}"
+
+    def exists(self):
+        self.store.call('get_blob_properties')
+        return self.blob_name in self.store.blobs
+
+    def get_blob_properties(self, **kwargs):
+        self.store.call('get_blob_properties')
+        return self._entry()[1]
+
+    def download_blob(self, offset=None, length=None, etag=None, match_condition=None, **kwargs):
+        self.store.call('download_blob')
+        data, props = self._entry()
+        if match_condition == MatchConditions.IfNotModified and etag != props.etag:
+            raise ResourceModifiedError("The condition specified using HTTP conditional header(s) is not met.")
+        if match_condition == MatchConditions.IfModified and etag == props.etag:
+            raise ResourceNotModifiedError("The condition specified using HTTP conditional header(s) is not met.")
+        if offset is not None:
+            data = data[offset:offset + length if length is not None else None]
+        return BlobDownloader(data, props)
+
+    def upload_blob(self, data, overwrite=False, **kwargs):
+        self.store.call('upload_blob')
+        if hasattr(data, 'read'):
+            data = data.read()
+        self.store.put(self.blob_name, data)
+
+    def delete_blob(self, **kwargs):
+        self.store.call('delete_blob')
+        with self.store._lock:
+            if self.store.blobs.pop(self.blob_name, None) is None:
+                raise ResourceNotFoundError("The specified blob does not exist.")
+
+    def _entry(self):
+        entry = self.store.blobs.get(self.blob_name)
+        if entry is None:
+            raise ResourceNotFoundError("The specified blob does not exist.")
+        return entry
+
+
+class MemoryContainerClient:
+    def __init__(self, store, container_name):
+        self.store = store
+        self.container_name = container_name
+        self.account_name = ACCOUNT_NAME
+        self.url = f"https://{ACCOUNT_NAME}.blob.core.windows.net/{container_name}"
+
+    def get_blob_client(self, blob):
+        return MemoryBlobClient(self.store, self.container_name, getattr(blob, 'name', blob))
+
+    def list_blobs(self, name_starts_with=None, **kwargs):
+        self.store.call('list_blobs')
+        with self.store._lock:
+            entries = list(self.store.blobs.values())
+        return [props for _, props in entries if not name_starts_with or props.name.startswith(name_starts_with)]
+
+    def delete_blobs(self, *blobs, **kwargs):
+        """Batch delete; returns one response per blob, like raise_on_any_failure=False."""
+        responses = []
+        for blob in blobs:
+            if isinstance(blob, dict):
+                name, etag, condition = blob['name'], blob.get('etag'), blob.get('match_condition')
+            else:
+                name, etag, condition = getattr(blob, 'name', blob), None, None
+            entry = self.store.blobs.get(name)
+            if entry is None:
+                responses.append(BatchResponse(404))
+            elif condition == MatchConditions.IfNotModified and etag != entry[1].etag:
+                responses.append(BatchResponse(412))
+            else:
+                self.get_blob_client(name).delete_blob()
+                responses.append(BatchResponse(202))
+        return iter(responses)
+
+
+class MemoryBlobServiceClient:
+    def __init__(self, store):
+        self.store = store
+        self.account_name = ACCOUNT_NAME
+
+    def get_container_client(self, container_name):
+        return MemoryContainerClient(self.store, container_name)
+
+
+def install(store):
+    """Make BlobServiceClient.from_connection_string() return clients over `store`."""
+    azure_blob.BlobServiceClient.from_connection_string = classmethod(
+        lambda cls, *args, **kwargs: MemoryBlobServiceClient(store)
+    )
@@ -0,0 +1,92 @@
+from collections import namedtuple
+
+from azure.core.exceptions import ResourceNotFoundError
+
+from cache import TTLCache
+from metrics import stage
+
+# What the app needs to know about a blob, fetched in a single round trip
+BlobMetadata = namedtuple('BlobMetadata', ['exists', 'size', 'last_modified', 'etag'])
+
+MISSING = BlobMetadata(exists=False, size=None, last_modified=None, etag=None)
+
+
+class BlobMetadataCache:
+    """In-process TTL/LRU cache of blob existence, size, last-modified time and ETag.
+
+    A miss costs one get_blob_properties() call; a missing blob is cached
+    too, for a shorter time. Callers that find a blob no longer has the
+    cached ETag (a conditional download failing) invalidate its entry.
+    """
+
+    def __init__(self, container_client, ttl=300, missing_ttl=30, max_entries=50000):
+        self.container_client = container_client
+        self.missing_ttl = missing_ttl
+        self._cache = TTLCache(max_entries=max_entries, ttl=ttl)
+
+    def get(self, blob_name):
+        """Return the BlobMetadata of a blob, from cache if still fresh."""
+        metadata = self._cache.get(blob_name)
+        if metadata is not None:
+            return metadata
+
+        try:
+            with stage('properties'):
+                props = self.container_client.get_blob_client(blob_name).get_blob_properties()
+        except ResourceNotFoundError:
+            self._cache.put(blob_name, MISSING, ttl=self.missing_ttl)
+            return MISSING
+
+        metadata = self._from_properties(props)
+        self._cache.put(blob_name, metadata)
+        return metadata
+
+    def invalidate(self, blob_name):
+        self._cache.pop(blob_name)
+
+    def clear(self):
+        self._cache.clear()
+
+    def warm(self, name_starts_with=None):
+        """Fill the cache from a container listing; returns the number of blobs cached."""
+        count = 0
+        for props in self.container_client.list_blobs(name_starts_with=name_starts_with):
+            self._cache.put(props.name, self._from_properties(props))
+            count += 1
+        return count
+
+    def stats(self):
+        return self._cache.stats()
+
+    @staticmethod
+    def _from_properties(props):
+        return BlobMetadata(exists=True, size=props.size, last_modified=props.last_modified, etag=props.etag)
+
+
+class AsyncBlobMetadataCache(BlobMetadataCache):
+    """BlobMetadataCache over an azure.storage.blob.aio ContainerClient."""
+
+    async def get(self, blob_name):
+        """Return the BlobMetadata of a blob, from cache if still fresh."""
+        metadata = self._cache.get(blob_name)
+        if metadata is not None:
+            return metadata
+
+        try:
+            with stage('properties'):
+                props = await self.container_client.get_blob_client(blob_name).get_blob_properties()
+        except ResourceNotFoundError:
+            self._cache.put(blob_name, MISSING, ttl=self.missing_ttl)
+            return MISSING
+
+        metadata = self._from_properties(props)
+        self._cache.put(blob_name, metadata)
+        return metadata
+
+    async def warm(self, name_starts_with=None):
+        """Fill the cache from a container listing; returns the number of blobs cached."""
+        count = 0
+        async for props in self.container_client.list_blobs(name_starts_with=name_starts_with):
+            self._cache.put(props.name, self._from_properties(props))
+            count += 1
+        return count
@@ -0,0 +1,136 @@
+"""Bounded-memory transfers of source documents and their highlighted copies.
+
+A request gets a MemoryBudget. Each DocumentBuffer it opens (the source
+download, the highlighted output) is kept in memory only if its expected
+size still fits the budget, and otherwise goes to a temporary file, so a
+query that touches a few large PDFs no longer holds them all in RAM.
+Downloads and uploads move in chunks, several at a time: the chunk sizes
+are the BlobServiceClient's max_single_get_size / max_chunk_get_size /
+max_single_put_size / max_block_size settings.
+"""
+import io
+import os
+import tempfile
+from contextlib import contextmanager
+
+
+class MemoryBudget:
+    """Bytes one request may keep in memory for document buffers."""
+
+    def __init__(self, limit):
+        self.remaining = limit
+
+    def reserve(self, size):
+        """Claim `size` bytes; returns False, claiming nothing, if they don't fit."""
+        if size > self.remaining:
+            return False
+        self.remaining -= size
+        return True
+
+    def release(self, size):
+        self.remaining += size
+
+
+class DocumentBuffer:
+    """The bytes of one document, in memory if `size_hint` fits the budget, else in a temporary file.
+
+    `target` is what the highlighters read from or save into: a BytesIO,
+    or the temporary file's path (PyMuPDF and python-docx both read a
+    file lazily from its path). close() releases the memory or deletes
+    the file.
+    """
+
+    def __init__(self, size_hint, budget, spool_dir=None, suffix=''):
+        self.path = None
+        self._file = None
+        self._budget = budget
+        self._reserved = size_hint if budget.reserve(size_hint) else 0
+        if self._reserved or not size_hint:
+            self._file = io.BytesIO()
+        else:
+            fd, self.path = tempfile.mkstemp(prefix='docsearch-', suffix=suffix, dir=spool_dir)
+            os.close(fd)
+
+    @property
+    def in_memory(self):
+        return self._file is not None
+
+    @property
+    def target(self):
+        if self._file is not None:
+            self._file.seek(0)
+            return self._file
+        return self.path
+
+    @property
+    def size(self):
+        if self._file is not None:
+            return self._file.getbuffer().nbytes
+        return os.path.getsize(self.path)
+
+    @contextmanager
+    def open(self, mode='rb'):
+        """File object over the buffer, positioned at the start."""
+        if self._file is not None:
+            self._file.seek(0)
+            if 'w' in mode:
+                self._file.truncate()
+            yield self._file
+        else:
+            with open(self.path, mode) as stream:
+                yield stream
+
+    def close(self):
+        if self._file is not None:
+            self._file = None
+            self._budget.release(self._reserved)
+            self._reserved = 0
+        elif self.path is not None:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def download_into(blob_client, buffer, max_concurrency=1, **kwargs):
+    """Download a blob into a DocumentBuffer in ranged chunks; returns the byte count.
+
+    Extra keyword arguments (etag, match_condition) go to download_blob().
+    """
+    downloader = blob_client.download_blob(max_concurrency=max_concurrency, **kwargs)
+    with buffer.open('wb') as stream:
+        return downloader.readinto(stream)
+
+
+def upload_from(blob_client, buffer, max_concurrency=1):
+    """Upload a DocumentBuffer as a blob, overwriting it; returns the byte count.
+
+    Buffers larger than the client's max_single_put_size are sent as
+    blocks, `max_concurrency` at a time, straight from the buffer.
+    """
+    size = buffer.size
+    with buffer.open() as stream:
+        blob_client.upload_blob(stream, length=size, overwrite=True, max_concurrency=max_concurrency)
+    return size
+
+
+async def download_into_async(blob_client, buffer, max_concurrency=1, **kwargs):
+    """download_into() for azure.storage.blob.aio clients."""
+    downloader = await blob_client.download_blob(max_concurrency=max_concurrency, **kwargs)
+    with buffer.open('wb') as stream:
+        return await downloader.readinto(stream)
+
+
+async def upload_from_async(blob_client, buffer, max_concurrency=1):
+    """upload_from() for azure.storage.blob.aio clients."""
+    size = buffer.size
+    with buffer.open() as stream:
+        await blob_client.upload_blob(stream, length=size, overwrite=True, max_concurrency=max_concurrency)
+    return size
@@ -1,8 +1,15 @@
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.blocking import BlockingScheduler
 from apscheduler.triggers.interval import IntervalTrigger
+from azure.core import MatchConditions
 from azure.storage.blob import BlobServiceClient
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+import fcntl
+import logging
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -12,74 +19,148 @@ load_dotenv()
 AZURE_STORAGE_CONNECTION_STRING = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
 CONTAINER_NAME = os.getenv("CONTAINER_NAME")
 
+# Highlighted copies are reused by the app for HIGHLIGHT_CACHE_TTL_SECONDS,
+# so they must outlive that before being swept
+HIGHLIGHTED_MAX_AGE_MINUTES = int(os.getenv("HIGHLIGHTED_MAX_AGE_MINUTES", "15"))
+
+CLEANUP_INTERVAL_SECONDS = int(os.getenv("CLEANUP_INTERVAL_SECONDS", "60"))
+# Blob batch requests take at most 256 sub-requests
+CLEANUP_DELETE_BATCH_SIZE = min(256, int(os.getenv("CLEANUP_DELETE_BATCH_SIZE", "256")))
+CLEANUP_DELETE_CONCURRENCY = int(os.getenv("CLEANUP_DELETE_CONCURRENCY", "4"))
+
+HIGHLIGHTED_PREFIX = 'highlighted_'
+
+logger = logging.getLogger(__name__)
+
 # Initialize Azure Blob client
 blob_service_client = BlobServiceClient.from_connection_string(AZURE_STORAGE_CONNECTION_STRING)
 container_client = blob_service_client.get_container_client(CONTAINER_NAME)
 
+def delete_batch(batch):
+    """Delete one batch of blobs; returns (deleted, skipped, failed) counts.
+
+    Each delete is conditional on the ETag seen in the listing, so a copy
+    the app re-uploaded since is kept (412). A blob already gone (404)
+    was swept by someone else.
+    """
+    deleted = skipped = failed = 0
+    try:
+        responses = container_client.delete_blobs(*batch, raise_on_any_failure=False)
+        for response in responses:
+            if response.status_code in (200, 202):
+                deleted += 1
+            elif response.status_code in (404, 412):
+                skipped += 1
+            else:
+                failed += 1
+    except Exception as e:
+        logger.error(f"Error deleting a batch of {len(batch)} highlighted files: {str(e)}")
+        failed += len(batch)
+    return deleted, skipped, failed
+
 def cleanup_highlighted_files():
-    """Delete all blobs starting with 'highlighted_' that are older than 2 minutes."""
+    """Delete all blobs starting with 'highlighted_' that are older than HIGHLIGHTED_MAX_AGE_MINUTES.
+
+    Lists only the 'highlighted_' prefix, reads ages from the listing and
+    deletes expired blobs in batches, several batches at a time. Returns
+    the sweep's counts and duration.
+    """
+    started = time.monotonic()
+    cutoff = datetime.now(timezone.utc) - timedelta(minutes=HIGHLIGHTED_MAX_AGE_MINUTES)
+    swept = expired = 0
+    futures = []
+    batch = []
+
     try:
-        # Get current time in UTC
-        current_time = datetime.now(timezone.utc)
-        
-        # List all blobs in the container
-        blobs = container_client.list_blobs()
-        
-        # Delete blobs that start with 'highlighted_' and are older than 2 minutes
-        for blob in blobs:
-            if blob.name.startswith('highlighted_'):
-                try:
-                    # Get blob properties to check creation time
-                    blob_client = container_client.get_blob_client(blob.name)
-                    properties = blob_client.get_blob_properties()
-                    
-                    # Get creation time and ensure it's timezone-aware
-                    creation_time = properties.creation_time
-                    if creation_time.tzinfo is None:
-                        creation_time = creation_time.replace(tzinfo=timezone.utc)
-                    
-                    # Calculate age of the blob
-                    blob_age = current_time - creation_time
-                    
-                    # Delete if older than 2 minutes
-                    if blob_age > timedelta(minutes=2):
-                        blob_client.delete_blob()
-                        print(f"Deleted old highlighted file: {blob.name}")
-                    else:
-                        print(f"Blob {blob.name} is {blob_age.total_seconds() / 60:.2f} minutes old - not deleting yet")
-                except Exception as e:
-                    print(f"Error processing blob {blob.name}: {str(e)}")
+        with ThreadPoolExecutor(max_workers=CLEANUP_DELETE_CONCURRENCY, thread_name_prefix="cleanup") as executor:
+            for blob in container_client.list_blobs(name_starts_with=HIGHLIGHTED_PREFIX):
+                swept += 1
+                creation_time = blob.creation_time
+                if creation_time.tzinfo is None:
+                    creation_time = creation_time.replace(tzinfo=timezone.utc)
+                if creation_time >= cutoff:
                     continue
-    
+
+                expired += 1
+                batch.append({'name': blob.name, 'etag': blob.etag, 'match_condition': MatchConditions.IfNotModified})
+                if len(batch) >= CLEANUP_DELETE_BATCH_SIZE:
+                    futures.append(executor.submit(delete_batch, batch))
+                    batch = []
+            if batch:
+                futures.append(executor.submit(delete_batch, batch))
     except Exception as e:
-        print(f"Error in cleanup_highlighted_files: {str(e)}")
+        logger.error(f"Error in cleanup_highlighted_files: {str(e)}")
 
-def start_scheduler():
-    """Initialize and start the scheduler."""
-    scheduler = BackgroundScheduler()
+    deleted = skipped = failed = 0
+    for future in futures:
+        batch_deleted, batch_skipped, batch_failed = future.result()
+        deleted += batch_deleted
+        skipped += batch_skipped
+        failed += batch_failed
+
+    report = {
+        'swept': swept,
+        'expired': expired,
+        'deleted': deleted,
+        'skipped': skipped,
+        'failed': failed,
+        'seconds': round(time.monotonic() - started, 3)
+    }
+    logger.info(
+        f"Cleanup swept {swept} highlighted files, deleted {deleted} of {expired} expired "
+        f"({skipped} skipped, {failed} failed) in {report['seconds']:.2f}s"
+    )
+    return report
+
+def add_cleanup_job(scheduler):
     scheduler.add_job(
         func=cleanup_highlighted_files,
-        trigger=IntervalTrigger(minutes=1),  # Run every minute
+        trigger=IntervalTrigger(seconds=CLEANUP_INTERVAL_SECONDS),
         id='cleanup_job',
-        name='Cleanup highlighted files every minute',
-        replace_existing=True
+        name='Cleanup highlighted files',
+        replace_existing=True,
+        # A sweep that overruns the interval is not started a second time
+        max_instances=1,
+        coalesce=True
     )
-    
+
+def start_scheduler():
+    """Initialize and start the scheduler."""
+    scheduler = BackgroundScheduler()
+    add_cleanup_job(scheduler)
+
     if not scheduler.running:
         scheduler.start()
-        print("Scheduler started successfully")
-    
+        logger.info("Scheduler started successfully")
+
     return scheduler
 
+def start_scheduler_when_elected(lock_path):
+    """Start the scheduler in this process once it holds an flock on `lock_path`.
+
+    Every app worker calls this; whichever holds the lock runs the sweeps.
+    The others wait for it on a daemon thread, and one of them takes over
+    when the leader exits and the kernel releases its lock.
+    """
+    def wait_for_leadership():
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        # Held, never closed, for the life of the process
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        logger.info(f"Process {os.getpid()} elected to run the cleanup scheduler")
+        start_scheduler()
+
+    os.makedirs(os.path.dirname(lock_path) or '.', exist_ok=True)
+    thread = threading.Thread(target=wait_for_leadership, name="cleanup-election", daemon=True)
+    thread.start()
+    return thread
+
 if __name__ == "__main__":
-    # Start the scheduler when run directly
-    scheduler = start_scheduler()
-    
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    # Run in the foreground; the scheduler blocks without using CPU between sweeps
+    scheduler = BlockingScheduler()
+    add_cleanup_job(scheduler)
     try:
-        # Keep the script running
-        while True:
-            pass
+        scheduler.start()
     except (KeyboardInterrupt, SystemExit):
-        # Shutdown the scheduler when the script is stopped
-        scheduler.shutdown()
-        print("Scheduler stopped") 
\ No newline at end of file
+        logger.info("Scheduler stopped")
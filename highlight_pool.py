@@ -0,0 +1,239 @@
+"""Process pool for CPU-bound highlighting, with a bounded queue and per-job limits.
+
+python-docx parsing and PyMuPDF annotation hold the GIL, so run in
+request threads a few large documents stall every other request of the
+worker. HighlightPool runs them in worker processes instead. At most
+`workers` jobs run and `max_queue` more wait; past that run() raises
+PoolSaturatedError straight away and the caller serves something cheaper
+(the plain document link) rather than queuing without limit.
+
+Each job may use `cpu_seconds` of CPU time before it is stopped with
+JobCpuLimitExceeded, and each worker process `memory_bytes` of address
+space, past which allocations fail with MemoryError. The CPU limit is a
+signal handled in Python, which a job stuck inside one MuPDF or lxml call
+never sees; a job still unfinished `timeout` seconds after it started
+running (time spent waiting for a worker does not count) raises
+JobTimeoutError, and its worker process is killed. Each worker runs one
+job at a time over its own pipe, so a killed or crashed worker fails
+only its own job and is replaced for the next one.
+
+Jobs and their arguments cross a process boundary: pass paths or bytes,
+not open files or memory maps.
+"""
+import math
+import multiprocessing
+import resource
+import signal
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+from metrics import count, gauge, observe
+
+
+class PoolSaturatedError(Exception):
+    """The pool's queue is full; the job was not submitted."""
+
+
+class JobCpuLimitExceeded(Exception):
+    """A job used more CPU time than the pool allows per job."""
+
+
+class JobTimeoutError(Exception):
+    """A job did not finish within the pool's wall-clock timeout."""
+
+
+class HighlightPool:
+    """Runs functions in `workers` processes, with at most `max_queue` jobs waiting for one."""
+
+    def __init__(self, workers, max_queue, cpu_seconds=0, memory_bytes=0, timeout=None, mp_context=None):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.cpu_seconds = cpu_seconds
+        self.timeout = timeout
+        self.memory_bytes = memory_bytes
+        self._mp_context = mp_context
+        self._idle = []
+        self._started = 0
+        self._busy = 0
+        self._in_flight = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+
+    def run(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) in a worker process and return its result.
+
+        Raises PoolSaturatedError, without running it, if `workers` jobs
+        are running and `max_queue` more are already waiting.
+        """
+        with self._lock:
+            if self._in_flight >= self.workers + self.max_queue:
+                self._rejected += 1
+                count('highlight_jobs', 1, 'Highlight pool jobs by outcome', outcome='rejected')
+                raise PoolSaturatedError(f"{self._in_flight} highlight jobs in flight")
+            self._in_flight += 1
+            self._report_depth()
+
+        started = time.perf_counter()
+        outcome = 'failed'
+        worker = None
+        try:
+            worker = self._acquire()
+            try:
+                # The timeout runs from here: the worker is idle, so the job starts as it arrives
+                worker.conn.send((self.cpu_seconds, func, args, kwargs))
+                finished = worker.conn.poll(self.timeout)
+                reply = worker.conn.recv() if finished else None
+            except (EOFError, OSError) as e:
+                # The worker died (out of memory, crashed); the next job gets a fresh one
+                worker.kill()
+                outcome = 'broken'
+                raise BrokenProcessPool("A highlight worker process terminated abruptly") from e
+            if not finished:
+                # Stuck where the CPU limit can't stop it; only killing its process frees the slot
+                worker.kill()
+                outcome = 'timeout'
+                raise JobTimeoutError(f"Highlight job did not finish within {self.timeout}s")
+            ok, value = reply
+            if ok:
+                outcome = 'done'
+                return value
+            if isinstance(value, JobCpuLimitExceeded):
+                outcome = 'cpu_limit'
+            raise value
+        finally:
+            if worker is not None:
+                self._release(worker)
+            with self._lock:
+                self._in_flight -= 1
+                self._report_depth()
+            observe('highlight_job_seconds', time.perf_counter() - started,
+                    'Highlight pool job latency, queue wait included', outcome=outcome)
+            count('highlight_jobs', 1, 'Highlight pool jobs by outcome', outcome=outcome)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'running': self._busy,
+                'queued': self._in_flight - self._busy,
+                'rejected': self._rejected
+            }
+
+    def shutdown(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.stop()
+
+    def _acquire(self):
+        """An idle worker for one job, started if there are fewer than `workers`; waits for one otherwise."""
+        with self._available:
+            while not self._idle and self._started >= self.workers:
+                self._available.wait()
+            self._busy += 1
+            self._report_depth()
+            if self._idle:
+                return self._idle.pop()
+            self._started += 1
+        try:
+            return _Worker(self._mp_context or multiprocessing, self.memory_bytes)
+        except BaseException:
+            with self._available:
+                self._started -= 1
+                self._busy -= 1
+                self._available.notify()
+            raise
+
+    def _release(self, worker):
+        """Return a worker after its job; a killed or dead one gives its slot to a new process."""
+        with self._available:
+            self._busy -= 1
+            if worker.process.is_alive():
+                self._idle.append(worker)
+            else:
+                self._started -= 1
+            self._report_depth()
+            self._available.notify()
+        if not worker.process.is_alive():
+            worker.stop()
+
+    def _report_depth(self):
+        """Publish running and queued job counts. Lock held."""
+        gauge('highlight_jobs_running', self._busy, 'Highlight pool jobs running')
+        gauge('highlight_queue_depth', self._in_flight - self._busy, 'Highlight pool jobs waiting for a worker')
+
+
+class _Worker:
+    """One worker process, running the jobs sent down its pipe one at a time."""
+
+    def __init__(self, context, memory_bytes):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child_conn, memory_bytes), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.conn.close()
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.kill()
+
+
+def _serve(conn, memory_bytes):
+    """Worker process main loop: run each job received and send back (ok, result or exception)."""
+    _init_worker(memory_bytes)
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        try:
+            reply = (True, _run_limited(*job))
+        except Exception as e:
+            reply = (False, e)
+        try:
+            conn.send(reply)
+        except Exception as e:
+            # An unpicklable result or exception still has to answer the job
+            conn.send((False, RuntimeError(f"Highlight job reply could not be sent: {e!r}")))
+
+
+def _init_worker(memory_bytes):
+    if memory_bytes:
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, hard))
+    signal.signal(signal.SIGXCPU, _cpu_limit_exceeded)
+
+
+def _cpu_limit_exceeded(signum, frame):
+    raise JobCpuLimitExceeded("Highlight job exceeded its CPU time limit")
+
+
+def _run_limited(cpu_seconds, func, args, kwargs):
+    """Worker side of run(): func under a CPU-time limit counted from the job's start."""
+    if not cpu_seconds:
+        return func(*args, **kwargs)
+    # RLIMIT_CPU counts the whole process, so the limit moves with each job
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    limit = math.ceil(usage.ru_utime + usage.ru_stime + cpu_seconds)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (limit, hard))
+    try:
+        return func(*args, **kwargs)
+    finally:
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
@@ -0,0 +1,426 @@
+import copy
+import html
+import io
+import re
+from functools import lru_cache
+
+import fitz  # PyMuPDF for PDF processing
+from docx import Document
+from docx.enum.text import WD_COLOR_INDEX
+from docx.oxml.ns import qn
+from docx.text.run import Run
+
+# Define colors for highlighting
+HTML_HIGHLIGHT_COLORS = [
+    'background-color: #FFFF00;',  # Yellow
+    'background-color: #40E0D0;',  # Turquoise
+    'background-color: #FFC0CB;',  # Pink
+    'background-color: #90EE90;',  # Green
+    'background-color: #98FB98;',  # Bright Green
+    'background-color: #ADD8E6;',  # Blue
+    'background-color: #FFB6C1;',  # Red
+    'background-color: #EE82EE;'   # Violet
+]
+
+DOCX_HIGHLIGHT_COLORS = [
+    WD_COLOR_INDEX.YELLOW,      # Yellow
+    WD_COLOR_INDEX.TURQUOISE,   # Turquoise
+    WD_COLOR_INDEX.PINK,        # Pink
+    WD_COLOR_INDEX.GREEN,       # Green
+    WD_COLOR_INDEX.BRIGHT_GREEN,# Bright Green
+    WD_COLOR_INDEX.BLUE,        # Blue
+    WD_COLOR_INDEX.RED,         # Red
+    WD_COLOR_INDEX.VIOLET       # Violet
+]
+
+PDF_HIGHLIGHT_COLORS = [
+    (1, 1, 0),       # Yellow
+    (0, 0.8, 0.8),   # Turquoise
+    (1, 0.75, 0.8),  # Pink
+    (0.56, 0.93, 0.56), # Green
+    (0.6, 0.98, 0.6),   # Bright Green
+    (0.68, 0.85, 0.9),  # Blue
+    (1, 0.71, 0.76),    # Red
+    (0.93, 0.51, 0.93)  # Violet
+]
+
+# The same colors for viewers that draw PDF highlights themselves
+PDF_HIGHLIGHT_CSS_COLORS = [
+    '#{:02x}{:02x}{:02x}'.format(*(round(channel * 255) for channel in color)) for color in PDF_HIGHLIGHT_COLORS
+]
+
+# Same extraction flags page.search_for() uses, so the prefilter sees the same text
+PDF_TEXT_FLAGS = (
+    fitz.TEXT_DEHYPHENATE | fitz.TEXT_PRESERVE_WHITESPACE
+    | fitz.TEXT_PRESERVE_LIGATURES | fitz.TEXT_MEDIABOX_CLIP
+)
+
+
+def normalize_keywords(keywords):
+    """Unique lowercase keywords in query order (order decides highlight colors)."""
+    return tuple(dict.fromkeys(keyword.lower() for keyword in keywords.split()))
+
+
+class KeywordMatcher:
+    """Finds all keywords of a query in one left-to-right scan.
+
+    The keywords are compiled into a single case-insensitive alternation,
+    longest first so that overlapping keywords prefer the longer match.
+    Each alternative is its own group, so a match maps straight back to the
+    index of its keyword (and thus its color) without re-matching.
+    """
+
+    def __init__(self, keywords):
+        self.keywords = keywords
+        ordered = sorted(range(len(keywords)), key=lambda i: len(keywords[i]), reverse=True)
+        self._group_to_keyword = {group: i for group, i in enumerate(ordered, start=1)}
+        self.pattern = re.compile(
+            '|'.join(f'({re.escape(keywords[i])})' for i in ordered),
+            re.IGNORECASE
+        ) if keywords else None
+
+    def finditer(self, text):
+        """Yield non-overlapping (start, end, keyword_index) spans in text order."""
+        if self.pattern is None:
+            return
+        for match in self.pattern.finditer(text):
+            yield match.start(), match.end(), self._group_to_keyword[match.lastindex]
+
+    def sub(self, text, replace):
+        """Replace every match with replace(matched_text, keyword_index) in one pass."""
+        if self.pattern is None:
+            return text
+        return self.pattern.sub(
+            lambda m: replace(m.group(0), self._group_to_keyword[m.lastindex]), text
+        )
+
+
+@lru_cache(maxsize=256)
+def _matcher_for(keywords):
+    return KeywordMatcher(keywords)
+
+
+def get_matcher(keywords):
+    """Compiled matcher for a raw query string, cached per normalized keyword set."""
+    return _matcher_for(normalize_keywords(keywords))
+
+
+def highlight_keywords(text, keywords):
+    """Wrap keywords with <mark> tags using different colors.
+
+    Returns HTML: the document text is escaped, matched in its raw form so
+    that keywords never match inside entities.
+    """
+    if not text:
+        return ""
+
+    parts = []
+    position = 0
+    for start, end, index in get_matcher(keywords).finditer(text):
+        parts.append(html.escape(text[position:start]))
+        style = HTML_HIGHLIGHT_COLORS[index % len(HTML_HIGHLIGHT_COLORS)]
+        parts.append(f'<mark style="{style}">{html.escape(text[start:end])}</mark>')
+        position = end
+    parts.append(html.escape(text[position:]))
+    return ''.join(parts)
+
+
+def extract_snippets(text, keywords, window=200, max_fragments=3):
+    """Plain-text passages of about `window` characters around keyword matches.
+
+    Windows centred on matches are merged when they overlap and widened to
+    word boundaries. The passages with the most matches are kept, in text
+    order. Returns [] if nothing matches.
+    """
+    if not text:
+        return []
+
+    spans = []
+    half = window // 2
+    for start, end, _ in get_matcher(keywords).finditer(text):
+        lo, hi = max(0, start - half), min(len(text), end + half)
+        if spans and lo <= spans[-1][1]:
+            spans[-1][1] = max(spans[-1][1], hi)
+            spans[-1][2] += 1
+        else:
+            spans.append([lo, hi, 1])
+
+    best = sorted(sorted(spans, key=lambda span: span[2], reverse=True)[:max_fragments])
+    return [_snap_to_words(text, lo, hi) for lo, hi, _ in best]
+
+
+def _snap_to_words(text, lo, hi):
+    # Don't cut words in half at either edge of a passage
+    if lo > 0:
+        space = text.find(' ', lo, lo + 20)
+        lo = space + 1 if space != -1 else lo
+    if hi < len(text):
+        space = text.rfind(' ', hi - 20, hi)
+        hi = space if space != -1 else hi
+    return ' '.join(text[lo:hi].split())
+
+
+def highlight_docx(source, keywords, output=None):
+    """Highlight every keyword of a DOCX document in its color.
+
+    `source` is the document as bytes, a file object or a path. The copy
+    is saved into `output` (a file object or path) if given, else returned
+    as bytes.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    doc = Document(source)
+    highlight_docx_document(doc, get_matcher(keywords))
+
+    if output is not None:
+        doc.save(output)
+        return output
+    output = io.BytesIO()
+    doc.save(output)
+    return output.getvalue()
+
+
+def highlight_docx_document(doc, matcher):
+    """Highlight keywords in the body, tables, headers and footers of a Document; returns the match count."""
+    return sum(_highlight_paragraph(paragraph, matcher) for paragraph in iter_docx_paragraphs(doc))
+
+
+def iter_docx_paragraphs(doc):
+    """Yield every paragraph of the body, of tables (nested too) and of headers and footers."""
+    yield from _iter_container_paragraphs(doc, set())
+
+    seen_parts = set()
+    for section in doc.sections:
+        for header_footer in (
+            section.header, section.first_page_header, section.even_page_header,
+            section.footer, section.first_page_footer, section.even_page_footer
+        ):
+            # Linked headers/footers belong to an earlier section; touching their
+            # paragraphs would also add an empty definition to this one
+            if header_footer.is_linked_to_previous:
+                continue
+            if header_footer.part in seen_parts:
+                continue
+            seen_parts.add(header_footer.part)
+            yield from _iter_container_paragraphs(header_footer, set())
+
+
+def _iter_container_paragraphs(container, seen_cells):
+    yield from container.paragraphs
+    for table in container.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                # Merged cells are returned once per grid column they span; the
+                # set holds the elements themselves so lxml keeps their proxies
+                if cell._tc in seen_cells:
+                    continue
+                seen_cells.add(cell._tc)
+                yield from _iter_container_paragraphs(cell, seen_cells)
+
+
+# Run children that _split_run can rebuild from text: formatting, text and tabs
+_PLAIN_RUN_TAGS = frozenset(qn(tag) for tag in ('w:rPr', 'w:t', 'w:tab'))
+
+
+def _highlight_paragraph(paragraph, matcher):
+    """Highlight one paragraph, matching across run boundaries; returns the match count.
+
+    The paragraph text is scanned once, then the match spans and the runs are
+    walked together. Runs that overlap a match are split into pieces that
+    keep the run's formatting, with the matched pieces highlighted. Runs
+    with content other than text are left whole.
+    """
+    runs = paragraph.runs
+    if not runs:
+        return 0
+    run_texts = [run.text for run in runs]
+    text = ''.join(run_texts)
+    spans = list(matcher.finditer(text))
+    if not spans:
+        return 0
+
+    span_index = 0
+    run_end = 0
+    for run, run_text in zip(runs, run_texts):
+        run_start, run_end = run_end, run_end + len(run_text)
+        if run_start == run_end:
+            continue
+
+        # Pieces of this run as (text, keyword index or None)
+        pieces = []
+        position = run_start
+        while span_index < len(spans) and spans[span_index][0] < run_end:
+            start, end, keyword_index = spans[span_index]
+            piece_start, piece_end = max(start, run_start), min(end, run_end)
+            if piece_start > position:
+                pieces.append((text[position:piece_start], None))
+            pieces.append((text[piece_start:piece_end], keyword_index))
+            position = piece_end
+            if end > run_end:
+                # The match continues into the next run
+                break
+            span_index += 1
+        if not pieces or not _is_plain_text_run(run):
+            continue
+        if position < run_end:
+            pieces.append((text[position:run_end], None))
+
+        _split_run(run, pieces, paragraph)
+
+    return len(spans)
+
+
+def _is_plain_text_run(run):
+    """Whether a run holds only text and tabs, which setting .text on its pieces recreates.
+
+    Pictures, fields, breaks and the like would be dropped by a split, so
+    matches in such runs are left unhighlighted.
+    """
+    return all(child.tag in _PLAIN_RUN_TAGS for child in run._r)
+
+
+def _split_run(run, pieces, paragraph):
+    """Replace a run by one run per piece, in place, copying the original formatting."""
+    template = copy.deepcopy(run._r)
+    anchor = run._r
+    for i, (piece_text, keyword_index) in enumerate(pieces):
+        if i == 0:
+            piece_run = run
+        else:
+            new_r = copy.deepcopy(template)
+            anchor.addnext(new_r)
+            anchor = new_r
+            piece_run = Run(new_r, paragraph)
+        piece_run.text = piece_text
+        if keyword_index is not None:
+            piece_run.font.highlight_color = DOCX_HIGHLIGHT_COLORS[keyword_index % len(DOCX_HIGHLIGHT_COLORS)]
+
+
+def highlight_pdf(source, keywords, executor=None, workers=1, parallel_min_pages=200, output=None,
+                  source_path=None, word_index=None):
+    """Highlight every keyword of a PDF in its color.
+
+    `source` is the PDF as a path, a BytesIO or a buffer such as bytes or
+    an mmap; a path is read lazily rather than loaded whole. Worker
+    processes get `source_path` if given (the file behind an mmap), else
+    `source`. The copy is saved into `output` (a BytesIO or path) if
+    given, else returned as bytes. If an `executor` (a process pool of
+    `workers` processes) is given and the document has at least `parallel_min_pages`
+    pages, page ranges are searched in parallel and the hits merged back
+    here; annotating itself is cheap and stays in-process. With a
+    `word_index` (a pdf_word_index.PdfWordIndex of this document) the hits
+    are looked up there instead and no page text is searched.
+    """
+    keywords = normalize_keywords(keywords)
+    doc = open_pdf(source)
+    try:
+        hits = _find_document_hits(doc, source, keywords, executor, workers, parallel_min_pages, source_path, word_index)
+        annotate_pdf_hits(doc, hits)
+
+        if output is not None:
+            doc.save(output)
+            return output
+        return doc.tobytes()
+    finally:
+        doc.close()
+
+
+def annotate_pdf_hits(doc, hits):
+    """Add a highlight annotation in its keyword's color for each (page number, keyword index, quads) hit."""
+    for page_num, keyword_index, quads in hits:
+        # The annotation is only valid while its page object is alive
+        page = doc[page_num]
+        annot = page.add_highlight_annot(
+            [fitz.Quad(quad[0:2], quad[2:4], quad[4:6], quad[6:8]) for quad in quads]
+        )
+        annot.set_colors(stroke=PDF_HIGHLIGHT_COLORS[keyword_index % len(PDF_HIGHLIGHT_COLORS)])
+        annot.update()
+
+
+def find_pdf_overlay(source, keywords, executor=None, workers=1, parallel_min_pages=200,
+                     source_path=None, word_index=None):
+    """Hits of a PDF for a viewer to draw over the original: [{'page', 'keyword', 'quads'}].
+
+    Takes the same arguments as highlight_pdf() but changes nothing.
+    Pages are numbered from 1 and quads are 8-float lists in PDF user
+    space (origin bottom-left, before rotation and crop box), which PDF.js
+    maps to the screen through its page viewport.
+    """
+    keywords = normalize_keywords(keywords)
+    doc = open_pdf(source)
+    try:
+        hits = _find_document_hits(doc, source, keywords, executor, workers, parallel_min_pages, source_path, word_index)
+        overlay = []
+        for page_num, keyword_index, quads in hits:
+            # Hits are unrotated, measured down and right from the crop box's top-left
+            # corner; page.transformation_matrix loses the crop offset on rotated pages
+            page = doc[page_num]
+            left = page.cropbox.x0
+            top = page.mediabox.y1 - page.cropbox.y0
+            overlay.append({
+                'page': page_num + 1,
+                'keyword': keyword_index,
+                'quads': [
+                    [round(value, 2) for i in range(0, 8, 2) for value in (left + quad[i], top - quad[i + 1])]
+                    for quad in quads
+                ]
+            })
+        return overlay
+    finally:
+        doc.close()
+
+
+def _find_document_hits(doc, source, keywords, executor, workers, parallel_min_pages, source_path, word_index):
+    page_count = len(doc)
+    if word_index is not None:
+        return word_index.find(keywords)
+    if executor is not None and workers > 1 and page_count >= parallel_min_pages:
+        chunk = -(-page_count // workers)
+        futures = [
+            executor.submit(find_pdf_hits_in_range, source_path or source, keywords, start, min(start + chunk, page_count))
+            for start in range(0, page_count, chunk)
+        ]
+        return [hit for future in futures for hit in future.result()]
+    return find_pdf_hits(doc, keywords, range(page_count))
+
+
+def find_pdf_hits(doc, keywords, page_numbers):
+    """Return (page number, keyword index, quads) for every keyword found on the given pages.
+
+    Each page's text is extracted once; keywords that do not occur in it are
+    skipped before the quad search, which reuses the same text page.
+    Quads are plain 8-float tuples so hits can cross process boundaries.
+    """
+    hits = []
+    for page_num in page_numbers:
+        page = doc[page_num]
+        textpage = page.get_textpage(flags=PDF_TEXT_FLAGS)
+        text = textpage.extractText().lower()
+        for keyword_index, keyword in enumerate(keywords):
+            if keyword not in text:
+                continue
+            quads = page.search_for(keyword, quads=True, textpage=textpage, flags=PDF_TEXT_FLAGS)
+            if quads:
+                hits.append((page_num, keyword_index, [
+                    (q.ul.x, q.ul.y, q.ur.x, q.ur.y, q.ll.x, q.ll.y, q.lr.x, q.lr.y) for q in quads
+                ]))
+    return hits
+
+
+def open_pdf(source):
+    """Open a PDF given as a path, a BytesIO or any buffer (bytes, mmap) without copying it."""
+    if isinstance(source, str):
+        return fitz.open(source, filetype="pdf")
+    if isinstance(source, io.BytesIO):
+        # PyMuPDF would copy a BytesIO with getvalue()
+        return fitz.open(stream=source.getbuffer(), filetype="pdf")
+    return fitz.open(stream=memoryview(source), filetype="pdf")
+
+
+def find_pdf_hits_in_range(source, keywords, start, stop):
+    """Process-pool entry point: find_pdf_hits() over pages [start, stop) of a PDF given as bytes or a path."""
+    doc = open_pdf(source)
+    try:
+        return find_pdf_hits(doc, keywords, range(start, stop))
+    finally:
+        doc.close()
@@ -0,0 +1,359 @@
+"""In-process search backend over a local folder of PDF, DOCX and TXT files.
+
+A stand-in for Azure Cognitive Search for development, load tests and
+benchmarks: a positional inverted index ranked with BM25, answering the
+same REST payloads app.py sends (Lucene phrase queries as produced by
+escape_query, searchMode, an OData `eq` filter, select, top/skip and
+hit highlights) with the same {"value": [...]} response shape.
+
+Who may see a document comes from an optional acl.json at the root of
+the folder, mapping glob patterns of relative paths to user lists:
+
+    {"contracts/*": ["alice"], "*": ["alice", "bob"]}
+
+The first matching pattern wins; documents matching none are visible to
+no one. The index is pickled to disk and reloaded on start; only files
+whose size or mtime changed are extracted again.
+"""
+import asyncio
+import fnmatch
+import json
+import logging
+import math
+import os
+import pickle
+import re
+import tempfile
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from highlighter import extract_snippets, get_matcher
+
+logger = logging.getLogger(__name__)
+
+INDEXED_EXTENSIONS = {'.pdf', '.docx', '.txt'}
+
+# Bumped whenever the on-disk layout changes, so stale pickles get rebuilt
+INDEX_FORMAT_VERSION = 1
+
+# Token id between a document's name and content; never a real term id
+FIELD_SEPARATOR = 0xFFFFFFFF
+
+TOKEN_RE = re.compile(r'\w+')
+# A quoted phrase (backslash escapes allowed inside) or a bare term
+QUERY_CLAUSE_RE = re.compile(r'"((?:\\.|[^"\\])*)"|((?:\\.|[^\s"\\])+)')
+FILTER_CLAUSE_RE = re.compile(r"\s*(\w+)\s+eq\s+'((?:[^']|'')*)'\s*(?:and|$)", re.IGNORECASE)
+LUCENE_ESCAPE_RE = re.compile(r'\\(.)')
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def extract_text(path):
+    """Plain text of a PDF, DOCX or TXT file."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.pdf':
+        import fitz
+        with fitz.open(path) as doc:
+            return '\n'.join(page.get_text() for page in doc)
+    if ext == '.docx':
+        from docx import Document
+        from highlighter import iter_docx_paragraphs
+        return '\n'.join(paragraph.text for paragraph in iter_docx_paragraphs(Document(path)))
+    with open(path, encoding='utf-8', errors='replace') as f:
+        return f.read()
+
+
+def _extract_file(path):
+    try:
+        return extract_text(path)
+    except Exception as e:
+        logger.warning(f"Could not extract text from {path}: {str(e)}")
+        return ''
+
+
+def parse_query(query):
+    """Split a Lucene query string into phrases, each a list of terms; None means match all."""
+    if query is None or query.strip() in ('', '*'):
+        return None
+    phrases = []
+    for quoted, bare in QUERY_CLAUSE_RE.findall(query):
+        terms = tokenize(LUCENE_ESCAPE_RE.sub(r'\1', quoted or bare))
+        if terms:
+            phrases.append(terms)
+    return phrases
+
+
+def parse_filter(expression):
+    """Parse `field eq 'value' [and ...]` into a list of (field, value)."""
+    if not expression:
+        return []
+    clauses = []
+    position = 0
+    while position < len(expression):
+        match = FILTER_CLAUSE_RE.match(expression, position)
+        if match is None:
+            raise ValueError(f"Unsupported filter: {expression}")
+        clauses.append((match.group(1), match.group(2).replace("''", "'")))
+        position = match.end()
+    return clauses
+
+
+class LocalSearchIndex:
+    """Inverted index with BM25 ranking over name and content.
+
+    Terms are interned to integer ids. Postings are two parallel arrays
+    per term (document ids, term frequencies), and each document keeps its
+    token ids as one array, in which phrases are found with a byte search.
+    A few large arrays instead of millions of small objects keep building,
+    pickling and loading tens of thousands of documents fast.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.documents = []  # dicts: metadata_storage_name/_path, content, authorized_users, size, mtime
+        self.vocabulary = {}  # term -> term id
+        self.postings = []  # term id -> (array of doc ids, array of term frequencies)
+        self.tokens = []  # doc id -> token ids as bytes, name then FIELD_SEPARATOR then content
+        self.total_length = 0
+
+    def add(self, document):
+        doc_id = len(self.documents)
+        self.documents.append(document)
+        terms = tokenize(os.path.splitext(document['metadata_storage_name'])[0])
+        separator = len(terms)
+        terms += tokenize(document['content'])
+
+        ids = array('I')
+        for term in terms:
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                term_id = self.vocabulary[term] = len(self.postings)
+                self.postings.append((array('I'), array('I')))
+            ids.append(term_id)
+        for term_id, frequency in Counter(ids).items():
+            doc_ids, frequencies = self.postings[term_id]
+            doc_ids.append(doc_id)
+            frequencies.append(frequency)
+        # Phrases can't match across the end of the name and the start of the content
+        ids.insert(separator, FIELD_SEPARATOR)
+        self.tokens.append(ids.tobytes())
+        self.total_length += len(terms)
+
+    def search(self, phrases, search_mode='all'):
+        """Return [(score, doc_id)] of documents matching the phrases, best first."""
+        if phrases is None:
+            return [(1.0, doc_id) for doc_id in range(len(self.documents))]
+
+        matches = [self._phrase_docs(terms) for terms in phrases]
+        if not matches:
+            return []
+        if search_mode == 'any':
+            candidates = set().union(*matches)
+        else:
+            candidates = set.intersection(*sorted(matches, key=len))
+        if not candidates:
+            return []
+
+        scores = dict.fromkeys(candidates, 0.0)
+        count = len(self.documents)
+        average_length = self.total_length / count
+        for term, query_frequency in Counter(term for terms in phrases for term in terms).items():
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            doc_ids, frequencies = self.postings[term_id]
+            idf = math.log(1 + (count - len(doc_ids) + 0.5) / (len(doc_ids) + 0.5))
+            for doc_id, frequency in zip(doc_ids, frequencies):
+                if doc_id in scores:
+                    length_norm = 1 - self.b + self.b * (len(self.tokens[doc_id]) // 4 - 1) / average_length
+                    scores[doc_id] += query_frequency * idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+        return sorted(((score, doc_id) for doc_id, score in scores.items()), key=lambda hit: (-hit[0], hit[1]))
+
+    def _phrase_docs(self, terms):
+        term_ids = [self.vocabulary.get(term) for term in terms]
+        if None in term_ids:
+            return set()
+        postings = sorted((self.postings[term_id][0] for term_id in set(term_ids)), key=len)
+        candidates = set(postings[0]).intersection(*postings[1:])
+        if len(terms) == 1:
+            return candidates
+        needle = array('I', term_ids).tobytes()
+        return {doc_id for doc_id in candidates if self._contains(self.tokens[doc_id], needle)}
+
+    @staticmethod
+    def _contains(haystack, needle):
+        # Only matches starting on a token boundary count
+        position = haystack.find(needle)
+        while position != -1 and position % 4:
+            position = haystack.find(needle, position + 1)
+        return position != -1
+
+
+class LocalSearchBackend:
+    """Answers Azure Search REST payloads from a LocalSearchIndex over `root`.
+
+    The index is loaded from `index_path` when given, refreshed for files
+    that changed since, and saved back. Extraction of new or changed files
+    runs on `workers` processes.
+    """
+
+    def __init__(self, root, index_path=None, workers=None):
+        self.root = os.path.abspath(root)
+        self.index_path = index_path
+        self.workers = workers or os.cpu_count() or 1
+        self.index = self.build()
+
+    def search(self, payload):
+        """Run a search payload; returns {"value": [...]} like the REST API."""
+        phrases = parse_query(payload.get('search'))
+        filters = parse_filter(payload.get('filter'))
+        skip = int(payload.get('skip', 0))
+        top = int(payload.get('top', 50))
+        select = [field.strip() for field in payload['select'].split(',')] if payload.get('select') else None
+
+        index = self.index
+        hits = [
+            (score, index.documents[doc_id])
+            for score, doc_id in index.search(phrases, payload.get('searchMode', 'any'))
+            if self._matches_filter(index.documents[doc_id], filters)
+        ]
+
+        keywords = ' '.join(term for terms in phrases or [] for term in terms)
+        value = []
+        for score, document in hits[skip:skip + top]:
+            hit = {'@search.score': score}
+            hit.update({
+                field: document.get(field) for field in (select or ('metadata_storage_name', 'metadata_storage_path', 'content'))
+            })
+            if payload.get('highlight') and keywords:
+                highlights = self._highlights(document, payload, keywords)
+                if highlights:
+                    hit['@search.highlights'] = highlights
+            value.append(hit)
+        return {'value': value}
+
+    def build(self):
+        """Load the saved index if any, re-extract new or changed files, and save it back."""
+        previous = self._load()
+        known = {document['metadata_storage_path']: document for document in previous.documents} if previous else {}
+        acl = self._load_acl()
+
+        files = []
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                if os.path.splitext(name)[1].lower() in INDEXED_EXTENSIONS:
+                    path = os.path.join(directory, name)
+                    files.append((os.path.relpath(path, self.root).replace(os.sep, '/'), os.stat(path)))
+        files.sort()
+
+        changed = [
+            relative for relative, stat in files
+            if relative not in known
+            or (known[relative]['size'], known[relative]['mtime']) != (stat.st_size, stat.st_mtime)
+        ]
+        if previous is not None and not changed and len(files) == len(known) and \
+                all(document['authorized_users'] == self._users_for(document['metadata_storage_path'], acl)
+                    for document in previous.documents):
+            return previous
+
+        extracted = dict(zip(changed, self._extract([os.path.join(self.root, relative) for relative in changed])))
+        index = LocalSearchIndex()
+        for relative, stat in files:
+            content = extracted[relative] if relative in extracted else known[relative]['content']
+            index.add({
+                'metadata_storage_name': relative,
+                'metadata_storage_path': relative,
+                'content': content,
+                'authorized_users': self._users_for(relative, acl),
+                'size': stat.st_size,
+                'mtime': stat.st_mtime
+            })
+        logger.info(f"Indexed {len(files)} documents ({len(changed)} extracted) from {self.root}")
+        self._save(index)
+        return index
+
+    def _extract(self, paths):
+        if len(paths) < 2 or self.workers < 2:
+            return [_extract_file(path) for path in paths]
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            return list(pool.map(_extract_file, paths, chunksize=16))
+
+    def _load(self):
+        if not self.index_path or not os.path.exists(self.index_path):
+            return None
+        try:
+            with open(self.index_path, 'rb') as f:
+                version, index = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable search index {self.index_path}: {str(e)}")
+            return None
+        return index if version == INDEX_FORMAT_VERSION else None
+
+    def _save(self, index):
+        if not self.index_path:
+            return
+        # Write then rename, so a crash never leaves a truncated index behind; the temporary
+        # file is this process's own, as every worker builds and saves the index on start
+        fd, temp_path = tempfile.mkstemp(prefix='.index-', dir=os.path.dirname(os.path.abspath(self.index_path)))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((INDEX_FORMAT_VERSION, index), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self.index_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def _load_acl(self):
+        path = os.path.join(self.root, 'acl.json')
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    @staticmethod
+    def _users_for(relative, acl):
+        for pattern, users in acl.items():
+            if fnmatch.fnmatch(relative, pattern):
+                return list(users)
+        return []
+
+    @staticmethod
+    def _matches_filter(document, filters):
+        for field, value in filters:
+            actual = document.get(field)
+            if isinstance(actual, list) and value not in actual:
+                return False
+            if not isinstance(actual, list) and actual != value:
+                return False
+        return True
+
+    @staticmethod
+    def _highlights(document, payload, keywords):
+        # Mirrors the REST API's highlight, highlightPreTag and highlightPostTag
+        field, _, count = payload['highlight'].partition('-')
+        if field != 'content':
+            return None
+        fragments = extract_snippets(document['content'], keywords, max_fragments=int(count or 5))
+        if not fragments:
+            return None
+        pre_tag = payload.get('highlightPreTag', '<em>')
+        post_tag = payload.get('highlightPostTag', '</em>')
+        matcher = get_matcher(keywords)
+        return {'content': [matcher.sub(fragment, lambda matched, _: f'{pre_tag}{matched}{post_tag}') for fragment in fragments]}
+
+
+class AsyncLocalSearchBackend:
+    """Awaitable search() over a LocalSearchBackend, for the async serving mode."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def search(self, payload):
+        return await asyncio.to_thread(self.backend.search, payload)
+
+    async def close(self):
+        pass
@@ -0,0 +1,396 @@
+"""Per-stage timers, counters and a slow-request sampling profiler.
+
+`stage(name)` times a block of work. The time goes into a process-wide
+histogram (rendered for Prometheus by `render_prometheus()`) and into the
+current request's timings (sent back as a Server-Timing header). Request
+timings live in a context variable: work submitted to a thread pool must
+run in `contextvars.copy_context()` to be counted against its request.
+
+Under several worker processes, enable_multiprocess() makes /metrics
+answer for all of them: each process writes its registry to a shared
+directory, and rendering sums the files, gauges included. When a worker
+is gone, retire_process() folds its counters and histograms into the
+directory's archive, so totals never go backwards, and drops its gauges.
+"""
+import collections
+import contextvars
+import fcntl
+import glob
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+METRIC_PREFIX = 'docsearch'
+
+
+class RequestTimings:
+    """Total seconds and call count per stage for one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}  # stage -> [seconds, count]
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            entry = self.stages.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def server_timing(self):
+        """Server-Timing header value: one entry per stage plus the total so far."""
+        with self._lock:
+            entries = [
+                f'{name};dur={seconds * 1000:.1f};desc="{count}x"' if count > 1 else f'{name};dur={seconds * 1000:.1f}'
+                for name, (seconds, count) in self.stages.items()
+            ]
+        entries.append(f'total;dur={(time.perf_counter() - self.started) * 1000:.1f}')
+        return ', '.join(entries)
+
+
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+def start_request():
+    """Start collecting stage timings for the current request; returns them."""
+    timings = RequestTimings()
+    _request_timings.set(timings)
+    return timings
+
+
+def current_timings():
+    return _request_timings.get()
+
+
+class Registry:
+    """Thread-safe counters, gauges and histograms keyed by (name, sorted labels)."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._counters = collections.defaultdict(float)
+        self._gauges = {}
+        self._histograms = {}  # key -> [bucket counts..., sum, count]
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, amount=1, help_text=None, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += amount
+            if help_text:
+                self._help.setdefault(name, help_text)
+
+    def set(self, name, value, help_text=None, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+            if help_text:
+                self._help.setdefault(name, help_text)
+
+    def observe(self, name, seconds, help_text=None, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+            if help_text:
+                self._help.setdefault(name, help_text)
+
+    def snapshot(self):
+        """All values and help texts, as JSON-serializable lists."""
+        with self._lock:
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self._counters.items()],
+                'gauges': [[name, labels, value] for (name, labels), value in self._gauges.items()],
+                'histograms': [[name, labels, list(value)] for (name, labels), value in self._histograms.items()],
+                'help': dict(self._help)
+            }
+
+    def merge(self, snapshot, gauges=True):
+        """Add another registry's snapshot to this one: every value is summed."""
+        with self._lock:
+            for name, labels, value in snapshot['counters']:
+                self._counters[(name, _label_key(labels))] += value
+            if gauges:
+                for name, labels, value in snapshot['gauges']:
+                    key = (name, _label_key(labels))
+                    self._gauges[key] = self._gauges.get(key, 0) + value
+            for name, labels, value in snapshot['histograms']:
+                histogram = self._histograms.setdefault((name, _label_key(labels)), [0] * len(self.buckets) + [0.0, 0])
+                for i, amount in enumerate(value):
+                    histogram[i] += amount
+            for name, help_text in snapshot['help'].items():
+                self._help.setdefault(name, help_text)
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            histograms = sorted((key, list(value)) for key, value in self._histograms.items())
+            help_texts = dict(self._help)
+
+        lines = []
+        declared = set()
+
+        def declare(name, family, kind):
+            if family not in declared:
+                declared.add(family)
+                if name in help_texts:
+                    lines.append(f"# HELP {family} {help_texts[name]}")
+                lines.append(f"# TYPE {family} {kind}")
+
+        for (name, labels), value in counters:
+            declare(name, f"{METRIC_PREFIX}_{name}_total", 'counter')
+            lines.append(f"{METRIC_PREFIX}_{name}_total{_labels(labels)} {value:g}")
+        for (name, labels), value in gauges:
+            declare(name, f"{METRIC_PREFIX}_{name}", 'gauge')
+            lines.append(f"{METRIC_PREFIX}_{name}{_labels(labels)} {value:g}")
+        for (name, labels), histogram in histograms:
+            declare(name, f"{METRIC_PREFIX}_{name}", 'histogram')
+            for bound, bucket_count in zip(self.buckets, histogram):
+                lines.append(f"{METRIC_PREFIX}_{name}_bucket{_labels(labels + (('le', f'{bound:g}'),))} {bucket_count}")
+            lines.append(f"{METRIC_PREFIX}_{name}_bucket{_labels(labels + (('le', '+Inf'),))} {histogram[-1]}")
+            lines.append(f"{METRIC_PREFIX}_{name}_sum{_labels(labels)} {histogram[-2]:.6f}")
+            lines.append(f"{METRIC_PREFIX}_{name}_count{_labels(labels)} {histogram[-1]}")
+        return '\n'.join(lines) + '\n'
+
+
+def _label_key(labels):
+    # Labels come back from JSON as lists of [key, value] lists
+    return tuple(tuple(label) for label in labels)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+
+
+@contextmanager
+def stage(name):
+    """Time a block as `name` in the stage histogram and the current request's timings."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        registry.observe('stage_seconds', seconds, 'Time spent per processing stage', stage=name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.add(name, seconds)
+
+
+def count(name, amount=1, help_text=None, **labels):
+    """Add to a counter, e.g. count('blob_bytes_downloaded', len(data))."""
+    registry.inc(name, amount, help_text, **labels)
+
+
+def gauge(name, value, help_text=None, **labels):
+    """Set a gauge to its current value, e.g. gauge('highlight_queue_depth', 3)."""
+    registry.set(name, value, help_text, **labels)
+
+
+def observe(name, seconds, help_text=None, **labels):
+    """Record a duration in a histogram other than the stage histogram."""
+    registry.observe(name, seconds, help_text, **labels)
+
+
+def observe_request(endpoint, status, seconds):
+    registry.observe('request_seconds', seconds, 'Request latency by endpoint', endpoint=endpoint)
+    registry.inc('requests', 1, 'Requests by endpoint and status', endpoint=endpoint, status=status)
+
+
+def render_prometheus():
+    if _multiprocess_dir is None:
+        return registry.render()
+    flush()
+    return collect(_multiprocess_dir).render()
+
+
+# Set by enable_multiprocess(); guarded by _flush_lock
+_multiprocess_dir = None
+_flush_lock = threading.Lock()
+
+ARCHIVE_FILE = 'archive.json'
+
+
+def enable_multiprocess(directory, flush_interval=1.0):
+    """Share this process's metrics through `directory` with the other processes writing there.
+
+    The registry is written to <directory>/<pid>.json every `flush_interval`
+    seconds and on every render, so other processes see it at most that late.
+    """
+    global _multiprocess_dir
+    os.makedirs(directory, exist_ok=True)
+    with _flush_lock:
+        _multiprocess_dir = directory
+    threading.Thread(target=_flush_periodically, args=(flush_interval,), name="metrics-flush", daemon=True).start()
+
+
+def disable_multiprocess():
+    """Write this process's final values and stop sharing them; call as the process exits."""
+    global _multiprocess_dir
+    with _flush_lock:
+        if _multiprocess_dir is not None:
+            _write_snapshot(_process_file(_multiprocess_dir, os.getpid()), registry.snapshot())
+        _multiprocess_dir = None
+
+
+def flush():
+    """Write this process's registry to the shared directory, if enabled."""
+    with _flush_lock:
+        if _multiprocess_dir is not None:
+            _write_snapshot(_process_file(_multiprocess_dir, os.getpid()), registry.snapshot())
+
+
+def collect(directory):
+    """A registry holding the sum of every process's values in `directory`, retired ones included."""
+    merged = Registry()
+    with _directory_lock(directory, fcntl.LOCK_SH):
+        for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+            snapshot = _read_snapshot(path)
+            if snapshot is not None:
+                merged.merge(snapshot)
+    return merged
+
+
+def retire_process(directory, pid):
+    """Fold a finished process's counters and histograms into the archive and remove its file.
+
+    Called by the process that reaped it; its gauges no longer describe
+    anything and are dropped.
+    """
+    path = _process_file(directory, pid)
+    with _directory_lock(directory, fcntl.LOCK_EX):
+        snapshot = _read_snapshot(path)
+        if snapshot is None:
+            return
+        archive_path = os.path.join(directory, ARCHIVE_FILE)
+        archive = Registry()
+        previous = _read_snapshot(archive_path)
+        if previous is not None:
+            archive.merge(previous)
+        archive.merge(snapshot, gauges=False)
+        _write_snapshot(archive_path, archive.snapshot())
+        os.unlink(path)
+
+
+def _flush_periodically(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            flush()
+        except OSError as e:
+            logger.warning(f"Could not write metrics for other processes: {str(e)}")
+
+
+def _process_file(directory, pid):
+    return os.path.join(directory, f"{pid}.json")
+
+
+@contextmanager
+def _directory_lock(directory, operation):
+    # Readers never see a retired process both in its file and in the archive
+    fd = os.open(os.path.join(directory, '.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, operation)
+        yield
+    finally:
+        os.close(fd)
+
+
+def _write_snapshot(path, snapshot):
+    # Write then rename, so readers never see half a file
+    directory, name = os.path.split(path)
+    temp_path = os.path.join(directory, f".{name}.{os.getpid()}.tmp")
+    with open(temp_path, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(temp_path, path)
+
+
+def _read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        logger.warning(f"Ignoring unreadable metrics file {path}: {str(e)}")
+        return None
+
+
+class SlowRequestProfiler:
+    """Samples the stacks of in-flight request threads; reports requests slower than `threshold`.
+
+    One daemon thread wakes every `interval` seconds and records the
+    innermost frames of each registered thread, so the cost is independent
+    of the request rate and nothing is collected for fast requests beyond
+    a few samples.
+    """
+
+    def __init__(self, threshold, interval=0.01, depth=12):
+        self.threshold = threshold
+        self.interval = interval
+        self.depth = depth
+        self._samples = {}  # thread id -> Counter of stacks
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+        self._thread.start()
+
+    def begin(self):
+        with self._lock:
+            self._samples[threading.get_ident()] = collections.Counter()
+
+    def end(self, elapsed):
+        """Stop sampling this thread; returns a report of the top stacks if the request was slow, else None."""
+        with self._lock:
+            samples = self._samples.pop(threading.get_ident(), None)
+        if not samples or elapsed < self.threshold:
+            return None
+        total = sum(samples.values())
+        lines = [f"{total} samples every {self.interval * 1000:.0f}ms, top stacks:"]
+        for stack, hits in samples.most_common(5):
+            lines.append(f"  {hits / total:5.1%}  " + ' <- '.join(reversed(stack)))
+        return '\n'.join(lines)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                thread_ids = list(self._samples)
+            if not thread_ids:
+                continue
+            frames = sys._current_frames()
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None and len(stack) < self.depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                    frame = frame.f_back
+                with self._lock:
+                    samples = self._samples.get(thread_id)
+                    if samples is not None:
+                        samples[tuple(reversed(stack))] += 1
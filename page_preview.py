@@ -0,0 +1,80 @@
+"""Server-rendered page images for previews, with keyword highlights drawn in.
+
+A preview asks for its document's layout first (page sizes and the pages
+with hits), then for page images one at a time as they scroll into view,
+so a large document never goes to the browser whole. Word documents are
+converted to PDF with LibreOffice and rendered the same way.
+"""
+import io
+import os
+import pathlib
+import subprocess
+import tempfile
+
+import fitz
+
+from highlighter import annotate_pdf_hits, find_pdf_hits, normalize_keywords, open_pdf
+
+
+def document_layout(source, keywords, word_index=None):
+    """Page sizes in points and the 1-based numbers of the pages with hits.
+
+    Returns {'pages': [[width, height], ...], 'hit_pages': [...]}.
+    """
+    keywords = normalize_keywords(keywords)
+    doc = open_pdf(source)
+    try:
+        pages = [[round(page.rect.width, 2), round(page.rect.height, 2)] for page in doc]
+        if word_index is not None:
+            hits = word_index.find(keywords)
+        else:
+            hits = find_pdf_hits(doc, keywords, range(len(doc)))
+        return {'pages': pages, 'hit_pages': sorted({page_num + 1 for page_num, _, _ in hits})}
+    finally:
+        doc.close()
+
+
+def render_page(source, page_num, zoom, keywords, word_index=None, quality=75):
+    """JPEG of one page (0-based) at `zoom` x 72 dpi, its keywords highlighted; IndexError if there is no such page.
+
+    Only this page is searched and annotated, in memory; the source is not changed.
+    """
+    keywords = normalize_keywords(keywords)
+    doc = open_pdf(source)
+    try:
+        if not 0 <= page_num < len(doc):
+            raise IndexError(f"Page {page_num + 1} is not in the document")
+        if word_index is not None:
+            hits = [hit for hit in word_index.find(keywords) if hit[0] == page_num]
+        else:
+            hits = find_pdf_hits(doc, keywords, [page_num])
+        annotate_pdf_hits(doc, hits)
+        pixmap = doc[page_num].get_pixmap(matrix=fitz.Matrix(zoom, zoom), annots=True)
+        return pixmap.tobytes('jpeg', jpg_quality=quality)
+    finally:
+        doc.close()
+
+
+def convert_to_pdf(source, converter, suffix='.docx', timeout=120):
+    """Convert a document given as a path, a BytesIO or bytes to PDF bytes with a headless LibreOffice `converter`."""
+    with tempfile.TemporaryDirectory(prefix='docsearch-convert-') as workdir:
+        if not isinstance(source, str):
+            path = os.path.join(workdir, 'document' + suffix)
+            with open(path, 'wb') as file:
+                file.write(source.getbuffer() if isinstance(source, io.BytesIO) else source)
+            source = path
+        # A profile per conversion, so concurrent conversions don't wait on one office instance
+        profile = pathlib.Path(workdir, 'profile').as_uri()
+        outdir = os.path.join(workdir, 'out')
+        subprocess.run(
+            [converter, f'-env:UserInstallation={profile}', '--headless', '--convert-to', 'pdf', '--outdir', outdir, source],
+            check=True,
+            timeout=timeout,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE
+        )
+        output = os.path.join(outdir, os.path.splitext(os.path.basename(source))[0] + '.pdf')
+        if not os.path.exists(output):
+            raise RuntimeError(f"{converter} did not produce a PDF")
+        with open(output, 'rb') as file:
+            return file.read()
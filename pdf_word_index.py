@@ -0,0 +1,174 @@
+"""Precomputed word positions of a PDF, for highlighting without a text search.
+
+A PdfWordIndex holds every word of a document with its bounding box,
+extracted once per PDF version. Looking up a keyword scans the distinct
+words of the document (not its pages) for ones containing it and turns
+each occurrence into a quad. Highlighting then costs time proportional to
+the number of hits rather than pages x keywords.
+
+The serialized form is a handful of little-endian arrays, zlib-compressed:
+
+    header        magic, page count, word count, vocabulary size
+    vocabulary    distinct lowercase words, newline-separated
+    term_starts   per vocabulary entry, its first slot in `occurrences`
+    occurrences   word numbers grouped by vocabulary entry
+    page_starts   per page, the number of its first word
+    boxes         x0, y0, x1, y1 per word, as float32
+"""
+import bisect
+import struct
+import sys
+import zlib
+from array import array
+
+from highlighter import PDF_TEXT_FLAGS, open_pdf
+
+FORMAT_MAGIC = b'PWI1'
+HEADER = struct.Struct('<4sIII')
+
+
+class PdfWordIndex:
+    """Words of a PDF with their boxes, grouped by lowercase text for lookup."""
+
+    def __init__(self, vocabulary, term_starts, occurrences, page_starts, boxes):
+        self.vocabulary = vocabulary
+        self.term_starts = term_starts
+        self.occurrences = occurrences
+        self.page_starts = page_starts
+        self.boxes = boxes
+
+    @property
+    def page_count(self):
+        return len(self.page_starts) - 1
+
+    @classmethod
+    def from_pages(cls, pages):
+        """Build from an iterable of per-page word lists [(x0, y0, x1, y1, text), ...] in page order."""
+        terms = {}  # lowercase word -> its word numbers
+        page_starts = array('I', [0])
+        boxes = array('f')
+        word_count = 0
+        for words in pages:
+            for x0, y0, x1, y1, text in words:
+                terms.setdefault(text.lower(), []).append(word_count)
+                boxes.extend((x0, y0, x1, y1))
+                word_count += 1
+            page_starts.append(word_count)
+
+        vocabulary = sorted(terms)
+        term_starts = array('I', [0])
+        occurrences = array('I')
+        for term in vocabulary:
+            occurrences.extend(terms[term])
+            term_starts.append(len(occurrences))
+        return cls(vocabulary, term_starts, occurrences, page_starts, boxes)
+
+    def find(self, keywords):
+        """Return (page number, keyword index, quads) hits, like highlighter.find_pdf_hits().
+
+        A keyword matches wherever it occurs inside a word, as search_for()
+        would; the quad of a partial match is the matching share of the
+        word's box, split in proportion to its characters.
+        """
+        by_page = {}  # (page, keyword index) -> quads
+        for keyword_index, keyword in enumerate(keywords):
+            if not keyword:
+                continue
+            for term_id, term in enumerate(self.vocabulary):
+                start = term.find(keyword)
+                if start == -1:
+                    continue
+                spans = []
+                while start != -1:
+                    spans.append((start / len(term), (start + len(keyword)) / len(term)))
+                    start = term.find(keyword, start + len(keyword))
+                for slot in range(self.term_starts[term_id], self.term_starts[term_id + 1]):
+                    word = self.occurrences[slot]
+                    page_num = bisect.bisect_right(self.page_starts, word) - 1
+                    x0, y0, x1, y1 = self.boxes[word * 4:word * 4 + 4]
+                    quads = by_page.setdefault((page_num, keyword_index), [])
+                    for lo, hi in spans:
+                        left, right = x0 + (x1 - x0) * lo, x0 + (x1 - x0) * hi
+                        quads.append((left, y0, right, y0, left, y1, right, y1))
+        return [(page_num, keyword_index, quads) for (page_num, keyword_index), quads in sorted(by_page.items())]
+
+    def dumps(self):
+        vocabulary = '\n'.join(self.vocabulary).encode('utf-8')
+        parts = [
+            HEADER.pack(FORMAT_MAGIC, self.page_count, len(self.occurrences), len(self.vocabulary)),
+            struct.pack('<I', len(vocabulary)), vocabulary
+        ]
+        for values in (self.term_starts, self.occurrences, self.page_starts, self.boxes):
+            parts.append(_little_endian(values).tobytes())
+        return zlib.compress(b''.join(parts), 6)
+
+    @classmethod
+    def loads(cls, data):
+        """Inverse of dumps(); raises ValueError for data in another format."""
+        data = memoryview(zlib.decompress(data))
+        magic, page_count, word_count, vocabulary_size = HEADER.unpack_from(data)
+        if magic != FORMAT_MAGIC:
+            raise ValueError("Not a PDF word index")
+        offset = HEADER.size
+        (vocabulary_bytes,) = struct.unpack_from('<I', data, offset)
+        offset += 4
+        text = bytes(data[offset:offset + vocabulary_bytes]).decode('utf-8')
+        vocabulary = text.split('\n') if vocabulary_size else []
+        offset += vocabulary_bytes
+
+        arrays = []
+        for typecode, length in (('I', vocabulary_size + 1), ('I', word_count), ('I', page_count + 1), ('f', word_count * 4)):
+            values = array(typecode)
+            end = offset + length * values.itemsize
+            values.frombytes(data[offset:end])
+            arrays.append(_little_endian(values))
+            offset = end
+        return cls(vocabulary, *arrays)
+
+
+def _little_endian(values):
+    # The arrays are native-endian in memory and little-endian on disk
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+def extract_pdf_words(doc, page_numbers):
+    """Per-page word lists [(x0, y0, x1, y1, text), ...] for the given pages."""
+    return [
+        [word[:5] for word in doc[page_num].get_text('words', flags=PDF_TEXT_FLAGS)]
+        for page_num in page_numbers
+    ]
+
+
+def extract_pdf_words_in_range(source, start, stop):
+    """Process-pool entry point: extract_pdf_words() over pages [start, stop) of a PDF given as bytes or a path."""
+    doc = open_pdf(source)
+    try:
+        return extract_pdf_words(doc, range(start, stop))
+    finally:
+        doc.close()
+
+
+def build_pdf_word_index(source, executor=None, workers=1, parallel_min_pages=200, source_path=None):
+    """Extract a PdfWordIndex from a PDF given as a path, a BytesIO or a buffer.
+
+    Large documents are split into page ranges across `executor` the same
+    way highlight_pdf() splits its search.
+    """
+    doc = open_pdf(source)
+    try:
+        page_count = len(doc)
+        if executor is not None and workers > 1 and page_count >= parallel_min_pages:
+            chunk = -(-page_count // workers)
+            futures = [
+                executor.submit(extract_pdf_words_in_range, source_path or source, start, min(start + chunk, page_count))
+                for start in range(0, page_count, chunk)
+            ]
+            pages = [words for future in futures for words in future.result()]
+        else:
+            pages = extract_pdf_words(doc, range(page_count))
+    finally:
+        doc.close()
+    return PdfWordIndex.from_pages(pages)
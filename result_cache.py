@@ -0,0 +1,130 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class SqliteResultStore:
+    """Result store in a SQLite file, shared by every worker process on the host.
+
+    Rows expire after `ttl` seconds; expired rows and rows beyond
+    `max_rows` (oldest first) are purged on every `purge_every` writes.
+    """
+
+    def __init__(self, path, ttl, max_rows=10000, purge_every=100):
+        self.path = path
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.purge_every = purge_every
+        self._writes = 0
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, latency REAL NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def get(self, key):
+        """Return (value, latency) for a fresh row, or None."""
+        row = self._connection().execute(
+            "SELECT value, latency FROM results WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return tuple(row) if row else None
+
+    def put(self, key, value, latency):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, latency, expires_at) VALUES (?, ?, ?, ?)",
+                (key, value, latency, time.time() + self.ttl)
+            )
+            self._writes += 1
+            if self._writes % self.purge_every == 0:
+                conn.execute("DELETE FROM results WHERE expires_at <= ?", (time.time(),))
+                conn.execute(
+                    "DELETE FROM results WHERE key IN ("
+                    "SELECT key FROM results ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_rows,)
+                )
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+
+class ResultCache:
+    """Short-lived cache of fully enriched search results.
+
+    Entries live in a bounded in-process LRU, optionally backed by a shared
+    store so that workers see each other's results. Callers must put
+    everything that changes the results, the user's ACL filter included,
+    into the key: results are never shared across keys.
+    """
+
+    def __init__(self, ttl=60, max_entries=1000, max_bytes=64 * 1024 ** 2, shared_store=None):
+        self._memory = TTLCache(max_entries=max_entries, ttl=ttl, max_bytes=max_bytes)
+        self.shared_store = shared_store
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def get(self, key):
+        """Return the cached results for `key`, or None."""
+        key = json.dumps(key)
+        entry = self._memory.get(key)
+        shared = False
+        if entry is None and self.shared_store is not None:
+            try:
+                entry = self.shared_store.get(key)
+            except sqlite3.Error as e:
+                logger.warning(f"Shared result store read failed: {str(e)}")
+            if entry is not None:
+                shared = True
+                self._memory.put(key, entry, size=len(entry[0]))
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.shared_hits += shared
+            self.saved_seconds += entry[1]
+        return json.loads(entry[0])
+
+    def put(self, key, results, latency):
+        """Cache results that took `latency` seconds to compute."""
+        key = json.dumps(key)
+        value = json.dumps(results)
+        self._memory.put(key, (value, latency), size=len(value))
+        if self.shared_store is not None:
+            try:
+                self.shared_store.put(key, value, latency)
+            except sqlite3.Error as e:
+                logger.warning(f"Shared result store write failed: {str(e)}")
+
+    def clear(self):
+        """Drop the in-process entries; the shared store keeps its rows until they expire."""
+        self._memory.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'saved_seconds': round(self.saved_seconds, 3),
+                'memory': self._memory.stats(),
+            }
@@ -0,0 +1,52 @@
+import datetime
+
+from azure.storage.blob import generate_blob_sas, BlobSasPermissions
+
+from cache import TTLCache
+from metrics import stage
+
+
+class SasUrlIssuer:
+    """Issues signed blob URLs and reuses them for part of their lifetime.
+
+    URLs are cached per (blob, permission, content disposition) and reissued
+    once `refresh_fraction` of `lifetime` has passed, so a handed-out URL is
+    always valid for at least the remaining share. Repeated searches skip
+    the HMAC signing and browsers see the same URL for the same document.
+    """
+
+    def __init__(self, container_client, account_key, lifetime=datetime.timedelta(hours=1),
+                 refresh_fraction=0.5, max_entries=10000):
+        self.container_client = container_client
+        self.account_key = account_key
+        self.lifetime = lifetime
+        self._cache = TTLCache(max_entries=max_entries, ttl=lifetime.total_seconds() * refresh_fraction)
+
+    def url(self, blob_name, permission='r', content_disposition='inline'):
+        """Return a SAS URL for a blob, signing a new one only if the cached one is due for refresh."""
+        key = (blob_name, permission, content_disposition)
+        url = self._cache.get(key)
+        if url is None:
+            with stage('sas_sign'):
+                url = self._sign(blob_name, permission, content_disposition)
+            self._cache.put(key, url)
+        return url
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        return self._cache.stats()
+
+    def _sign(self, blob_name, permission, content_disposition):
+        blob_client = self.container_client.get_blob_client(blob_name)
+        sas_token = generate_blob_sas(
+            account_name=blob_client.account_name,
+            container_name=blob_client.container_name,
+            blob_name=blob_name,
+            account_key=self.account_key,
+            permission=BlobSasPermissions.from_string(permission),
+            expiry=datetime.datetime.now(datetime.timezone.utc) + self.lifetime,
+            content_disposition=content_disposition
+        )
+        return f"{blob_client.url}?{sas_token}"
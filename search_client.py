@@ -0,0 +1,266 @@
+import asyncio
+import email.utils
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import aiohttp
+except ImportError:  # only needed by the async serving mode (asgi_app.py)
+    aiohttp = None
+
+# Status codes that mean "try again later" rather than "bad request"
+RETRYABLE_STATUS_CODES = {429, 503}
+
+
+def backoff_delay(attempt, base, cap):
+    """Full-jitter exponential backoff for the given retry attempt (0-based)."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def retry_after_seconds(headers):
+    """Seconds to wait from retry-after-ms / Retry-After headers, or None."""
+    retry_after_ms = headers.get('retry-after-ms')
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get('Retry-After')
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class SearchServiceError(requests.exceptions.RequestException):
+    """The search service kept failing or throttling after all retries."""
+
+
+class CircuitOpenError(SearchServiceError):
+    """Raised without calling the service while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Fails fast after repeated service failures.
+
+    After `failure_threshold` consecutive failures the circuit opens and
+    calls are refused for `reset_timeout` seconds. Then a single trial call
+    is let through: success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    def allow(self):
+        """Whether a call may go to the service now."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+    def release(self):
+        """A call let through ended without telling anything about the service (cancelled)."""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+class AzureSearchClient:
+    """Client for the Azure Cognitive Search REST API.
+
+    Keeps a pooled keep-alive Session, applies connect/read timeouts, retries
+    throttled and unavailable responses (429/503) and connection errors with
+    jittered exponential backoff honouring Retry-After, and trips a circuit
+    breaker when the service keeps failing.
+    """
+
+    def __init__(self, endpoint, api_key, pool_size=20, connect_timeout=3.05, read_timeout=15,
+                 max_retries=3, backoff_base=0.5, backoff_max=8, breaker=None):
+        self.endpoint = endpoint
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            "api-key": api_key
+        })
+
+    def search(self, payload):
+        """POST a search payload and return the decoded JSON response."""
+        if not self.breaker.allow():
+            raise CircuitOpenError("Search service circuit breaker is open")
+
+        try:
+            response = self._post_with_retries(payload)
+        except requests.exceptions.RequestException:
+            self.breaker.record_failure()
+            raise
+
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            # Client errors (bad query, auth) say nothing about service health
+            self.breaker.record_success()
+        response.raise_for_status()
+        return response.json()
+
+    def _post_with_retries(self, payload):
+        attempt = 0
+        while True:
+            try:
+                response = self.session.post(self.endpoint, json=payload, timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_max)
+            else:
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    return response
+                if attempt >= self.max_retries:
+                    raise SearchServiceError(
+                        f"Search service returned {response.status_code} after {attempt + 1} attempts",
+                        response=response
+                    )
+                retry_after = retry_after_seconds(response.headers)
+                if retry_after is not None and retry_after > self.backoff_max:
+                    # Waiting that long would hold the request thread; give up now
+                    raise SearchServiceError(
+                        f"Search service asked to retry after {retry_after:.0f}s",
+                        response=response
+                    )
+                delay = retry_after if retry_after is not None else backoff_delay(attempt, self.backoff_base, self.backoff_max)
+            time.sleep(delay)
+            attempt += 1
+
+
+class AsyncAzureSearchClient:
+    """asyncio counterpart of AzureSearchClient, built on aiohttp.
+
+    Same pooling, timeouts, retry and circuit breaker behaviour. The
+    aiohttp session is created on first use, inside the running event loop;
+    call close() on shutdown.
+    """
+
+    def __init__(self, endpoint, api_key, pool_size=100, connect_timeout=3.05, read_timeout=15,
+                 max_retries=3, backoff_base=0.5, backoff_max=8, breaker=None):
+        if aiohttp is None:
+            raise RuntimeError("aiohttp is required for the async search client")
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self._session = None
+
+    async def search(self, payload):
+        """POST a search payload and return the decoded JSON response."""
+        if not self.breaker.allow():
+            raise CircuitOpenError("Search service circuit breaker is open")
+
+        try:
+            status, body = await self._post_with_retries(payload)
+        except SearchServiceError:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            # Cancelled (the client went away): another trial must be able to run
+            self.breaker.release()
+            raise
+
+        if status >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        if status >= 400:
+            raise SearchServiceError(f"Search service returned {status}")
+        return body
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=self.timeout,
+                headers={"Content-Type": "application/json", "api-key": self.api_key}
+            )
+        return self._session
+
+    async def _post_with_retries(self, payload):
+        attempt = 0
+        while True:
+            try:
+                async with self._get_session().post(self.endpoint, json=payload) as response:
+                    if response.status not in RETRYABLE_STATUS_CODES:
+                        body = await response.json(content_type=None) if response.status < 400 else None
+                        return response.status, body
+                    status, headers = response.status, response.headers
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt >= self.max_retries:
+                    raise SearchServiceError(f"Search service unreachable: {str(e)}") from e
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_max)
+            except (aiohttp.ClientError, ValueError) as e:
+                # Broken or undecodable response body
+                raise SearchServiceError(f"Invalid response from search service: {str(e)}") from e
+            else:
+                if attempt >= self.max_retries:
+                    raise SearchServiceError(f"Search service returned {status} after {attempt + 1} attempts")
+                retry_after = retry_after_seconds(headers)
+                if retry_after is not None and retry_after > self.backoff_max:
+                    raise SearchServiceError(f"Search service asked to retry after {retry_after:.0f}s")
+                delay = retry_after if retry_after is not None else backoff_delay(attempt, self.backoff_base, self.backoff_max)
+            await asyncio.sleep(delay)
+            attempt += 1
@@ -0,0 +1,163 @@
+"""Production entry point: the app under gunicorn, with the highlighted-copy cleanup in one worker.
+
+    python serve.py
+
+SERVE_WORKER_CLASS picks the worker model:
+- 'sync': pre-forked single-threaded workers, one request each at a time
+- 'gthread': pre-forked workers with SERVE_THREADS request threads each
+- 'uvicorn': the Quart app (asgi_app) on one event loop per worker, for
+  many concurrent requests that mostly wait on Azure
+
+Heavy libraries (PyMuPDF, python-docx, the Azure SDKs) are imported in the
+master before it forks, so workers start quickly and share those pages.
+The app itself is loaded in each worker: its HTTP clients, caches, locks
+and process pools don't survive a fork. On SIGTERM, workers stop accepting
+connections and finish the requests they have for up to
+SERVE_GRACEFUL_TIMEOUT seconds.
+
+Whichever worker holds CLEANUP_LOCK_PATH runs the cleanup scheduler; when
+it exits, another worker takes the lock over, so no separate cleanup
+process is needed.
+
+Workers share their metrics through METRICS_DIR, so /metrics answers for
+the whole server whichever worker serves the scrape. The directory is
+emptied on start, and each worker's counters are folded into an archive
+when the master reaps the worker.
+"""
+import importlib
+import os
+import shutil
+import sys
+import tempfile
+
+from dotenv import load_dotenv
+from gunicorn.app.base import BaseApplication
+
+import metrics
+
+# Load environment variables
+load_dotenv()
+
+WORKER_CLASSES = {
+    'sync': 'sync',
+    'gthread': 'gthread',
+    'uvicorn': 'uvicorn.workers.UvicornWorker'
+}
+
+# Configuration
+SERVE_WORKER_CLASS = os.getenv("SERVE_WORKER_CLASS", "gthread").lower()
+SERVE_BIND = os.getenv("SERVE_BIND", f"0.0.0.0:{os.getenv('PORT', '5001')}")
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", str(os.cpu_count() or 1)))
+# Request threads per worker ('gthread' only)
+SERVE_THREADS = int(os.getenv("SERVE_THREADS", "8"))
+# A worker silent for this long is killed and replaced; highlighting a large document must fit
+SERVE_TIMEOUT = int(os.getenv("SERVE_TIMEOUT", "120"))
+# Time to finish in-flight requests on shutdown; keep below the container's stop timeout
+SERVE_GRACEFUL_TIMEOUT = int(os.getenv("SERVE_GRACEFUL_TIMEOUT", "25"))
+SERVE_KEEPALIVE_SECONDS = int(os.getenv("SERVE_KEEPALIVE_SECONDS", "5"))
+# Replace a worker after this many requests, plus up to the jitter so they don't all restart together; 0 never
+SERVE_MAX_REQUESTS = int(os.getenv("SERVE_MAX_REQUESTS", "0"))
+SERVE_MAX_REQUESTS_JITTER = int(os.getenv("SERVE_MAX_REQUESTS_JITTER", "0"))
+
+# Lock files shared by the workers of this host
+SERVE_RUNTIME_DIR = os.getenv("SERVE_RUNTIME_DIR", os.path.join(tempfile.gettempdir(), "docsearch"))
+# Run the highlighted-copy cleanup in the elected worker instead of cleanup_scheduler.py
+CLEANUP_IN_PROCESS = os.getenv("CLEANUP_IN_PROCESS", "true").lower() == "true"
+CLEANUP_LOCK_PATH = os.getenv("CLEANUP_LOCK_PATH", os.path.join(SERVE_RUNTIME_DIR, "cleanup.lock"))
+# Each worker writes its metrics here every METRICS_FLUSH_SECONDS for /metrics to sum across workers
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(SERVE_RUNTIME_DIR, "metrics"))
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "1"))
+
+# Imported once in the master; none of them start threads or open connections on import
+PRELOAD_MODULES = [
+    'fitz', 'docx', 'requests', 'azure.storage.blob', 'apscheduler.schedulers.background',
+    'highlighter', 'pdf_word_index', 'page_preview'
+]
+
+
+def post_worker_init(worker):
+    metrics.enable_multiprocess(METRICS_DIR, METRICS_FLUSH_SECONDS)
+    if CLEANUP_IN_PROCESS:
+        import cleanup_scheduler
+        # Election and sweep reports go to gunicorn's error log
+        cleanup_scheduler.logger.handlers = worker.log.error_log.handlers
+        cleanup_scheduler.logger.setLevel(worker.log.error_log.level)
+        cleanup_scheduler.start_scheduler_when_elected(CLEANUP_LOCK_PATH)
+
+
+def worker_exit(server, worker):
+    metrics.disable_multiprocess()
+    # Stop this worker's highlighting processes with it
+    sync_app = sys.modules.get('app')
+    if sync_app is None:
+        return
+    if sync_app.highlight_pool is not None:
+        sync_app.highlight_pool.shutdown()
+    if sync_app.pdf_process_pool is not None:
+        sync_app.pdf_process_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def child_exit(server, worker):
+    # In the master, for every worker that exited, killed ones included
+    metrics.retire_process(METRICS_DIR, worker.pid)
+
+
+class ServeApplication(BaseApplication):
+    """gunicorn configured from the SERVE_* settings instead of a config file."""
+
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # Called in each worker after the fork
+        if SERVE_WORKER_CLASS == 'uvicorn':
+            from asgi_app import app
+        else:
+            from app import app
+        return app
+
+
+def serve_options():
+    if SERVE_WORKER_CLASS not in WORKER_CLASSES:
+        raise ValueError(f"SERVE_WORKER_CLASS must be one of {', '.join(WORKER_CLASSES)}, not {SERVE_WORKER_CLASS!r}")
+    return {
+        'bind': SERVE_BIND,
+        'worker_class': WORKER_CLASSES[SERVE_WORKER_CLASS],
+        'workers': SERVE_WORKERS,
+        # gunicorn turns sync workers with several threads into gthread ones
+        'threads': SERVE_THREADS if SERVE_WORKER_CLASS == 'gthread' else 1,
+        'timeout': SERVE_TIMEOUT,
+        'graceful_timeout': SERVE_GRACEFUL_TIMEOUT,
+        'keepalive': SERVE_KEEPALIVE_SECONDS,
+        'max_requests': SERVE_MAX_REQUESTS,
+        'max_requests_jitter': SERVE_MAX_REQUESTS_JITTER,
+        'accesslog': '-',
+        'post_worker_init': post_worker_init,
+        'worker_exit': worker_exit,
+        'child_exit': child_exit
+    }
+
+
+def main():
+    options = serve_options()
+    # Each worker has its own highlight pool; split the CPUs between them unless set explicitly
+    os.environ.setdefault("HIGHLIGHT_POOL_WORKERS", str(max(1, (os.cpu_count() or 1) // SERVE_WORKERS)))
+    # Identical searches and highlight jobs in different workers wait for one another
+    os.environ.setdefault("SINGLEFLIGHT_LOCK_DIR", os.path.join(SERVE_RUNTIME_DIR, "singleflight"))
+    os.makedirs(SERVE_RUNTIME_DIR, exist_ok=True)
+    # Counts left by an earlier run would be added to this one's
+    shutil.rmtree(METRICS_DIR, ignore_errors=True)
+    os.makedirs(METRICS_DIR)
+
+    for name in PRELOAD_MODULES:
+        importlib.import_module(name)
+    ServeApplication(options).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""Coalescing of concurrent identical calls into one execution.
+
+When a search term is shared around, a dozen people run the same query
+within seconds, and each would otherwise search, enrich, highlight and
+upload the same thing on its own. SingleFlight.do(key, func) runs `func`
+once per key at a time: calls that arrive while it is in flight wait for
+it and get the same result (or exception). Results are shared objects;
+callers must not modify them.
+
+With a `lock_dir`, the leader of each key also takes an flock on one of
+`stripes` lock files there, so leaders in other worker processes queue
+behind it. A leader that had to wait calls `recheck()` first, which can
+pick up what the other process stored (a shared result store, an
+uploaded blob) instead of doing the work again. Unrelated keys that
+share a stripe merely queue; the lock files are reused, never removed.
+"""
+import asyncio
+import contextvars
+import fcntl
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+from functools import partial
+
+from metrics import count
+
+# (flight group, key) pairs and lock files the current call chain holds, so nested calls don't wait on themselves
+_leading = contextvars.ContextVar('singleflight_leading', default=frozenset())
+_held_stripes = contextvars.ContextVar('singleflight_stripes', default=frozenset())
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs one call per key at a time across threads and, with `lock_dir`, processes."""
+
+    def __init__(self, name, lock_dir=None, stripes=256):
+        self.name = name
+        self.lock_dir = lock_dir
+        self.stripes = stripes
+        self._flights = {}
+        self._lock = threading.Lock()
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+
+    def do(self, key, func, *args, recheck=None, **kwargs):
+        """Return func(*args, **kwargs), shared with concurrent calls for the same key.
+
+        `recheck`, if given, is called instead when this process had to
+        wait for another one's lock; a non-None result is returned as is.
+        """
+        if (id(self), key) in _leading.get():
+            # Called again from inside its own flight (a retry): waiting would deadlock
+            return func(*args, **kwargs)
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            count('singleflight', 1, 'Coalesced calls by group and outcome', group=self.name, outcome='shared')
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        count('singleflight', 1, 'Coalesced calls by group and outcome', group=self.name, outcome='leader')
+        token = _leading.set(_leading.get() | {(id(self), key)})
+        try:
+            with self._process_lock(key) as waited:
+                value = recheck() if waited and recheck is not None else None
+                flight.result = value if value is not None else func(*args, **kwargs)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            _leading.reset(token)
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+    @contextmanager
+    def _process_lock(self, key):
+        """Hold this key's lock file stripe; yields whether another process had it first."""
+        path = self._stripe_path(key)
+        if path is None or path in _held_stripes.get():
+            yield False
+            return
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        token = _held_stripes.set(_held_stripes.get() | {path})
+        try:
+            waited = not _try_flock(fd)
+            if waited:
+                count('singleflight', 1, 'Coalesced calls by group and outcome', group=self.name, outcome='waited')
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            yield waited
+        finally:
+            _held_stripes.reset(token)
+            # Closing the descriptor releases the lock
+            os.close(fd)
+
+    def _stripe_path(self, key):
+        if not self.lock_dir:
+            return None
+        # hash() differs between processes; the stripe must not
+        digest = hashlib.sha256(repr(key).encode('utf-8')).digest()
+        stripe = int.from_bytes(digest[:4], 'big') % self.stripes
+        return os.path.join(self.lock_dir, f"{self.name}-{stripe:03d}.lock")
+
+
+class AsyncSingleFlight(SingleFlight):
+    """SingleFlight for coroutines on one event loop; the cross-process lock is taken on a thread."""
+
+    async def do(self, key, func, *args, recheck=None, **kwargs):
+        """Return await func(*args, **kwargs), shared with concurrent calls for the same key.
+
+        `recheck` is a coroutine function, used as in SingleFlight.do().
+        The call runs in its own task, which every caller awaits shielded:
+        a caller that is cancelled (its client went away) stops waiting,
+        and the others still get the result.
+        """
+        if (id(self), key) in _leading.get():
+            return await func(*args, **kwargs)
+
+        flight = self._flights.get(key)
+        if flight is None:
+            count('singleflight', 1, 'Coalesced calls by group and outcome', group=self.name, outcome='leader')
+            flight = self._flights[key] = asyncio.ensure_future(self._lead(key, func, args, kwargs, recheck))
+            flight.add_done_callback(partial(self._landed, key))
+        else:
+            count('singleflight', 1, 'Coalesced calls by group and outcome', group=self.name, outcome='shared')
+        return await asyncio.shield(flight)
+
+    def _landed(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.cancelled():
+            # Mark it retrieved: every caller may have stopped waiting
+            flight.exception()
+
+    async def _lead(self, key, func, args, kwargs, recheck):
+        _leading.set(_leading.get() | {(id(self), key)})
+        path = self._stripe_path(key)
+        if path in _held_stripes.get():
+            path = None
+        fd, waited = await self._acquire_process_lock(path)
+        if fd is not None:
+            _held_stripes.set(_held_stripes.get() | {path})
+        try:
+            value = await recheck() if waited and recheck is not None else None
+            if value is None:
+                value = await func(*args, **kwargs)
+            return value
+        finally:
+            if fd is not None:
+                # Closing the descriptor releases the lock
+                os.close(fd)
+
+    async def _acquire_process_lock(self, path):
+        """(descriptor holding the lock file at `path`, whether another process had it), or (None, False)."""
+        if path is None:
+            return None, False
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if _try_flock(fd):
+            return fd, False
+        count('singleflight', 1, 'Coalesced calls by group and outcome', group=self.name, outcome='waited')
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, fcntl.flock, fd, fcntl.LOCK_EX)
+        except BaseException:
+            os.close(fd)
+            raise
+        return fd, True
+
+
+def _try_flock(fd):
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
@@ -0,0 +1,436 @@
+"""On-disk LRU cache of source documents for the highlighting path.
+
+Popular documents are highlighted over and over with different keywords;
+caching their bytes locally saves the download on every highlight. Entries
+are keyed by blob name and hold one version (ETag) each. An entry is used
+without a round trip for `revalidate_after` seconds after it was last
+checked; after that it is revalidated with a conditional download
+(If-None-Match), which costs a 304 and no body while the blob is
+unchanged. Cached files are handed out memory-mapped.
+
+Each file has a small JSON sidecar with its blob name and ETag, so the
+cache survives restarts. Data derived from one version of a document
+(such as a PDF's word index) can be stored next to it with
+write_sidecar(); it counts towards the cache size and is evicted with it.
+
+Byte accounting is per process: processes that share a directory may
+remove each other's files, which then count as misses. Downloads in
+progress are named after their process's pid, and a process starting up
+removes only those whose process is gone.
+"""
+import glob
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceModifiedError, ResourceNotModifiedError
+
+from metrics import count
+
+# Temporary files are named TEMP_PREFIX + '<pid>-...'
+TEMP_PREFIX = '.download-'
+
+CacheEntry = namedtuple('CacheEntry', ['etag', 'size', 'path', 'validated'])
+
+
+class CachedSource:
+    """A cached source document, memory-mapped read-only.
+
+    `target` is the mmap (what the PDF highlighter reads from) and `path`
+    the file behind it. A file that was too large to keep in the cache is
+    deleted on close().
+    """
+
+    in_memory = False
+
+    def __init__(self, path, delete=False):
+        self.path = path
+        self._delete = delete
+        with open(path, 'rb') as file:
+            self.size = os.fstat(file.fileno()).st_size
+            # The mapping keeps the file readable even if it is evicted meanwhile
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+
+    @property
+    def target(self):
+        return self._map if self._map is not None else b''
+
+    def close(self):
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # A reader still holds a view of it; the mapping goes with the last reference
+                pass
+            self._map = None
+        if self._delete:
+            _unlink(self.path)
+            self._delete = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class SourceCache:
+    """Bounded on-disk LRU cache of source blobs, validated by ETag."""
+
+    def __init__(self, directory, max_bytes, revalidate_after=60, max_concurrency=1):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.revalidate_after = revalidate_after
+        self.max_concurrency = max_concurrency
+        self._entries = OrderedDict()  # blob name -> CacheEntry
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def open(self, blob_client, etag):
+        """Return a CachedSource of the blob's version `etag`, downloading it if needed.
+
+        Raises ResourceModifiedError if the blob no longer has `etag`; a
+        newer version found while revalidating is cached for the retry.
+        """
+        blob_name = blob_client.blob_name
+        source = self._lookup(blob_name, etag)
+        if source is not None:
+            return source
+
+        if self._needs_revalidation(blob_name, etag):
+            try:
+                downloader = blob_client.download_blob(
+                    max_concurrency=self.max_concurrency,
+                    etag=etag, match_condition=MatchConditions.IfModified
+                )
+            except ResourceNotModifiedError:
+                source = self._revalidated(blob_name)
+                if source is not None:
+                    return source
+            else:
+                temp_path = self._download(downloader)
+                self._commit(blob_name, downloader.properties.etag, temp_path, 'stale').close()
+                raise ResourceModifiedError(f"Blob {blob_name} no longer has ETag {etag}")
+
+        downloader = blob_client.download_blob(
+            max_concurrency=self.max_concurrency,
+            etag=etag, match_condition=MatchConditions.IfNotModified
+        )
+        temp_path = self._download(downloader)
+        return self._commit(blob_name, etag, temp_path, 'miss')
+
+    def invalidate(self, blob_name):
+        with self._lock:
+            entry = self._entries.pop(blob_name, None)
+            if entry is not None:
+                self._bytes -= entry.size
+        if entry is not None:
+            _remove_entry_files(entry.path)
+
+    def clear(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+            self._bytes = 0
+        for entry in entries:
+            _remove_entry_files(entry.path)
+
+    def stats(self):
+        """Counters for monitoring: hits (with and without revalidation), misses, evictions and size."""
+        with self._lock:
+            lookups = self.hits + self.revalidations + self.misses + self.stale
+            return {
+                'hits': self.hits,
+                'revalidations': self.revalidations,
+                'misses': self.misses,
+                'stale': self.stale,
+                'hit_ratio': (self.hits + self.revalidations) / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+    def _lookup(self, blob_name, etag):
+        """A CachedSource for an entry of version `etag` checked recently enough, else None."""
+        with self._lock:
+            entry = self._entries.get(blob_name)
+            if entry is None or entry.etag != etag:
+                return None
+            if entry.validated is None or time.monotonic() - entry.validated >= self.revalidate_after:
+                return None
+            source = self._map_entry(blob_name, entry)
+            if source is not None:
+                self.hits += 1
+        if source is not None:
+            count('source_cache', 1, 'Source document cache lookups by outcome', outcome='hit')
+        return source
+
+    def _needs_revalidation(self, blob_name, etag):
+        with self._lock:
+            entry = self._entries.get(blob_name)
+            return entry is not None and entry.etag == etag
+
+    def _revalidated(self, blob_name):
+        """Mark an entry as checked now; returns its CachedSource, or None if it was removed meanwhile."""
+        with self._lock:
+            entry = self._entries.get(blob_name)
+            if entry is None:
+                return None
+            entry = self._entries[blob_name] = entry._replace(validated=time.monotonic())
+            source = self._map_entry(blob_name, entry)
+            if source is not None:
+                self.revalidations += 1
+        if source is not None:
+            count('source_cache', 1, 'Source document cache lookups by outcome', outcome='revalidated')
+        return source
+
+    def _map_entry(self, blob_name, entry):
+        # Called with the lock held, so the file cannot be evicted between lookup and mapping
+        try:
+            source = CachedSource(entry.path)
+        except FileNotFoundError:
+            # Removed by another process sharing the directory
+            del self._entries[blob_name]
+            self._bytes -= entry.size
+            return None
+        self._entries.move_to_end(blob_name)
+        return source
+
+    def _download(self, downloader):
+        """Write a download to a temporary file in the cache directory; returns its path."""
+        fd, temp_path = _mkstemp(self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                downloader.readinto(file)
+        except BaseException:
+            _unlink(temp_path)
+            raise
+        return temp_path
+
+    def _commit(self, blob_name, etag, temp_path, outcome):
+        """Move a downloaded file into the cache under (blob name, ETag); returns its CachedSource."""
+        size = os.path.getsize(temp_path)
+        count('blob_bytes_downloaded', size, 'Bytes downloaded from Blob Storage')
+        count('source_cache', 1, 'Source document cache lookups by outcome', outcome=outcome)
+
+        with self._lock:
+            if outcome == 'stale':
+                self.stale += 1
+            else:
+                self.misses += 1
+        if size > self.max_bytes:
+            # Too large to cache; the caller still gets it, and it is deleted after use
+            return CachedSource(temp_path, delete=True)
+
+        path = self._path_for(blob_name, etag)
+        os.replace(temp_path, path)
+        with open(f"{path}.json", 'w') as sidecar:
+            json.dump({'blob': blob_name, 'etag': etag}, sidecar)
+
+        evicted = []
+        with self._lock:
+            previous = self._entries.pop(blob_name, None)
+            if previous is not None:
+                self._bytes -= previous.size
+                if previous.path != path:
+                    evicted.append(previous.path)
+            # Sidecars of the same version, written before a re-download, stay valid
+            size += _sidecar_size(path)
+            self._entries[blob_name] = CacheEntry(etag=etag, size=size, path=path, validated=time.monotonic())
+            self._bytes += size
+            evicted.extend(self._evict())
+            source = CachedSource(path)
+        for old_path in evicted:
+            _remove_entry_files(old_path)
+        return source
+
+    def read_sidecar(self, blob_name, etag, suffix):
+        """Data stored with write_sidecar() for the cached version `etag` of a blob, or None."""
+        with self._lock:
+            entry = self._entries.get(blob_name)
+            if entry is None or entry.etag != etag:
+                return None
+            try:
+                with open(entry.path + suffix, 'rb') as file:
+                    return file.read()
+            except FileNotFoundError:
+                return None
+
+    def write_sidecar(self, blob_name, etag, suffix, data):
+        """Store data derived from the cached version `etag` of a blob; dropped if it is no longer cached."""
+        fd, temp_path = _mkstemp(self.directory)
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+
+        evicted = []
+        with self._lock:
+            entry = self._entries.get(blob_name)
+            if entry is None or entry.etag != etag:
+                _unlink(temp_path)
+                return False
+            path = entry.path + suffix
+            replaced = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(temp_path, path)
+            self._entries[blob_name] = entry._replace(size=entry.size - replaced + len(data))
+            self._bytes += len(data) - replaced
+            evicted.extend(self._evict())
+        for old_path in evicted:
+            _remove_entry_files(old_path)
+        return True
+
+    def _evict(self):
+        """Drop least recently used entries until within max_bytes; returns their paths. Lock held."""
+        evicted = []
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, oldest = self._entries.popitem(last=False)
+            self._bytes -= oldest.size
+            self.evictions += 1
+            evicted.append(oldest.path)
+        return evicted
+
+    def _path_for(self, blob_name, etag):
+        name_digest = hashlib.sha256(blob_name.encode('utf-8')).hexdigest()[:32]
+        etag_digest = hashlib.sha256(etag.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.directory, f"{name_digest}-{etag_digest}{os.path.splitext(blob_name)[1]}")
+
+    def _load(self):
+        """Rebuild the index from the sidecars of a previous run, oldest first; entries start unvalidated."""
+        found = []
+        for filename in os.listdir(self.directory):
+            path = os.path.join(self.directory, filename)
+            if filename.startswith(TEMP_PREFIX):
+                # Left over from an interrupted download; other live processes' are in use
+                if not _process_alive(_temp_owner(filename)):
+                    _unlink(path)
+                continue
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(path) as sidecar:
+                    meta = json.load(sidecar)
+                data_path = path[:-len('.json')]
+                stat = os.stat(data_path)
+            except (OSError, ValueError):
+                _unlink(path)
+                continue
+            found.append((stat.st_mtime, meta['blob'], meta['etag'], stat.st_size + _sidecar_size(data_path), data_path))
+
+        for _, blob_name, etag, size, data_path in sorted(found):
+            previous = self._entries.pop(blob_name, None)
+            if previous is not None:
+                self._bytes -= previous.size
+                _remove_entry_files(previous.path)
+            self._entries[blob_name] = CacheEntry(etag=etag, size=size, path=data_path, validated=None)
+            self._bytes += size
+        while self._bytes > self.max_bytes and self._entries:
+            _, oldest = self._entries.popitem(last=False)
+            self._bytes -= oldest.size
+            _remove_entry_files(oldest.path)
+
+
+class AsyncSourceCache:
+    """open() over azure.storage.blob.aio blob clients, sharing a SourceCache's files and index."""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    async def open(self, blob_client, etag):
+        """Return a CachedSource of the blob's version `etag`, downloading it if needed."""
+        cache = self.cache
+        blob_name = blob_client.blob_name
+        source = cache._lookup(blob_name, etag)
+        if source is not None:
+            return source
+
+        if cache._needs_revalidation(blob_name, etag):
+            try:
+                downloader = await blob_client.download_blob(
+                    max_concurrency=cache.max_concurrency,
+                    etag=etag, match_condition=MatchConditions.IfModified
+                )
+            except ResourceNotModifiedError:
+                source = cache._revalidated(blob_name)
+                if source is not None:
+                    return source
+            else:
+                temp_path = await self._download(downloader)
+                cache._commit(blob_name, downloader.properties.etag, temp_path, 'stale').close()
+                raise ResourceModifiedError(f"Blob {blob_name} no longer has ETag {etag}")
+
+        downloader = await blob_client.download_blob(
+            max_concurrency=cache.max_concurrency,
+            etag=etag, match_condition=MatchConditions.IfNotModified
+        )
+        temp_path = await self._download(downloader)
+        return cache._commit(blob_name, etag, temp_path, 'miss')
+
+    def stats(self):
+        return self.cache.stats()
+
+    async def _download(self, downloader):
+        fd, temp_path = _mkstemp(self.cache.directory)
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                await downloader.readinto(file)
+        except BaseException:
+            _unlink(temp_path)
+            raise
+        return temp_path
+
+
+def _sidecar_size(path):
+    """Bytes of the derived-data sidecars of a cached file (not its JSON metadata)."""
+    return sum(
+        os.path.getsize(sidecar) for sidecar in glob.glob(glob.escape(path) + '.*')
+        if not sidecar.endswith('.json')
+    )
+
+
+def _remove_entry_files(path):
+    _unlink(path)
+    for sidecar in glob.glob(glob.escape(path) + '.*'):
+        _unlink(sidecar)
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _mkstemp(directory):
+    return tempfile.mkstemp(prefix=f"{TEMP_PREFIX}{os.getpid()}-", dir=directory)
+
+
+def _temp_owner(filename):
+    """Pid in a temporary file name, or None for one from an older version without it."""
+    pid = filename[len(TEMP_PREFIX):].split('-', 1)[0]
+    return int(pid) if pid.isdigit() else None
+
+
+def _process_alive(pid):
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Someone else's process
+        pass
+    return True
@@ -0,0 +1,103 @@
+import pytest
+
+import cache
+from cache import TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, 'monotonic', clock)
+    return clock
+
+
+def test_entries_expire_after_ttl(clock):
+    entries = TTLCache(ttl=10)
+    entries.put('key', 'value')
+    clock.now += 9.9
+    assert entries.get('key') == 'value'
+    clock.now += 0.1
+    assert entries.get('key') is None
+    assert entries.stats()['expirations'] == 1
+    assert len(entries) == 0
+
+
+def test_per_entry_ttl_overrides_default(clock):
+    entries = TTLCache(ttl=10)
+    entries.put('short', 1, ttl=2)
+    entries.put('long', 2)
+    clock.now += 5
+    assert 'short' not in entries
+    assert 'long' in entries
+
+
+def test_no_ttl_never_expires(clock):
+    entries = TTLCache()
+    entries.put('key', 'value')
+    clock.now += 10 ** 9
+    assert entries.get('key') == 'value'
+
+
+def test_contains_does_not_count_or_touch(clock):
+    entries = TTLCache(max_entries=2)
+    entries.put('a', 1)
+    entries.put('b', 2)
+    assert 'a' in entries
+    entries.put('c', 3)
+    # 'a' is still least recently used, so it went first
+    assert 'a' not in entries
+    assert entries.stats()['hits'] == 0
+
+
+def test_least_recently_used_evicted_by_count():
+    entries = TTLCache(max_entries=2)
+    entries.put('a', 1)
+    entries.put('b', 2)
+    entries.get('a')
+    entries.put('c', 3)
+    assert entries.get('b') is None
+    assert entries.get('a') == 1 and entries.get('c') == 3
+    assert entries.stats()['evictions'] == 1
+
+
+def test_byte_bound_evicts_until_within():
+    entries = TTLCache(max_bytes=100)
+    entries.put('a', 'x', size=40)
+    entries.put('b', 'y', size=40)
+    entries.put('c', 'z', size=50)
+    assert 'a' not in entries
+    assert entries.stats()['bytes'] == 90
+
+
+def test_oversized_entry_is_not_kept():
+    entries = TTLCache(max_bytes=100)
+    entries.put('a', 'x', size=10)
+    entries.put('huge', 'y', size=101)
+    assert len(entries) == 0
+    assert entries.stats()['bytes'] == 0
+
+
+def test_replacing_and_popping_keep_byte_count():
+    entries = TTLCache(max_bytes=100)
+    entries.put('a', 'x', size=60)
+    entries.put('a', 'y', size=30)
+    assert entries.stats()['bytes'] == 30
+    assert entries.pop('a') == 'y'
+    assert entries.stats()['bytes'] == 0
+    assert entries.pop('a', 'gone') == 'gone'
+
+
+def test_expired_entry_frees_its_bytes(clock):
+    entries = TTLCache(ttl=1, max_bytes=100)
+    entries.put('a', 'x', size=80)
+    clock.now += 2
+    assert entries.get('a') is None
+    assert entries.stats()['bytes'] == 0
@@ -0,0 +1,114 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from azure.core import MatchConditions
+
+import cleanup_scheduler
+
+
+class BlobItem:
+    def __init__(self, name, age_minutes, etag):
+        self.name = name
+        self.creation_time = datetime.now(timezone.utc) - timedelta(minutes=age_minutes)
+        self.etag = etag
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class StubContainer:
+    """Container client that lists by prefix and answers batch deletes like the service."""
+
+    def __init__(self, blobs):
+        self.blobs = {blob.name: blob for blob in blobs}
+        self.prefixes = []
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def list_blobs(self, name_starts_with=None):
+        self.prefixes.append(name_starts_with)
+        return [blob for name, blob in sorted(self.blobs.items()) if name.startswith(name_starts_with or '')]
+
+    def delete_blobs(self, *batch, raise_on_any_failure=True):
+        with self.lock:
+            self.batches.append(batch)
+            responses = []
+            for entry in batch:
+                blob = self.blobs.get(entry['name'])
+                if blob is None:
+                    responses.append(Response(404))
+                elif entry['match_condition'] == MatchConditions.IfNotModified and entry['etag'] != blob.etag:
+                    responses.append(Response(412))
+                else:
+                    del self.blobs[entry['name']]
+                    responses.append(Response(202))
+            return responses
+
+
+@pytest.fixture
+def container(monkeypatch):
+    def install(blobs, batch_size=3):
+        stub = StubContainer(blobs)
+        monkeypatch.setattr(cleanup_scheduler, 'container_client', stub)
+        monkeypatch.setattr(cleanup_scheduler, 'CLEANUP_DELETE_BATCH_SIZE', batch_size)
+        monkeypatch.setattr(cleanup_scheduler, 'HIGHLIGHTED_MAX_AGE_MINUTES', 15)
+        return stub
+    return install
+
+
+def test_lists_only_the_highlighted_prefix(container):
+    stub = container([
+        BlobItem('highlighted_old.pdf', 60, '"1"'),
+        BlobItem('report.pdf', 60, '"1"'),
+    ])
+    report = cleanup_scheduler.cleanup_highlighted_files()
+
+    assert stub.prefixes == ['highlighted_']
+    assert report['swept'] == 1 and report['deleted'] == 1
+    assert list(stub.blobs) == ['report.pdf']
+
+
+def test_expired_blobs_are_deleted_in_batches_of_at_most_the_limit(container):
+    stub = container([BlobItem(f"highlighted_{i}.pdf", 60, '"1"') for i in range(7)]
+                     + [BlobItem('highlighted_new.pdf', 1, '"1"')])
+    report = cleanup_scheduler.cleanup_highlighted_files()
+
+    assert sorted(len(batch) for batch in stub.batches) == [1, 3, 3]
+    assert report == dict(report, swept=8, expired=7, deleted=7, skipped=0, failed=0)
+    assert list(stub.blobs) == ['highlighted_new.pdf']
+
+
+def test_deletes_are_conditional_on_the_listed_etag(container):
+    stub = container([BlobItem('highlighted_a.pdf', 60, '"1"'), BlobItem('highlighted_b.pdf', 60, '"1"')])
+    listed = stub.list_blobs
+
+    def list_then_reupload(name_starts_with=None):
+        blobs = [BlobItem(blob.name, 60, blob.etag) for blob in listed(name_starts_with)]
+        # The app re-uploads one copy between the listing and the delete
+        stub.blobs['highlighted_a.pdf'].etag = '"2"'
+        return blobs
+
+    stub.list_blobs = list_then_reupload
+    report = cleanup_scheduler.cleanup_highlighted_files()
+
+    assert all(entry['match_condition'] == MatchConditions.IfNotModified and entry['etag'] == '"1"'
+               for batch in stub.batches for entry in batch)
+    assert (report['deleted'], report['skipped']) == (1, 1)
+    assert list(stub.blobs) == ['highlighted_a.pdf']
+
+
+def test_failed_batch_is_counted_and_others_still_run(container):
+    stub = container([BlobItem(f"highlighted_{i}.pdf", 60, '"1"') for i in range(4)])
+    delete_blobs = stub.delete_blobs
+
+    def fail_first(*batch, **kwargs):
+        if batch[0]['name'] == 'highlighted_0.pdf':
+            raise ConnectionError('reset')
+        return delete_blobs(*batch, **kwargs)
+
+    stub.delete_blobs = fail_first
+    report = cleanup_scheduler.cleanup_highlighted_files()
+    assert (report['deleted'], report['failed']) == (1, 3)
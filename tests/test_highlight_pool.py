@@ -0,0 +1,121 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from highlight_pool import HighlightPool, JobCpuLimitExceeded, JobTimeoutError, PoolSaturatedError
+
+# Jobs run in forkserver workers, which import them from this module by name
+
+
+def echo(value, delay=0):
+    time.sleep(delay)
+    return value, os.getpid()
+
+
+def fail():
+    raise ValueError('boom')
+
+
+def crash():
+    os._exit(1)
+
+
+def spin():
+    while True:
+        pass
+
+
+@pytest.fixture
+def make_pool():
+    pools = []
+
+    def make(workers, max_queue=4, **kwargs):
+        pool = HighlightPool(workers, max_queue, mp_context=multiprocessing.get_context('forkserver'), **kwargs)
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.shutdown()
+
+
+def in_thread(pool, *args, **kwargs):
+    outcome = {}
+
+    def run():
+        try:
+            outcome['result'] = pool.run(*args, **kwargs)
+        except Exception as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, outcome
+
+
+def test_stuck_job_times_out_without_failing_its_neighbour(make_pool):
+    pool = make_pool(2, timeout=1)
+    # Warm both workers so the timeout doesn't include process start-up
+    first = in_thread(pool, echo, 'a', delay=0.3)
+    assert pool.run(echo, 'b', delay=0.3)[0] == 'b'
+    first[0].join()
+
+    stuck_thread, stuck = in_thread(pool, echo, 'stuck', delay=30)
+    time.sleep(0.1)
+    value, pid = pool.run(echo, 'fine', delay=0.5)
+    stuck_thread.join()
+
+    assert value == 'fine'
+    assert isinstance(stuck['error'], JobTimeoutError)
+    # The killed worker's slot goes to a new process; the other kept its own
+    assert pool.run(echo, 'after')[0] == 'after'
+    assert pool.stats()['running'] == 0
+
+
+def test_timeout_does_not_count_queue_wait(make_pool):
+    pool = make_pool(1, timeout=1)
+    pool.run(echo, 'warm')
+    thread, outcome = in_thread(pool, echo, 'long', delay=0.8)
+    time.sleep(0.1)
+    # Waits about 0.7s for the worker, then runs well inside its own second
+    assert pool.run(echo, 'queued', delay=0.5)[0] == 'queued'
+    thread.join()
+    assert outcome['result'][0] == 'long'
+
+
+def test_full_queue_rejects(make_pool):
+    pool = make_pool(1, max_queue=0)
+    thread, outcome = in_thread(pool, echo, 'slow', delay=0.5)
+    time.sleep(0.2)
+    with pytest.raises(PoolSaturatedError):
+        pool.run(echo, 'rejected')
+    thread.join()
+    assert pool.stats()['rejected'] == 1
+
+
+def test_job_exception_is_raised_and_worker_kept(make_pool):
+    pool = make_pool(1)
+    _, pid = pool.run(echo, 'first')
+    with pytest.raises(ValueError):
+        pool.run(fail)
+    assert pool.run(echo, 'second')[1] == pid
+
+
+def test_dead_worker_fails_its_job_and_is_replaced(make_pool):
+    pool = make_pool(1)
+    _, pid = pool.run(echo, 'first')
+    with pytest.raises(BrokenProcessPool):
+        pool.run(crash)
+    value, new_pid = pool.run(echo, 'second')
+    assert value == 'second' and new_pid != pid
+
+
+def test_cpu_limit_stops_a_job(make_pool):
+    pool = make_pool(1, cpu_seconds=1)
+    with pytest.raises(JobCpuLimitExceeded):
+        pool.run(spin)
+    assert pool.run(echo, 'after')[0] == 'after'
@@ -0,0 +1,120 @@
+import io
+import re
+
+import fitz
+from docx import Document
+from docx.enum.text import WD_BREAK
+from docx.shared import Pt
+
+from highlighter import DOCX_HIGHLIGHT_COLORS, HTML_HIGHLIGHT_COLORS, highlight_docx, highlight_keywords
+
+YELLOW = DOCX_HIGHLIGHT_COLORS[0]
+
+
+def mark(text, index):
+    return f'<mark style="{HTML_HIGHLIGHT_COLORS[index]}">{text}</mark>'
+
+
+def strip_marks(html):
+    return re.sub(r'</?mark[^>]*>', '', html)
+
+
+def test_highlight_keywords_matches_case_insensitively_in_query_colors():
+    html = highlight_keywords('Contract terms: the CONTRACT ends', 'contract terms')
+    assert html == f"{mark('Contract', 0)} {mark('terms', 1)}: the {mark('CONTRACT', 0)} ends"
+
+
+def test_highlight_keywords_prefers_the_longer_overlapping_keyword():
+    html = highlight_keywords('cat category', 'cat category')
+    assert html == f"{mark('cat', 0)} {mark('category', 1)}"
+
+
+def test_highlight_keywords_never_matches_inside_its_own_markup():
+    # 'mark', 'style' and 'background' all occur in the inserted tags
+    text = 'mark the style'
+    html = highlight_keywords(text, 'mark style background color')
+    assert html == f"{mark('mark', 0)} the {mark('style', 1)}"
+    assert strip_marks(html) == text
+
+
+def test_highlight_keywords_without_text_or_matches():
+    assert highlight_keywords('', 'anything') == ''
+    assert highlight_keywords('nothing here', 'absent') == 'nothing here'
+    assert highlight_keywords('nothing here', '') == 'nothing here'
+
+
+def docx_bytes(build):
+    doc = Document()
+    build(doc)
+    stream = io.BytesIO()
+    doc.save(stream)
+    return stream.getvalue()
+
+
+def highlighted(build, keywords):
+    return Document(io.BytesIO(highlight_docx(docx_bytes(build), keywords)))
+
+
+def runs(paragraph):
+    return [(run.text, run.font.highlight_color) for run in paragraph.runs]
+
+
+def test_docx_match_across_runs_highlights_both_parts():
+    def build(doc):
+        paragraph = doc.add_paragraph('the con')
+        paragraph.add_run('tract').bold = True
+        paragraph.add_run(' ends')
+
+    paragraph = highlighted(build, 'contract').paragraphs[0]
+    assert runs(paragraph) == [('the ', None), ('con', YELLOW), ('tract', YELLOW), (' ends', None)]
+    assert [run.bold for run in paragraph.runs] == [None, None, True, None]
+
+
+def test_docx_split_run_keeps_formatting():
+    def build(doc):
+        run = doc.add_paragraph().add_run('the contract ends\there')
+        run.italic = True
+        run.font.size = Pt(14)
+
+    paragraph = highlighted(build, 'contract').paragraphs[0]
+    assert runs(paragraph) == [('the ', None), ('contract', YELLOW), (' ends\there', None)]
+    assert all(run.italic and run.font.size == Pt(14) for run in paragraph.runs)
+
+
+def test_docx_table_cells_are_highlighted():
+    def build(doc):
+        table = doc.add_table(rows=1, cols=2)
+        table.cell(0, 0).text = 'contract terms'
+        table.cell(0, 1).text = 'nothing'
+
+    cells = highlighted(build, 'terms').tables[0].rows[0].cells
+    assert runs(cells[0].paragraphs[0]) == [('contract ', None), ('terms', YELLOW)]
+    assert runs(cells[1].paragraphs[0]) == [('nothing', None)]
+
+
+def test_docx_runs_with_other_content_are_left_whole(tmp_path):
+    image = tmp_path / 'pixel.png'
+    image.write_bytes(fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 2, 2)).tobytes('png'))
+
+    def build(doc):
+        paragraph = doc.add_paragraph('contract ')
+        run = paragraph.add_run('contract with picture ')
+        run.add_picture(str(image))
+        run = paragraph.add_run('contract before break')
+        run.add_break(WD_BREAK.PAGE)
+
+    paragraph = highlighted(build, 'contract').paragraphs[0]
+    assert runs(paragraph)[:2] == [('contract', YELLOW), (' ', None)]
+    assert [text for text, _ in runs(paragraph)[2:]] == ['contract with picture ', 'contract before break']
+    xml = paragraph._p.xml
+    assert xml.count('<w:drawing>') == 1
+    assert xml.count('w:type="page"') == 1
+
+
+def test_highlight_keywords_escapes_document_text():
+    html = highlight_keywords('<script>alert("contract")</script> & amp', 'contract amp script')
+    assert '<script>' not in html
+    assert html == (
+        f'&lt;{mark("script", 2)}&gt;alert(&quot;{mark("contract", 0)}&quot;)&lt;/{mark("script", 2)}&gt;'
+        f' &amp; {mark("amp", 1)}'
+    )
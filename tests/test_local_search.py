@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+from local_search import LocalSearchBackend, parse_filter, parse_query
+
+
+def test_parse_query_phrases_and_terms():
+    assert parse_query('"Contract Terms" payment') == [['contract', 'terms'], ['payment']]
+    assert parse_query(r'"say \"hi\"" a\-b') == [['say', 'hi'], ['a', 'b']]
+    assert parse_query('"" ---') == []
+
+
+@pytest.mark.parametrize('query', [None, '', '  ', '*'])
+def test_parse_query_match_all(query):
+    assert parse_query(query) is None
+
+
+def test_parse_filter_clauses():
+    assert parse_filter("authorized_users eq 'alice'") == [('authorized_users', 'alice')]
+    assert parse_filter("authorized_users eq 'o''brien' and metadata_storage_name eq 'a b.pdf'") == [
+        ('authorized_users', "o'brien"), ('metadata_storage_name', 'a b.pdf')
+    ]
+    assert parse_filter(None) == []
+
+
+@pytest.mark.parametrize('expression', ["size gt 10", "authorized_users eq 'alice' or x eq 'y'", "name eq alice"])
+def test_parse_filter_rejects_unsupported(expression):
+    with pytest.raises(ValueError):
+        parse_filter(expression)
+
+
+@pytest.fixture
+def backend(tmp_path):
+    root = tmp_path / 'docs'
+    (root / 'private').mkdir(parents=True)
+    files = {
+        'often.txt': 'contract contract contract and some other words here',
+        'once.txt': 'contract and some other words here as well',
+        'short.txt': 'contract',
+        'phrase.txt': 'the terms of the contract',
+        'private/secret.txt': 'contract contract contract contract',
+    }
+    for name, text in files.items():
+        (root / name).write_text(text)
+    (root / 'acl.json').write_text(json.dumps({'private/*': ['alice'], '*': ['alice', 'bob']}))
+    return LocalSearchBackend(str(root), index_path=str(tmp_path / 'index.pickle'), workers=1)
+
+
+def names(backend, query, user, **payload):
+    hits = backend.search({'search': query, 'filter': f"authorized_users eq '{user}'", **payload})['value']
+    return [hit['metadata_storage_name'] for hit in hits]
+
+
+def test_bm25_ranks_by_frequency_and_length(backend):
+    # More occurrences first, and among single occurrences the shorter document
+    assert names(backend, 'contract', 'bob') == ['often.txt', 'short.txt', 'phrase.txt', 'once.txt']
+
+
+def test_acl_filter_excludes_other_users_documents(backend):
+    assert 'private/secret.txt' not in names(backend, 'contract', 'bob')
+    assert names(backend, 'contract', 'alice')[0] == 'private/secret.txt'
+    assert names(backend, 'contract', 'mallory') == []
+
+
+def test_phrase_and_search_mode(backend):
+    assert names(backend, '"terms of the contract"', 'bob') == ['phrase.txt']
+    assert names(backend, '"contract terms"', 'bob') == []
+    assert names(backend, 'terms often', 'bob', searchMode='all') == []
+    assert sorted(names(backend, 'terms often', 'bob', searchMode='any')) == ['often.txt', 'phrase.txt']
+
+
+def test_top_skip_and_reload(backend, tmp_path):
+    assert names(backend, 'contract', 'bob', top=2, skip=1) == ['short.txt', 'phrase.txt']
+    reloaded = LocalSearchBackend(backend.root, index_path=str(tmp_path / 'index.pickle'), workers=1)
+    assert reloaded.index.documents == backend.index.documents
@@ -0,0 +1,93 @@
+import multiprocessing
+import os
+
+import metrics
+from metrics import Registry, collect, retire_process
+
+
+def worker(directory, requests, running, exit_cleanly):
+    metrics.registry = Registry()
+    metrics.enable_multiprocess(directory, flush_interval=60)
+    for _ in range(requests):
+        metrics.observe_request('search', 200, 0.02)
+    metrics.gauge('highlight_jobs_running', running)
+    if exit_cleanly:
+        metrics.disable_multiprocess()
+    else:
+        # Killed: only what it flushed before is left
+        metrics.flush()
+        os._exit(1)
+
+
+def run_worker(directory, requests, running, exit_cleanly=True):
+    process = multiprocessing.get_context('fork').Process(
+        target=worker, args=(directory, requests, running, exit_cleanly)
+    )
+    process.start()
+    process.join()
+    return process.pid
+
+
+def values(registry):
+    lines = registry.render().splitlines()
+    return {
+        line.split(' ')[0]: float(line.split(' ')[1])
+        for line in lines
+        if line.startswith(('docsearch_requests_total', 'docsearch_request_seconds_count', 'docsearch_highlight'))
+    }
+
+
+def test_render_sums_every_process(tmp_path):
+    directory = str(tmp_path)
+    run_worker(directory, 2, 1)
+    run_worker(directory, 3, 2)
+
+    assert values(collect(directory)) == {
+        'docsearch_requests_total{endpoint="search",status="200"}': 5,
+        'docsearch_request_seconds_count{endpoint="search"}': 5,
+        'docsearch_highlight_jobs_running': 3,
+    }
+
+
+def test_retired_process_keeps_its_counters_but_not_its_gauges(tmp_path):
+    directory = str(tmp_path)
+    first = run_worker(directory, 2, 1)
+    second = run_worker(directory, 3, 2, exit_cleanly=False)
+    retire_process(directory, first)
+    retire_process(directory, second)
+    retire_process(directory, second)
+
+    assert sorted(os.listdir(directory)) == ['.lock', 'archive.json']
+    assert values(collect(directory)) == {
+        'docsearch_requests_total{endpoint="search",status="200"}': 5,
+        'docsearch_request_seconds_count{endpoint="search"}': 5,
+    }
+    # A new worker's counts add to the archive's
+    run_worker(directory, 1, 4)
+    assert values(collect(directory))['docsearch_requests_total{endpoint="search",status="200"}'] == 6
+
+
+def test_render_includes_this_process(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'registry', Registry())
+    run_worker(str(tmp_path), 2, 0)
+    metrics.enable_multiprocess(str(tmp_path), flush_interval=60)
+    try:
+        metrics.observe_request('search', 200, 0.02)
+        assert 'docsearch_requests_total{endpoint="search",status="200"} 3' in metrics.render_prometheus()
+    finally:
+        metrics.disable_multiprocess()
+
+
+def test_merge_sums_histograms_bucket_by_bucket():
+    first, second = Registry(), Registry()
+    first.observe('job_seconds', 0.002)
+    second.observe('job_seconds', 0.2)
+    second.observe('job_seconds', 0.2)
+
+    merged = Registry()
+    merged.merge(first.snapshot())
+    merged.merge(second.snapshot())
+    rendered = merged.render()
+    assert 'docsearch_job_seconds_bucket{le="0.005"} 1' in rendered
+    assert 'docsearch_job_seconds_bucket{le="0.25"} 3' in rendered
+    assert 'docsearch_job_seconds_sum 0.402000' in rendered
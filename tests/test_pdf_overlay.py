@@ -0,0 +1,39 @@
+import fitz
+import pytest
+
+from highlighter import find_pdf_overlay
+
+
+def make_pdf(media_box=(0, 0, 612, 792), crop_box=None, rotate=0):
+    """One page with 'hello' set at PDF user space (100, 700), in the given boxes."""
+    doc = fitz.open()
+    page = doc.new_page()
+    doc.xref_set_key(page.xref, "MediaBox", "[%g %g %g %g]" % media_box)
+    contents = doc.get_new_xref()
+    doc.update_object(contents, "<<>>")
+    doc.update_stream(contents, b"BT /Helv 12 Tf 100 700 Td (hello) Tj ET")
+    doc.xref_set_key(page.xref, "Contents", f"{contents} 0 R")
+    doc.xref_set_key(page.xref, "Resources", "<</Font <</Helv <</Type/Font/Subtype/Type1/BaseFont/Helvetica>> >> >>")
+    if crop_box:
+        doc.xref_set_key(page.xref, "CropBox", "[%g %g %g %g]" % crop_box)
+    if rotate:
+        doc.xref_set_key(page.xref, "Rotate", str(rotate))
+    return doc.tobytes()
+
+
+@pytest.mark.parametrize('rotate', [0, 90, 180, 270])
+@pytest.mark.parametrize('crop_box', [None, (50, 50, 562, 742), (80, 90, 500, 760)])
+@pytest.mark.parametrize('media_box', [(0, 0, 612, 792), (-30, -40, 600, 780)])
+def test_quads_are_in_pdf_user_space(media_box, crop_box, rotate):
+    overlay = find_pdf_overlay(make_pdf(media_box, crop_box, rotate), 'hello')
+
+    assert [(hit['page'], hit['keyword']) for hit in overlay] == [(1, 0)]
+    [quad] = overlay[0]['quads']
+    xs, ys = quad[0::2], quad[1::2]
+    # The word starts at x=100 and sits on or just below the 700 baseline
+    assert min(xs) == pytest.approx(100, abs=0.5)
+    assert 690 < min(ys) <= 700 < max(ys) < 715
+
+
+def test_no_hits():
+    assert find_pdf_overlay(make_pdf(), 'absent') == []
@@ -0,0 +1,80 @@
+import zlib
+
+import fitz
+import pytest
+
+from highlighter import find_pdf_hits, normalize_keywords
+from pdf_word_index import PdfWordIndex, build_pdf_word_index
+
+PAGES = [
+    "Service contract between the parties",
+    "No matches on this page",
+    "Contract terms: the contract ends in 2030",
+    "Subcontractors and contracts",
+]
+
+
+@pytest.fixture(scope='module')
+def pdf():
+    doc = fitz.open()
+    for text in PAGES:
+        doc.new_page().insert_text((72, 100), text, fontsize=12)
+    return doc.tobytes()
+
+
+def rect(quad):
+    xs, ys = quad[0::2], quad[1::2]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def test_dumps_loads_round_trip(pdf):
+    index = build_pdf_word_index(pdf)
+    loaded = PdfWordIndex.loads(index.dumps())
+
+    assert loaded.page_count == len(PAGES)
+    assert loaded.vocabulary == index.vocabulary
+    for name in ('term_starts', 'occurrences', 'page_starts', 'boxes'):
+        assert list(getattr(loaded, name)) == list(getattr(index, name))
+    keywords = normalize_keywords('contract terms')
+    assert loaded.find(keywords) == index.find(keywords)
+
+
+def test_empty_index_round_trip():
+    loaded = PdfWordIndex.loads(PdfWordIndex.from_pages([[]]).dumps())
+    assert loaded.page_count == 1
+    assert loaded.find(('anything',)) == []
+
+
+def test_loads_rejects_other_data():
+    with pytest.raises(ValueError):
+        PdfWordIndex.loads(zlib.compress(b'NOPE' + bytes(64)))
+
+
+@pytest.mark.parametrize('query', ['contract', 'terms service', 'parties 2030', 'absent'])
+def test_find_matches_search_for(pdf, query):
+    keywords = normalize_keywords(query)
+    index = build_pdf_word_index(pdf)
+    doc = fitz.open(stream=pdf, filetype='pdf')
+    expected = find_pdf_hits(doc, keywords, range(len(doc)))
+
+    found = index.find(keywords)
+    assert [(page, keyword, len(quads)) for page, keyword, quads in found] == \
+        [(page, keyword, len(quads)) for page, keyword, quads in sorted(expected)]
+    for (_, _, quads), (_, _, expected_quads) in zip(found, sorted(expected)):
+        for quad, expected_quad in zip(sorted(map(rect, quads)), sorted(map(rect, expected_quads))):
+            assert quad[1] == pytest.approx(expected_quad[1], abs=1)
+            assert quad[3] == pytest.approx(expected_quad[3], abs=1)
+            # A match inside a longer word gets its share of the box by character
+            # count, which is only approximate in a proportional font
+            assert quad[0] == pytest.approx(expected_quad[0], abs=8)
+            assert quad[2] == pytest.approx(expected_quad[2], abs=8)
+
+
+def test_whole_word_boxes_match_search_for(pdf):
+    keywords = normalize_keywords('service parties')
+    doc = fitz.open(stream=pdf, filetype='pdf')
+    expected = find_pdf_hits(doc, keywords, range(len(doc)))
+    found = build_pdf_word_index(pdf).find(keywords)
+    assert len(found) == len(expected) == 2
+    for (_, _, [quad]), (_, _, [expected_quad]) in zip(found, sorted(expected)):
+        assert rect(quad) == pytest.approx(rect(expected_quad), abs=1)
@@ -0,0 +1,66 @@
+import pytest
+
+import app as search_app
+from result_cache import ResultCache, SqliteResultStore
+
+
+@pytest.fixture
+def searches(monkeypatch):
+    """Fake search service answering with the user and page each search was made for."""
+    calls = []
+
+    def search(payload):
+        calls.append(payload)
+        user = payload['filter'].split("'")[1]
+        return {'value': [{'id': f"{user} skip {payload['skip']}"}]}
+
+    monkeypatch.setattr(search_app.search_client, 'search', search)
+    monkeypatch.setattr(search_app, 'result_cache', ResultCache(ttl=60))
+    return calls
+
+
+def search_as(username, query='contract', **form):
+    client = search_app.app.test_client()
+    with client.session_transaction() as session:
+        session['username'] = username
+    response = client.post('/search', data={'query': query, **form})
+    assert response.status_code == 200
+    return response.headers['X-Cache'], [result['id'] for result in response.get_json()['results']]
+
+
+def test_cache_key_includes_user_and_page():
+    _, alice = search_app.build_search({}, 'contract', 'alice')
+    _, bob = search_app.build_search({}, 'contract', 'bob')
+    _, alice_page_2 = search_app.build_search({'skip': '10'}, 'contract', 'alice')
+    _, alice_top_5 = search_app.build_search({'top': '5'}, 'contract', 'alice')
+    _, alice_again = search_app.build_search({}, '  Contract ', 'alice')
+
+    assert len({str(key) for key in (alice, bob, alice_page_2, alice_top_5)}) == 4
+    assert alice_again == alice
+
+
+def test_results_are_never_served_to_another_user(searches):
+    assert search_as('alice') == ('MISS', ['alice skip 0'])
+    assert search_as('bob') == ('MISS', ['bob skip 0'])
+    assert search_as('alice') == ('HIT', ['alice skip 0'])
+    assert search_as('bob') == ('HIT', ['bob skip 0'])
+    assert len(searches) == 2
+
+
+def test_each_page_is_cached_separately(searches):
+    assert search_as('alice', skip='0') == ('MISS', ['alice skip 0'])
+    assert search_as('alice', skip='10') == ('MISS', ['alice skip 10'])
+    assert search_as('alice', skip='10') == ('HIT', ['alice skip 10'])
+    assert len(searches) == 2
+
+
+def test_shared_store_keeps_users_apart(tmp_path):
+    store = SqliteResultStore(str(tmp_path / 'results.sqlite'), ttl=60)
+    writer, reader = ResultCache(shared_store=store), ResultCache(shared_store=store)
+    _, alice = search_app.build_search({}, 'contract', 'alice')
+    _, bob = search_app.build_search({}, 'contract', 'bob')
+
+    writer.put(alice, ['alice result'], 0.5)
+    assert reader.get(bob) is None
+    assert reader.get(alice) == ['alice result']
+    assert reader.stats()['shared_hits'] == 1
@@ -0,0 +1,147 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+
+import search_client
+from search_client import AsyncAzureSearchClient, CircuitBreaker, CircuitOpenError, SearchServiceError
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(search_client.time, 'monotonic', clock)
+    return clock
+
+
+def test_breaker_opens_after_threshold(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+
+
+def test_breaker_lets_one_trial_through_when_half_open(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.state == 'half-open'
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_breaker_trial_success_closes(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    assert breaker.allow() and breaker.allow()
+
+
+def test_breaker_trial_failure_reopens(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+
+
+def test_breaker_release_frees_the_trial(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == 'half-open'
+    assert breaker.allow()
+
+
+def test_async_cancelled_trial_is_released(clock):
+    class HangingClient(AsyncAzureSearchClient):
+        async def _post_with_retries(self, payload):
+            await asyncio.sleep(10)
+
+    async def main():
+        client = HangingClient('http://search.invalid', 'key', breaker=CircuitBreaker(1, 30))
+        client.breaker.record_failure()
+        clock.now += 30
+        task = asyncio.ensure_future(client.search({}))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return client.breaker.allow()
+
+    assert asyncio.run(main())
+
+
+async def serve(handler):
+    app = web.Application()
+    app.router.add_post('/search', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://127.0.0.1:{port}/search"
+
+
+def search_once(handler, breaker):
+    async def main():
+        runner, url = await serve(handler)
+        client = AsyncAzureSearchClient(url, 'key', max_retries=0, breaker=breaker)
+        try:
+            return await client.search({'search': 'x'})
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    return asyncio.run(main())
+
+
+def test_async_search_returns_body():
+    async def handler(request):
+        return web.json_response({'value': [{'id': 1}]})
+
+    assert search_once(handler, CircuitBreaker()) == {'value': [{'id': 1}]}
+
+
+def test_async_invalid_json_is_a_service_error_and_counts_as_failure(clock):
+    async def handler(request):
+        return web.Response(text='not json')
+
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.now += 30
+    with pytest.raises(SearchServiceError):
+        search_once(handler, breaker)
+    assert breaker.state == 'open'
+    clock.now += 30
+    assert breaker.allow()
+
+
+def test_async_open_circuit_refuses_without_calling():
+    async def handler(request):
+        raise AssertionError('called the service')
+
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        search_once(handler, breaker)
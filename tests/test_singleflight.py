@@ -0,0 +1,192 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+
+from singleflight import AsyncSingleFlight, SingleFlight
+
+
+def run_threads(count, target):
+    results = [None] * count
+
+    def run(i):
+        try:
+            results[i] = target()
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_calls_share_one_execution():
+    flights = SingleFlight('test')
+    calls = []
+
+    def work():
+        calls.append(1)
+        time.sleep(0.2)
+        return 'result'
+
+    assert run_threads(5, lambda: flights.do('key', work)) == ['result'] * 5
+    assert len(calls) == 1
+    assert flights.in_flight() == 0
+
+
+def test_different_keys_run_concurrently():
+    flights = SingleFlight('test')
+    # Only passes if all three calls are running at once
+    barrier = threading.Barrier(3, timeout=5)
+    keys = iter(range(3))
+    lock = threading.Lock()
+
+    def call():
+        with lock:
+            key = next(keys)
+        return flights.do(key, lambda: (barrier.wait(), key)[1])
+
+    assert sorted(run_threads(3, call)) == [0, 1, 2]
+
+
+def test_exception_is_shared_and_next_call_runs_again():
+    flights = SingleFlight('test')
+
+    def fail():
+        time.sleep(0.2)
+        raise ValueError('boom')
+
+    results = run_threads(3, lambda: flights.do('key', fail))
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flights.do('key', lambda: 'fresh') == 'fresh'
+
+
+def test_reentrant_call_runs_directly():
+    flights = SingleFlight('test')
+    assert flights.do('key', lambda: flights.do('key', lambda: 'inner')) == 'inner'
+
+
+def lead_in_process(lock_dir, marker, results):
+    def work():
+        time.sleep(0.5)
+        with open(marker, 'a') as file:
+            file.write('x')
+        return 'computed'
+
+    def recheck():
+        return 'found' if os.path.exists(marker) else None
+
+    results.put(SingleFlight('test', lock_dir).do('key', work, recheck=recheck))
+
+
+def test_lock_dir_serializes_processes_and_rechecks(tmp_path):
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    marker = str(tmp_path / 'marker')
+    processes = [
+        context.Process(target=lead_in_process, args=(str(tmp_path / 'locks'), marker, results))
+        for _ in range(3)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    assert sorted(results.get() for _ in processes) == ['computed', 'found', 'found']
+    with open(marker) as file:
+        assert file.read() == 'x'
+
+
+def test_async_concurrent_calls_share_one_execution():
+    async def main():
+        flights = AsyncSingleFlight('test')
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return 'result'
+
+        results = await asyncio.gather(*[flights.do('key', work) for _ in range(5)])
+        return results, calls, flights.in_flight()
+
+    results, calls, in_flight = asyncio.run(main())
+    assert results == ['result'] * 5
+    assert len(calls) == 1
+    assert in_flight == 0
+
+
+def test_async_exception_is_shared():
+    async def main():
+        flights = AsyncSingleFlight('test')
+
+        async def fail():
+            await asyncio.sleep(0.1)
+            raise ValueError('boom')
+
+        return await asyncio.gather(*[flights.do('key', fail) for _ in range(3)], return_exceptions=True)
+
+    assert all(isinstance(result, ValueError) for result in asyncio.run(main()))
+
+
+def test_async_cancelled_first_caller_does_not_cancel_the_others():
+    async def main():
+        flights = AsyncSingleFlight('test')
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.2)
+            return 'result'
+
+        first = asyncio.ensure_future(flights.do('key', work))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(flights.do('key', work))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second, calls
+
+    result, calls = asyncio.run(main())
+    assert result == 'result'
+    assert len(calls) == 1
+
+
+def test_async_cancelled_follower_does_not_cancel_the_work():
+    async def main():
+        flights = AsyncSingleFlight('test')
+
+        async def work():
+            await asyncio.sleep(0.2)
+            return 'result'
+
+        first = asyncio.ensure_future(flights.do('key', work))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(flights.do('key', work))
+        await asyncio.sleep(0.05)
+        second.cancel()
+        return await first
+
+    assert asyncio.run(main()) == 'result'
+
+
+def test_async_reentrant_call_runs_directly():
+    async def main():
+        flights = AsyncSingleFlight('test')
+
+        async def inner():
+            return 'inner'
+
+        async def outer():
+            return await flights.do('key', inner)
+
+        return await flights.do('key', outer)
+
+    assert asyncio.run(main()) == 'inner'
@@ -0,0 +1,74 @@
+import app as search_app
+from app import SNIPPET_POST_TAG, SNIPPET_PRE_TAG, azure_snippets, trim_snippets
+from highlighter import extract_snippets
+
+
+def words(count, word='filler'):
+    return ' '.join([word] * count)
+
+
+def test_passage_is_a_window_around_the_match_cut_at_words():
+    text = f"{words(30)} contract {words(30)}"
+    # 20 characters either side, narrowed to whole words
+    assert extract_snippets(text, 'contract', window=40) == ['filler filler contract filler filler']
+
+
+def test_nearby_matches_merge_into_one_passage():
+    text = f"{words(30)} contract terms {words(3)} contract {words(30)}"
+    [snippet] = extract_snippets(text, 'contract terms', window=40)
+    assert snippet.count('contract') == 2 and 'terms' in snippet
+
+
+def test_passages_with_most_matches_are_kept_in_text_order():
+    text = ' '.join([
+        'contract', words(40),
+        'terms contract terms', words(40),
+        'contract terms', words(40),
+        'terms'
+    ])
+    snippets = extract_snippets(text, 'contract terms', window=20, max_fragments=2)
+    # The lone first and last matches lose to the passages with three and two
+    assert snippets == ['filler terms contract terms filler', 'filler contract terms filler']
+
+
+def test_no_match_no_passages():
+    assert extract_snippets('nothing here', 'contract') == []
+    assert extract_snippets('', 'contract') == []
+
+
+def test_azure_snippets_strip_tags_and_trim_around_first_match(monkeypatch):
+    monkeypatch.setattr(search_app, 'SNIPPET_WINDOW_CHARS', 20)
+    monkeypatch.setattr(search_app, 'SNIPPET_MAX_FRAGMENTS', 2)
+    fragment = f"{'a' * 30} {SNIPPET_PRE_TAG}contract{SNIPPET_POST_TAG} {'b' * 30}"
+    highlights = [fragment, f"{SNIPPET_PRE_TAG}terms{SNIPPET_POST_TAG} apply", 'third']
+
+    snippets = azure_snippets(highlights)
+    # 20 characters from 10 before the match; the third fragment is over the limit
+    assert snippets == [f"{'a' * 9} contract b", 'terms apply']
+
+
+def result(*snippets):
+    return {'snippets': list(snippets)}
+
+
+def test_trim_keeps_first_passages_of_every_hit_first():
+    results = [result('a' * 10, 'b' * 10), result('c' * 10, 'd' * 10)]
+    trim_snippets(results, 30)
+
+    assert results[0]['snippets'] == ['a' * 10, 'b' * 10]
+    assert results[1]['snippets'] == ['c' * 10]
+    assert results[1]['snippets_truncated'] and 'snippets_truncated' not in results[0]
+
+
+def test_trim_counts_utf8_bytes_and_skips_what_does_not_fit():
+    results = [result('é' * 10), result('x' * 5)]
+    trim_snippets(results, 15)
+    # The 20-byte passage doesn't fit, the smaller one after it still does
+    assert results[0]['snippets'] == [] and results[0]['snippets_truncated']
+    assert results[1]['snippets'] == ['x' * 5]
+
+
+def test_trim_within_limit_changes_nothing():
+    results = [result('a', 'b'), result()]
+    trim_snippets(results, 100)
+    assert results == [result('a', 'b'), result()]
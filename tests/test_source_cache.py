@@ -0,0 +1,164 @@
+import os
+
+import pytest
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceModifiedError, ResourceNotModifiedError
+
+import source_cache
+from source_cache import SourceCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Properties:
+    def __init__(self, etag):
+        self.etag = etag
+
+
+class Downloader:
+    def __init__(self, data, etag):
+        self.data = data
+        self.properties = Properties(etag)
+
+    def readinto(self, stream):
+        stream.write(self.data)
+        return len(self.data)
+
+
+class FakeBlob:
+    """A blob client that honours the conditional downloads SourceCache makes."""
+
+    def __init__(self, blob_name, data, etag):
+        self.blob_name = blob_name
+        self.data = data
+        self.etag = etag
+        self.downloads = []
+
+    def download_blob(self, max_concurrency=1, etag=None, match_condition=None):
+        self.downloads.append(match_condition)
+        if match_condition == MatchConditions.IfModified and etag == self.etag:
+            raise ResourceNotModifiedError("not modified")
+        if match_condition == MatchConditions.IfNotModified and etag != self.etag:
+            raise ResourceModifiedError("modified")
+        return Downloader(self.data, self.etag)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(source_cache.time, 'monotonic', clock)
+    return clock
+
+
+def read(source):
+    with source:
+        return bytes(source.target)
+
+
+def test_miss_then_hit_without_request(tmp_path, clock):
+    cache = SourceCache(str(tmp_path), 1000, revalidate_after=60)
+    blob = FakeBlob('a.pdf', b'version 1', '"1"')
+
+    assert read(cache.open(blob, '"1"')) == b'version 1'
+    clock.now += 59
+    assert read(cache.open(blob, '"1"')) == b'version 1'
+    assert blob.downloads == [MatchConditions.IfNotModified]
+    assert cache.stats()['hits'] == 1
+
+
+def test_revalidates_with_conditional_request_after_interval(tmp_path, clock):
+    cache = SourceCache(str(tmp_path), 1000, revalidate_after=60)
+    blob = FakeBlob('a.pdf', b'version 1', '"1"')
+    cache.open(blob, '"1"').close()
+
+    clock.now += 60
+    assert read(cache.open(blob, '"1"')) == b'version 1'
+    assert blob.downloads == [MatchConditions.IfNotModified, MatchConditions.IfModified]
+    assert cache.stats()['revalidations'] == 1
+    # Validated again, so the next lookup makes no request
+    cache.open(blob, '"1"').close()
+    assert len(blob.downloads) == 2
+
+
+def test_changed_blob_raises_and_caches_new_version(tmp_path, clock):
+    cache = SourceCache(str(tmp_path), 1000, revalidate_after=60)
+    blob = FakeBlob('a.pdf', b'version 1', '"1"')
+    cache.open(blob, '"1"').close()
+
+    blob.data, blob.etag = b'version 2', '"2"'
+    clock.now += 60
+    with pytest.raises(ResourceModifiedError):
+        cache.open(blob, '"1"')
+    assert read(cache.open(blob, '"2"')) == b'version 2'
+    assert len(blob.downloads) == 2
+    assert cache.stats()['entries'] == 1
+
+
+def test_evicts_least_recently_used_over_max_bytes(tmp_path, clock):
+    cache = SourceCache(str(tmp_path), 25)
+    blobs = [FakeBlob(f"{name}.pdf", b'x' * 10, '"1"') for name in 'abc']
+    cache.open(blobs[0], '"1"').close()
+    cache.open(blobs[1], '"1"').close()
+    cache.open(blobs[0], '"1"').close()
+    cache.open(blobs[2], '"1"').close()
+
+    stats = cache.stats()
+    assert stats['evictions'] == 1
+    assert stats['bytes'] == 20
+    # 'b' was least recently used, so it has to be downloaded again
+    cache.open(blobs[0], '"1"').close()
+    cache.open(blobs[1], '"1"').close()
+    assert len(blobs[0].downloads) == 1
+    assert len(blobs[1].downloads) == 2
+
+
+def test_sidecars_count_towards_size_and_go_with_entry(tmp_path, clock):
+    cache = SourceCache(str(tmp_path), 25)
+    blob = FakeBlob('a.pdf', b'x' * 10, '"1"')
+    cache.open(blob, '"1"').close()
+
+    assert cache.write_sidecar('a.pdf', '"1"', '.index', b'y' * 5)
+    assert cache.read_sidecar('a.pdf', '"1"', '.index') == b'y' * 5
+    assert cache.read_sidecar('a.pdf', '"2"', '.index') is None
+    assert not cache.write_sidecar('a.pdf', '"2"', '.index', b'z')
+    assert cache.stats()['bytes'] == 15
+
+    cache.open(FakeBlob('b.pdf', b'x' * 15, '"1"'), '"1"').close()
+    assert cache.read_sidecar('a.pdf', '"1"', '.index') is None
+    assert not any(name.endswith('.index') for name in os.listdir(tmp_path))
+
+
+def test_too_large_file_is_served_but_not_kept(tmp_path, clock):
+    cache = SourceCache(str(tmp_path), 5)
+    source = cache.open(FakeBlob('a.pdf', b'x' * 10, '"1"'), '"1"')
+    assert bytes(source.target) == b'x' * 10
+    source.close()
+    assert os.listdir(tmp_path) == []
+    assert cache.stats()['entries'] == 0
+
+
+def test_reload_after_restart_revalidates_first(tmp_path, clock):
+    blob = FakeBlob('a.pdf', b'version 1', '"1"')
+    SourceCache(str(tmp_path), 1000).open(blob, '"1"').close()
+
+    cache = SourceCache(str(tmp_path), 1000)
+    assert cache.stats()['entries'] == 1
+    assert read(cache.open(blob, '"1"')) == b'version 1'
+    assert blob.downloads == [MatchConditions.IfNotModified, MatchConditions.IfModified]
+
+
+def test_startup_keeps_live_processes_temporary_files(tmp_path):
+    live = tmp_path / f".download-{os.getpid()}-abc"
+    dead = tmp_path / ".download-999999999-abc"
+    old = tmp_path / ".download-abc"
+    for path in (live, dead, old):
+        path.write_bytes(b'partial')
+
+    SourceCache(str(tmp_path), 1000)
+    assert sorted(os.listdir(tmp_path)) == [live.name]